@@ -101,9 +101,7 @@ overview_query_dict = {
     #     "datecols": ["DATE"],
     # },
 }
-overview_data_dict = {}
-for k, v in overview_query_dict.items():
-    overview_data_dict[k] = utils.load_flipside_api_data(v["api"], v["datecols"])
+overview_data_dict = utils.load_flipside_api_data_dict(overview_query_dict)
 overview_data_dict["Fees"] = (
     overview_data_dict["Fees"]
     .copy()
@@ -636,7 +634,7 @@ with defi:
         index=2,
         key="defi_date_range",
     )
-    tx_data, user_data = utils.agg_defi_data(dex_info, date_range)
+    tx_data, user_data = utils.agg_defi_data(dex_info, utils.get_defi_dataset(), date_range)
     c1, c2 = st.columns(2)
     chart = (
         alt.Chart(tx_data, title=f"DeFi Transactions by Protocol: Daily, Past {date_range}")
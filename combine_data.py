@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 import datetime
 import gc
-import json
 import logging
 import time
-from itertools import combinations
 from pathlib import Path
 
 import networkx as nx
 import numpy as np
 import pandas as pd
-import requests
 import streamlit as st
 
+import spire_fyi.addresses as addresses
+import spire_fyi.http_client as http_client
+import spire_fyi.incremental as incremental
+import spire_fyi.labels as labels
+import spire_fyi.leaderboard as leaderboard
+import spire_fyi.network as network
+import spire_fyi.nft_metadata as nft_metadata
+import spire_fyi.sketches as sketches
+import spire_fyi.store as store
 import spire_fyi.utils as utils
+import spire_fyi.xnft_snapshot as xnft_snapshot
 
 helius_key = st.secrets["helius"]["api_key"]
 
@@ -28,131 +35,25 @@ def get_labeled_program_df(df, programs):
     return all_programs_df
 
 
-def get_net_and_programs(labeled_programs, signers, label, cutoff_date):
+def get_net_and_programs(labeled_programs, last_seen, label, cutoff_date, signer_sketches=None):
     programs_labeled = labeled_programs.copy()[labeled_programs.LABEL != "solana"]
     programs_labeled = programs_labeled[programs_labeled.Date >= cutoff_date]
     programs = utils.get_program_ids(programs_labeled)
 
-    df = signers.copy()
-    df["Date"] = pd.to_datetime(df.Date)
-    df = df[df.Date >= cutoff_date]
-    df = df[df["Program ID"].isin(programs)]
+    labels = programs_labeled.groupby("PROGRAM_ID").Name.first()
+    names = labels.reindex(programs).fillna(pd.Series(programs, index=programs))
 
-    combos = list(combinations(programs, 2))
-
-    labels = programs_labeled.groupby("PROGRAM_ID").Name.first().reset_index()
-    df = df.merge(labels.rename(columns={"PROGRAM_ID": "Program ID"}), on="Program ID")
-
-    prog_user_dict = {}
-    for x in programs:
-        try:
-            prog_user_dict[x] = (
-                df[df["Program ID"] == x].Name.iloc[0],
-                df[df["Program ID"] == x].Address.unique(),
-            )
-        except IndexError:
-            print(x)
-            prog_user_dict[x] = (
-                x,
-                np.array([]),
-            )
-
-    df_list = []
-    for i, j in combos:
-        name1, prog1_users = prog_user_dict[i]
-        name2, prog2_users = prog_user_dict[j]
-        if len(prog1_users) < 10 or len(prog2_users) < 10:
-            continue
-        else:
-            all_users = np.union1d(prog1_users, prog2_users)
-            overlap = np.intersect1d(prog1_users, prog2_users, assume_unique=True)
-
-            n_users = len(all_users)
-            n_overlap = len(overlap)
-
-            df_dict = {}
-            df_dict["Program1"] = i
-            df_dict["Program2"] = j
-            df_dict["Name1"] = name1
-            df_dict["Name2"] = name2
-            df_dict["weight"] = n_overlap / n_users
-            df_dict["Timedelta"] = label
-
-            df_list.append(df_dict)
-    net_df = pd.DataFrame(df_list)
+    if signer_sketches is None:
+        incidence = network.get_window_incidence(*last_seen, programs, cutoff_date)
+        net_df = network.get_overlap_network(incidence, programs, names)
+    else:
+        window_sketches = signer_sketches[pd.to_datetime(signer_sketches.DATE) >= cutoff_date]
+        net_df = sketches.get_similarity_network(window_sketches, programs, names)
+    net_df["Timedelta"] = label
 
     return net_df, programs
 
 
-def get_top_creator_info(creators):
-    data = {"creator_address": "", "creator_share": 0}
-    for x in creators:
-        if x["share"] > data["creator_share"]:
-            data["creator_share"] = x["share"]
-            data["creator_address"] = x["address"]
-    return data
-
-
-def get_important_metadata(enumerated_splits, filehandle):
-    url = f"https://api.helius.xyz/v0/tokens/metadata?api-key={helius_key}"
-    important_metadata = []
-    mints_no_metadata = []
-    for i, x in enumerated_splits:
-        if i % 100 == 0:
-            logging.info(f"Working on request {i}")
-        mints = x.tolist()
-        r = requests.post(url, json={"mintAccounts": mints})
-        metadata = r.json()
-        for y in metadata:
-            mint = y["mint"]
-            filehandle.write(f"{mint}\n")
-            try:
-                onchain = y["onChainData"]
-                onchaindata = onchain["data"]
-            except:
-                mints_no_metadata.append(mint)
-                continue
-
-            try:
-                name = onchaindata["name"]
-            except:
-                name = ""
-            try:
-                symbol = onchaindata["symbol"]
-            except:
-                symbol = ""
-            try:
-                seller_fee_basis_points = onchaindata["sellerFeeBasisPoints"]
-            except:
-                seller_fee_basis_points = 0
-            try:
-                uri = onchaindata["uri"]
-            except:
-                uri = ""
-            try:
-                update_authority = onchain["updateAuthority"]
-            except:
-                update_authority = ""
-            try:
-                creator_info = get_top_creator_info(onchaindata["creators"])
-            except:
-                creator_info = {"creator_address": "", "creator_share": 0}
-
-            data = {
-                "mint": mint,
-                "name": name,
-                "symbol": symbol,
-                "seller_fee_basis_points": seller_fee_basis_points,
-                "uri": uri,
-                "update_authority": update_authority,
-                **creator_info,
-            }
-            with open(f"data/nft_metadata/{mint}.json", "w") as f:
-                json.dump(data, f)
-            important_metadata.append(data)
-    return pd.DataFrame(important_metadata), mints_no_metadata
-
-
 def fix_carriage_return_error(df):
     """There is a `\r` character in some NFT metadata, which breaks parsing.
     Hack to fix this
@@ -254,147 +155,138 @@ def get_collection_name(row):
 
 # #TODO: add to cli
 if __name__ == "__main__":
+    do_parquet_migration = False
     do_main = True
+    do_incremental = True  # only fold in new query output, set False to rebuild everything
+    refresh_labels = False  # refetch every label rather than only new ones and those past labels.LABEL_TTL
     do_network = False
+    network_from_sketches = False  # estimate the network weights from MinHash sketches instead of exactly
     do_nft = False
     combine_nft = False
     do_xnft = True
+    do_xnft_snapshot = False  # every account of the xNFT program, straight from RPC
     do_fees = True
     do_madlad_metadata = False
     do_staking_report = True
+    label_ttl = datetime.timedelta(0) if refresh_labels else None
 
-    if do_main:
-        program_df = utils.combine_flipside_date_data("data/sdk_programs_sol", add_date=False)
-        program_df.to_csv("data/programs.csv.gz", index=False, compression="gzip")
-        utils.get_flipside_labels(program_df, "program", "PROGRAM_ID")
-        utils.get_solana_fm_labels(program_df, "program", "PROGRAM_ID")
-
-        labeled_program_df = utils.add_program_labels(program_df)
-        labeled_program_df.to_csv("data/programs_labeled.csv.gz", index=False, compression="gzip")
-
-        # New users only
-        program_new_users_df = utils.combine_flipside_date_data(
-            "data/sdk_programs_new_users_sol", add_date=False
-        )
-        program_new_users_df.to_csv("data/programs_new_users.csv.gz", index=False, compression="gzip")
-        utils.get_flipside_labels(program_new_users_df, "program_new_users", "PROGRAM_ID")
-        utils.get_solana_fm_labels(program_new_users_df, "program_new_users", "PROGRAM_ID")
+    if do_parquet_migration:
+        # One-time conversion of per-date CSV query output to the partitioned parquet dataset
+        for x in sorted(Path("data").glob("sdk_*")):
+            if x.is_dir() and not store.has_flipside_dataset(x.name):
+                n = store.migrate_csv_dir(x)
+                logging.info(f"#@# Migrated {n} files from {x} to {store.FLIPSIDE_DATASET_DIR}")
 
-        labeled_program_new_users_df = utils.add_program_labels(program_new_users_df)
-        labeled_program_new_users_df.to_csv(
-            "data/programs_new_users_labeled.csv.gz", index=False, compression="gzip"
-        )
+    if do_main:
+        label_store = labels.LabelStore()
+        if len(label_store) == 0:
+            # One-time load of the per-dataset label csvs into the label store
+            label_store.import_csvs()
+        label_store.upsert(pd.read_csv("data/program_manual_labels.csv"), "manual", replace=True)
+        label_store.close()
+
+        state = incremental.CombineState()
+        full_rebuild = not do_incremental
+
+        program_datasets = [
+            ("sdk_programs_sol", "programs", "program"),
+            ("sdk_programs_new_users_sol", "programs_new_users", "program_new_users"),
+            ("sdk_programs_all_signers_sol", "programs_all_signers", "program_all_signers"),
+            (
+                "sdk_programs_new_users_all_signers_sol",
+                "programs_new_users_all_signers",
+                "program_new_users_all_signers",
+            ),
+        ]
+        for template, output_basename, label_prefix in program_datasets:
+            output_file = f"data/{output_basename}.csv.gz"
+            labeled_output_file = f"data/{output_basename}_labeled.csv.gz"
+            program_df, partitions, full = incremental.read_new_partitions(
+                f"data/{template}", [output_file, labeled_output_file], state, full=full_rebuild
+            )
+            if len(program_df) > 0:
+                # Only addresses without a label from each source, or with a stale one, are fetched
+                utils.get_flipside_labels(program_df, label_prefix, "PROGRAM_ID", ttl=label_ttl)
+                utils.get_solana_fm_labels(program_df, label_prefix, "PROGRAM_ID", ttl=label_ttl)
+            if full:
+                program_df.to_csv(output_file, index=False, compression="gzip")
+                labeled_program_df = utils.add_program_labels(program_df)
+                labeled_program_df.to_csv(labeled_output_file, index=False, compression="gzip")
+                store.write_feather(labeled_program_df, labeled_output_file)
+                del labeled_program_df
+            elif len(program_df) > 0:
+                # #TODO: refreshed labels are only applied to already labeled rows on a full rebuild
+                incremental.append_csv(program_df, output_file)
+                incremental.append_csv(utils.add_program_labels(program_df), labeled_output_file)
+            state.mark(output_file, partitions)
+            state.mark(labeled_output_file, partitions)
+            # Rebuilt every run, since its date ranges end today
+            leaderboard.write_cube(
+                leaderboard.build_cube(store.read_output(labeled_output_file, leaderboard.COLUMNS)),
+                labeled_output_file,
+            )
+        del program_df
         # ------
-        program_all_signers_df = utils.combine_flipside_date_data(
-            "data/sdk_programs_all_signers_sol", add_date=False
-        )
-        program_all_signers_df.to_csv("data/programs_all_signers.csv.gz", index=False, compression="gzip")
-        utils.get_flipside_labels(program_all_signers_df, "program_all_signers", "PROGRAM_ID")
-        utils.get_solana_fm_labels(program_all_signers_df, "program_all_signers", "PROGRAM_ID")
-
-        labeled_program_all_signers_df = utils.add_program_labels(program_all_signers_df)
-        labeled_program_all_signers_df.to_csv(
-            "data/programs_all_signers_labeled.csv.gz", index=False, compression="gzip"
-        )
-
-        # New users only
-        program_new_users_all_signers_df = utils.combine_flipside_date_data(
-            "data/sdk_programs_new_users_all_signers_sol", add_date=False
-        )
-        program_new_users_all_signers_df.to_csv(
-            "data/programs_new_users_all_signers.csv.gz", index=False, compression="gzip"
-        )
-        utils.get_flipside_labels(
-            program_new_users_all_signers_df, "program_new_users_all_signers", "PROGRAM_ID"
-        )
-        utils.get_solana_fm_labels(
-            program_new_users_all_signers_df, "program_new_users_all_signers", "PROGRAM_ID"
-        )
 
-        labeled_program_new_users_all_signers_df = utils.add_program_labels(program_new_users_all_signers_df)
-        labeled_program_new_users_all_signers_df.to_csv(
-            "data/programs_new_users_all_signers_labeled.csv.gz", index=False, compression="gzip"
+        users_file = "data/users.csv.gz"
+        user_df, partitions, full = incremental.read_new_partitions(
+            "data/sdk_new_users_sol",
+            [users_file, incremental.WEEKLY_USER_BUCKETS_FILE],
+            state,
+            full=full_rebuild,
         )
-        # ------
-
-        user_df = utils.combine_flipside_date_data("data/sdk_new_users_sol", add_date=False)
         datecols = ["CREATION_DATE", "LAST_USE"]
-        user_df[datecols] = user_df[datecols].apply(pd.to_datetime)
-        last30d_users = user_df[user_df.CREATION_DATE > (datetime.datetime.today() - pd.Timedelta("31d"))]
-        user_df.to_csv("data/users.csv.gz", index=False, compression="gzip")
+        if len(user_df) > 0:
+            user_df[datecols] = user_df[datecols].apply(pd.to_datetime)
+        if full:
+            user_df.to_csv(users_file, index=False, compression="gzip")
+            weekly_user_buckets = incremental.update_weekly_user_buckets(user_df)
+        else:
+            incremental.append_csv(user_df, users_file)
+            weekly_user_buckets = pd.read_csv(incremental.WEEKLY_USER_BUCKETS_FILE, parse_dates=["bucket"])
+            if len(user_df) > 0:
+                weekly_user_buckets = incremental.update_weekly_user_buckets(user_df, weekly_user_buckets)
+        weekly_user_buckets.to_csv(incremental.WEEKLY_USER_BUCKETS_FILE, index=False)
+        state.mark(users_file, partitions)
+        state.mark(incremental.WEEKLY_USER_BUCKETS_FILE, partitions)
+
+        last30d_cutoff = datetime.datetime.today() - pd.Timedelta("31d")
+        last30d_users = utils.combine_flipside_date_data(
+            "data/sdk_new_users_sol", start_date=last30d_cutoff.date()
+        )
+        last30d_users[datecols] = last30d_users[datecols].apply(pd.to_datetime)
+        last30d_users = last30d_users[last30d_users.CREATION_DATE > last30d_cutoff]
         last30d_users.to_csv("data/last30d_users.csv.gz", index=False, compression="gzip")
 
-        user_df["Days since last use"] = (datetime.datetime.today() - pd.Timedelta("1d")) - user_df.LAST_USE
-
-        grouped = (
-            user_df.groupby(pd.Grouper(key="CREATION_DATE", axis=0, freq="7d")).ADDRESS.count().reset_index()
-        )
-        grouped.to_csv("data/weekly_users.csv", index=False)
-        grouped = user_df.groupby(pd.Grouper(key="LAST_USE", axis=0, freq="7d")).ADDRESS.count().reset_index()
-        grouped.to_csv("data/weekly_users_last_use.csv", index=False)
-
-        user_df["Days since last use"] = (
-            ((datetime.datetime.today() - pd.Timedelta("1d")) - user_df.LAST_USE).dt.total_seconds()
-            / 3600
-            / 24
-        )
-        grouped = (
-            user_df.groupby(pd.Grouper(key="CREATION_DATE", axis=0, freq="7d"))["Days since last use"]
-            .mean()
-            .reset_index()
-        )
-        grouped["Days since creation"] = (
-            ((datetime.datetime.today() - pd.Timedelta("1d")) - grouped.CREATION_DATE).dt.total_seconds()
-            / 3600
-            / 24
-        )
-        grouped.to_csv("data/weekly_days_since_last_use.csv", index=False)
-
-        user_df["Days Active"] = (user_df.LAST_USE - user_df.CREATION_DATE).dt.total_seconds() / 3600 / 24
-        grouped = (
-            user_df.groupby(pd.Grouper(key="CREATION_DATE", axis=0, freq="7d"))["Days Active"]
-            .mean()
-            .reset_index()
-        )
-        grouped.to_csv("data/weekly_days_active.csv", index=False)
-
-        weekly_program_data = utils.combine_flipside_date_data(
-            "data/sdk_weekly_program_count_sol", add_date=False
-        )
-        weekly_program_data.to_csv("data/weekly_program.csv", index=False)
-
-        weekly_new_program_data = utils.combine_flipside_date_data(
-            "data/sdk_weekly_new_program_count_sol", add_date=False
-        )
-        weekly_new_program_data.to_csv("data/weekly_new_program.csv", index=False)
-
-        weekly_user_data = utils.combine_flipside_date_data("data/sdk_weekly_users_sol", add_date=False)
-        weekly_user_data.to_csv("data/weekly_users.csv", index=False)
-        weekly_new_user_data = utils.combine_flipside_date_data(
-            "data/sdk_weekly_new_users_sol", add_date=False
-        )
-        weekly_new_user_data.to_csv("data/weekly_new_users.csv", index=False)
-
-        weekly_user_all_signers_data = utils.combine_flipside_date_data(
-            "data/sdk_weekly_users_all_signers_sol", add_date=False
-        )
-        weekly_user_all_signers_data.to_csv("data/weekly_users_all_signers.csv", index=False)
-        weekly_new_user_all_signers_data = utils.combine_flipside_date_data(
-            "data/sdk_weekly_new_users_all_signers_sol", add_date=False
-        )
-        weekly_new_user_all_signers_data.to_csv("data/weekly_new_users_all_signers.csv", index=False)
-
-        dex_new_users = utils.combine_flipside_date_data("data/sdk_dex_new_users", add_date=False)
-        dex_new_users.to_csv("data/dex_new_users.csv", index=False)
-
-        dex = utils.combine_flipside_date_data("data/sdk_dex", add_date=False)
-        dex.to_csv("data/dex_info.csv", index=False)
-
-        signers_fee_payers = utils.combine_flipside_date_data("data/sdk_openbook_users", add_date=False)
-        signers_fee_payers.to_csv("data/dex_signers_fee_payers.csv", index=False)
+        weekly_user_stats = incremental.get_weekly_user_stats(weekly_user_buckets, datetime.datetime.today())
+        for name, grouped in weekly_user_stats.items():
+            grouped.to_csv(f"data/{name}.csv", index=False)
+
+        weekly_datasets = [
+            ("sdk_weekly_program_count_sol", "weekly_program", ["WEEK"]),
+            ("sdk_weekly_new_program_count_sol", "weekly_new_program", ["WEEK"]),
+            ("sdk_weekly_users_sol", "weekly_users", ["WEEK"]),
+            ("sdk_weekly_new_users_sol", "weekly_new_users", ["WEEK"]),
+            ("sdk_weekly_users_all_signers_sol", "weekly_users_all_signers", ["WEEK"]),
+            ("sdk_weekly_new_users_all_signers_sol", "weekly_new_users_all_signers", ["WEEK"]),
+            ("sdk_dex_new_users", "dex_new_users", ["FIRST_TX_DATE", "PROGRAM_ID", "DEX"]),
+            ("sdk_dex", "dex_info", ["DATE", "DEX"]),
+            ("sdk_openbook_users", "dex_signers_fee_payers", ["TYPE", "DATE", "DEX"]),
+        ]
+        for template, output_basename, key in weekly_datasets:
+            output_file = f"data/{output_basename}.csv"
+            weekly_df, partitions, full = incremental.read_new_partitions(
+                f"data/{template}", [output_file], state, full=full_rebuild, replace=True
+            )
+            if full:
+                weekly_df.to_csv(output_file, index=False)
+            else:
+                incremental.merge_csv(weekly_df, output_file, key, template)
+            state.mark(output_file, partitions)
 
         # #---
-        # #TODO: need to divide the ~500k+ addresses into ~10 queries to add labels, if necessary
+        # #TODO: solana.fm labels for the ~500k+ addresses are fetched concurrently now, but the Flipside
+        # labels still need dividing into ~10 queries, if necessary
         # utils.get_flipside_labels(last30d_users, "user", "ADDRESS")
         # utils.get_solana_fm_labels(last30d_users, "user", "ADDRESS")
 
@@ -403,25 +295,61 @@ if __name__ == "__main__":
         # #---
 
     if do_network:
-        signers_by_programID = utils.combine_flipside_date_data(
-            "data/sdk_signers_by_programID_sol", add_date=True, with_program=True
-        ).rename(columns={"DATE": "Date", "PROGRAM_ID": "Program ID", "SIGNERS": "Address"})
-        signers_by_programID.to_csv("data/signers_by_programID.csv.gz", compression="gzip", index=False)
-
-        signers_by_programID_new_users = utils.combine_flipside_date_data(
-            "data/sdk_signers_by_programID_new_users_sol", add_date=True, with_program=True
-        ).rename(columns={"DATE": "Date", "PROGRAM_ID": "Program ID", "SIGNERS": "Address"})
-        signers_by_programID_new_users.to_csv(
-            "data/signers_by_programID_new_users.csv.gz", compression="gzip", index=False
-        )
-
+        state = incremental.CombineState()
+        network_start_date = datetime.date.today() - datetime.timedelta(days=91)
+        # Last date each signer used each program over the longest window, updated with only the new days
+        # Signers are stored as address IDs in the last seen tables
+        address_ids = addresses.AddressDictionary()
+        last_seen_matrices = {}
+        signer_sketches = {}
+        for template, output_file, sketch_file in [
+            (
+                "sdk_signers_by_programID_sol",
+                "data/signers_by_programID_last_seen.parquet",
+                sketches.SIGNER_SKETCHES_FILE,
+            ),
+            (
+                "sdk_signers_by_programID_new_users_sol",
+                "data/signers_by_programID_new_users_last_seen.parquet",
+                sketches.SIGNER_SKETCHES_NEW_USERS_FILE,
+            ),
+        ]:
+            signers, partitions, full = incremental.read_new_partitions(
+                f"data/{template}",
+                [output_file],
+                state,
+                full=not do_incremental,
+                replace=True,
+                add_date=True,
+                start_date=network_start_date,
+            )
+            if len(signers) > 0:
+                # Per program per day sketches, kept for all dates rather than just the network window
+                signer_sketches[template] = sketches.update_sketches(
+                    sketches.build_sketches(signers), sketch_file
+                )
+                signers["SIGNERS"] = address_ids.encode(signers.SIGNERS)
+            elif sketch_file.exists():
+                signer_sketches[template] = pd.read_parquet(sketch_file)
+            signers = signers.rename(
+                columns={"DATE": "Date", "PROGRAM_ID": "Program ID", "SIGNERS": "Address"}
+            )
+            last_seen = None if full else pd.read_parquet(output_file)
+            last_seen = network.update_last_seen(signers, last_seen, start_date=network_start_date)
+            last_seen.to_parquet(output_file, index=False)
+            state.mark(output_file, partitions)
+            last_seen_matrices[template] = network.get_last_seen_matrix(last_seen)
+        address_ids.save()
+        del signers
+        del last_seen
+
+        labeled_program_df = pd.read_csv("data/programs_labeled.csv.gz")
         labeled_program_df["Date"] = pd.to_datetime(labeled_program_df.Date)
-        labeled_program_df["Name"] = labeled_program_df.apply(utils.apply_program_name, axis=1)
+        labeled_program_df["Name"] = utils.get_program_names(labeled_program_df)
 
+        labeled_program_new_users_df = pd.read_csv("data/programs_new_users_labeled.csv.gz")
         labeled_program_new_users_df["Date"] = pd.to_datetime(labeled_program_new_users_df.Date)
-        labeled_program_new_users_df["Name"] = labeled_program_new_users_df.apply(
-            utils.apply_program_name, axis=1
-        )
+        labeled_program_new_users_df["Name"] = utils.get_program_names(labeled_program_new_users_df)
 
         cutoff_dates = [
             ("7d", datetime.datetime.today() - pd.Timedelta("8d")),
@@ -440,13 +368,25 @@ if __name__ == "__main__":
             print(cutoff_date)
             print("#@# all programs")
             net_df, programs = get_net_and_programs(
-                labeled_program_df, signers_by_programID, label, cutoff_date
+                labeled_program_df,
+                last_seen_matrices["sdk_signers_by_programID_sol"],
+                label,
+                cutoff_date,
+                signer_sketches.get("sdk_signers_by_programID_sol") if network_from_sketches else None,
             )
             net_dfs.append(net_df)
             all_programs.extend(list(programs))
             print("#@# new users only")
             net_df_new_users, programs_new_users = get_net_and_programs(
-                labeled_program_new_users_df, signers_by_programID_new_users, label, cutoff_date
+                labeled_program_new_users_df,
+                last_seen_matrices["sdk_signers_by_programID_new_users_sol"],
+                label,
+                cutoff_date,
+                (
+                    signer_sketches.get("sdk_signers_by_programID_new_users_sol")
+                    if network_from_sketches
+                    else None
+                ),
             )
             net_dfs_new_users.append(net_df_new_users)
             all_programs_new_users.extend(list(programs_new_users))
@@ -467,20 +407,16 @@ if __name__ == "__main__":
     if do_nft:
         if do_main:
             # Clear memory so this runs on my laptop
-            del program_df
-            del labeled_program_df
-            del program_new_users_df
-            del labeled_program_new_users_df
             del user_df
             del last30d_users
-            del grouped
-            del weekly_program_data
-            del weekly_new_program_data
-            del weekly_user_data
-            del weekly_new_user_data
+            del weekly_user_buckets
+            del weekly_user_stats
+            del weekly_df
         if do_network:
-            del signers_by_programID
-            del signers_by_programID_new_users
+            del labeled_program_df
+            del labeled_program_new_users_df
+            del last_seen_matrices
+            del signer_sketches
             del all_net_df
             del all_programs_df
             del all_net_df_new_users
@@ -493,30 +429,12 @@ if __name__ == "__main__":
         nft_mints_df = nft_mints_df[nft_mints_df["BLOCK_TIMESTAMP"] >= "2022-10-07"]
         all_mints = sorted(nft_mints_df.MINT.astype(str).unique())
 
-        checked_for_metadata_file = "data/checked_for_metadata.txt"
-        with open("data/checked_for_metadata.txt", "r+") as f:
-            completed_metadata = [x.strip() for x in f]
-            mints_to_check = np.setdiff1d(all_mints, completed_metadata)
-
-            n_splits = np.ceil(len(mints_to_check) / 100)
-            if n_splits == 0:
-                logging.info("#@# No new mints to  check")
-            else:
-                all_mint_splits = np.array_split(mints_to_check, n_splits)
-                logging.info(
-                    f"#@# Using Helius get metadata for {len(mints_to_check)} of {len(all_mints)} divided into {len(all_mint_splits)} requests..."
-                )
-                all_mints_metadata, mints_no_metadata = get_important_metadata(enumerate(all_mint_splits), f)
-                # #TODO: remove, not necessary:
-                # with open("data/mints_no_metadata.txt", "w") as f:
-                #     f.writelines(f"{x}\n" for x in mints_no_metadata)
-        if len(mints_to_check) != len(all_mints):
-            json_data = []
-            for x in Path("data/nft_metadata").glob("*.json"):
-                with open(x) as f:
-                    data = json.load(f)
-                    json_data.append(data)
-            all_mints_metadata = pd.DataFrame(json_data)
+        metadata_table = nft_metadata.NftMetadataTable()
+        if not metadata_table.path.exists() and Path("data/checked_for_metadata.txt").exists():
+            # One-time conversion of the per-mint json files
+            metadata_table.import_legacy()
+        nft_metadata.ingest(all_mints, helius_key, table=metadata_table)
+        all_mints_metadata = metadata_table.read()
         all_mints_metadata.to_csv("data/nft_mints_metadata.csv.gz", compression="gzip", index=False)
 
         nft_mints_df = nft_mints_df.merge(
@@ -598,34 +516,36 @@ if __name__ == "__main__":
         metadata_df = metadata_df[metadata_df.unique_collection.isin(top_collections.unique_collection)]
 
         # manual labeled collections from the above dataset
-        labels = pd.read_csv("data/labeled_collections_by_uri.csv")  # #TODO: need to manually update this
-        metadata_df = metadata_df.merge(labels, on="unique_collection", how="left")
+        # #TODO: need to manually update this
+        collection_labels = pd.read_csv("data/labeled_collections_by_uri.csv")
+        metadata_df = metadata_df.merge(collection_labels, on="unique_collection", how="left")
         x = metadata_df[metadata_df.Name.isna()]
         assert len(x) == 0
         metadata_df.to_csv(
             "data/top_nft_sales_metadata_with_royalties.csv.gz", compression="gzip", index=False
         )
+        store.write_feather(metadata_df, "data/top_nft_sales_metadata_with_royalties.csv.gz")
+
+    if do_xnft_snapshot:
+        xnft_snapshot.write_snapshot(xnft_snapshot.get_snapshot(utils.rpc_url))
 
     if do_xnft:
-        xnft_df = pd.read_csv("data/sdk_xnft/sdk_xnft_2022-12-01.csv")
+        xnft_df = utils.combine_flipside_date_data("data/sdk_xnft")
         createInstall = xnft_df[xnft_df["INSTRUCTION_TYPE"] == "createInstall"].reset_index(drop=True)
 
         xnfts = createInstall.XNFT.unique()
         xnft_info = utils.get_xnft_info(xnfts)
         xnft_info_df = utils.create_xnft_info_df(xnft_info)
-        xnft_info_df = xnft_info_df[
-            xnft_info_df.columns.drop(["bump", "reserved0", "reserved1", "reserved2"])
-        ]
         xnft_info_df = utils.add_uri_info(xnft_info_df)
 
         merged_xnft = createInstall.merge(xnft_info_df, on="XNFT")
 
         mad_lad_df = pd.read_csv("data/mad_lad.csv").rename(columns={"mint": "MINT"})
-        mint_df = pd.read_csv("data/sdk_madlist/sdk_madlist_2022-12-01.csv")
+        mint_df = utils.combine_flipside_date_data("data/sdk_madlist")
         merged_mad_lad = mad_lad_df.merge(mint_df, on="MINT", how="left")
         merged_mad_lad.to_csv("data/mad_lad_all.csv", index=False)
 
-        xnft_new_users = pd.read_csv("data/sdk_xnft_new_users/sdk_xnft_new_users_2022-12-01.csv")
+        xnft_new_users = utils.combine_flipside_date_data("data/sdk_xnft_new_users")
         # TODO: any aggregation?
         xnft_new_users.to_csv("data/xnft_new_users.csv", index=False)
 
@@ -651,7 +571,7 @@ if __name__ == "__main__":
 
     if do_madlad_metadata:
         data = []
-        rarity_data = requests.get("https://api.howrare.is/v0.1/collections/madlads").json()
+        rarity_data = http_client.get_json("https://api.howrare.is/v0.1/collections/madlads")
         collection = rarity_data["result"]["data"]["collection"]
         for x in rarity_data["result"]["data"]["items"]:
             d = {
@@ -675,7 +595,7 @@ if __name__ == "__main__":
     if do_staking_report:
         stakers_df = utils.combine_flipside_date_data("data/sdk_top_stakers_by_date_sol", add_date=True)
         all_staker_addresses = stakers_df.rename(columns={"STAKER": "ADDRESS"})
-        utils.get_solana_fm_labels(all_staker_addresses, "stakers", "ADDRESS")
+        utils.get_solana_fm_labels(all_staker_addresses, "stakers", "ADDRESS", ttl=label_ttl)
         labeled_stakers = utils.add_program_labels(
             all_staker_addresses,
             left_on="ADDRESS",
@@ -685,9 +605,7 @@ if __name__ == "__main__":
             drop=[],
             sfm_only=True,
         )
-        labeled_stakers["Name"] = labeled_stakers.apply(
-            utils.apply_program_name, axis=1, address_col="ADDRESS"
-        )
+        labeled_stakers["Name"] = utils.get_program_names(labeled_stakers, address_col="ADDRESS")
         labeled_stakers["Rank"] = labeled_stakers.groupby("DATE")["TOTAL_STAKE"].rank(ascending=False)
         labeled_stakers["Diff"] = labeled_stakers.groupby(["ADDRESS"]).Rank.diff()
         labeled_stakers["DATE"] = pd.to_datetime(labeled_stakers["DATE"])
@@ -707,14 +625,15 @@ if __name__ == "__main__":
             lst_delta_df.loc[lst_delta_df["TOKEN"] == token, "SYMBOL"] = symbol
         lst_delta_df = lst_delta_df.sort_values(by=["ADDRESS", "TOKEN", "DATE"]).reset_index(drop=True)
         lst_delta_df.to_csv("data/liquid_staking_token_holders_delta.csv", index=False)
+        store.write_feather(lst_delta_df, "data/liquid_staking_token_holders_delta.csv")
+
+        # Group and join on address IDs, only decoding back to strings for the output files
+        address_ids = addresses.AddressDictionary()
+        lst_delta_df["ADDRESS"] = address_ids.encode(lst_delta_df.ADDRESS)
 
         max_date = lst_delta_df.DATE.max()
-        results = []
-        for x in lst_delta_df.ADDRESS.unique():
-            df = lst_delta_df[lst_delta_df.ADDRESS == x]
-            for y in df.TOKEN.unique():
-                results.append(df[df.TOKEN == y].DATE.idxmax())
-        lst_delta_df_copy = lst_delta_df.iloc[results].copy()
+        results = lst_delta_df.groupby(["ADDRESS", "TOKEN"]).DATE.idxmax()
+        lst_delta_df_copy = lst_delta_df.loc[results].copy()
         lst_delta_df_copy["DATE"] = max_date
         lst_df = pd.concat([lst_delta_df, lst_delta_df_copy])
 
@@ -728,13 +647,7 @@ if __name__ == "__main__":
             .resample("D")
             .ffill()
         )
-        lst_df = (
-            s.droplevel(["ADDRESS", "TOKEN", "TOKEN_NAME", "SYMBOL"])
-            .reset_index()
-            # .sort_values(by=["DATE", "ADDRESS", "TOKEN"])
-            .sort_values(by=["ADDRESS", "TOKEN", "DATE"])
-            .reset_index(drop=True)
-        )
+        lst_df = s.droplevel(["ADDRESS", "TOKEN", "TOKEN_NAME", "SYMBOL"]).reset_index()
         #     lst_df = lst_df.join(
         #         labeled_stakers['ADDRESS', 'TOTAL_STAKE', 'ADDRESS_NAME', 'LABEL', 'LABEL_SUBTYPE',
         #    'LABEL_TYPE', 'DATE', 'FriendlyName', 'Abbreviation', 'Category',
@@ -742,23 +655,31 @@ if __name__ == "__main__":
         #    'Diff']
         #     )
 
-        lst_df.to_csv("data/liquid_staking_token_holders.csv.gz", index=False, compression="gzip")
+        lst_df_out = (
+            lst_df.assign(ADDRESS=address_ids.decode(lst_df.ADDRESS))
+            # .sort_values(by=["DATE", "ADDRESS", "TOKEN"])
+            .sort_values(by=["ADDRESS", "TOKEN", "DATE"]).reset_index(drop=True)
+        )
+        lst_df_out.to_csv("data/liquid_staking_token_holders.csv.gz", index=False, compression="gzip")
+        store.write_feather(lst_df_out, "data/liquid_staking_token_holders.csv.gz")
+        del lst_df_out
 
         # Combine the two datasets
         staking_combined_df = lst_df.merge(
-            labeled_stakers,
+            labeled_stakers.assign(ADDRESS=address_ids.encode(labeled_stakers.ADDRESS)),
             how="outer",
             on=["DATE", "ADDRESS"],
             #   right_on=['DATE', 'ADDRESS']
         )
+        staking_combined_df["ADDRESS"] = address_ids.decode(staking_combined_df.ADDRESS)
+        address_ids.save()
         # get rid of na's in Name
-        staking_combined_df["Name"] = staking_combined_df.apply(
-            utils.apply_program_name, axis=1, address_col="ADDRESS"
-        )
+        staking_combined_df["Name"] = utils.get_program_names(staking_combined_df, address_col="ADDRESS")
         staking_combined_df["Explorer URL"] = staking_combined_df.ADDRESS.apply(
             lambda x: f"https://solana.fm/address/{x}"
         )
         staking_combined_df.to_csv("data/staking_combined.csv.gz", index=False, compression="gzip")
+        store.write_feather(staking_combined_df, "data/staking_combined.csv.gz")
 
         # #NOTE: probably dont need this, can just use the delta table
         # lst_delta_df = lst_delta_df.rename(columns={"Date": "DATE", "WALLET": "ADDRESS"})
@@ -769,3 +690,5 @@ if __name__ == "__main__":
         #     #   right_on=['Date', 'WALLET']
         # )
         # staking_delta_combined.to_csv("data/staking_delta_combined.csv.gz", index=False, compression="gzip")
+
+    http_client.metrics.log_summary()
@@ -76,11 +76,7 @@ date_range = c1.radio(
 )
 xnfts = c2.slider("Top xNFTs to view", 1, createInstall.Xnft.nunique(), 10, key="installs_slider")
 
-chart_df = createInstall.copy()[
-    createInstall["Block Timestamp"]
-    >= (pd.to_datetime(datetime.datetime.today()) - pd.Timedelta(f"{int(date_range[:-1])}d"))
-]
-chart_df, totals = utils.aggregate_xnft_data(chart_df, xnfts)
+chart_df, totals = utils.aggregate_xnft_data(createInstall, utils.get_xnft_dataset(), date_range, xnfts)
 
 chart = (
     (
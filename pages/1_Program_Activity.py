@@ -88,7 +88,24 @@ exclude_oracle = c4.checkbox("Exclude Oracle Programs", key="program_exclude_ora
 new_users_only = c4.checkbox("New Users Only", key="program_new_users")
 log_scale = c4.checkbox("Log Scale", key="program_log_scale")
 st.write("---")
-df = utils.load_labeled_program_data(new_users_only=new_users_only, user_type=user_type)
+df = utils.load_labeled_program_data(
+    new_users_only=new_users_only,
+    user_type=user_type,
+    columns=[
+        "Date",
+        "PROGRAM_ID",
+        "TX_COUNT",
+        "SIGNERS",
+        "LABEL_TYPE",
+        "LABEL_SUBTYPE",
+        "LABEL",
+        "ADDRESS_NAME",
+        "FriendlyName",
+        "Abbreviation",
+        "Category",
+        "LogoURI",
+    ],
+)
 df["Date"] = pd.to_datetime(df["Date"])
 c1, c2 = st.columns(2)
 date_range = c1.radio(
@@ -119,12 +136,17 @@ else:
         programs = np.random.choice(df.PROGRAM_ID.unique(), 5)
 
 chart_df = utils.get_program_chart_data(
-    df, metric, agg_method, date_range, exclude_solana, exclude_oracle, programs
-)
-chart_df["Name"] = chart_df.apply(
-    utils.apply_program_name,
-    axis=1,
+    df,
+    utils.get_labeled_program_dataset(new_users_only=new_users_only, user_type=user_type),
+    metric,
+    agg_method,
+    date_range,
+    exclude_solana,
+    exclude_oracle,
+    programs,
+    utils.load_program_leaderboard(new_users_only=new_users_only, user_type=user_type),
 )
+chart_df["Name"] = utils.get_program_names(chart_df)
 chart_df["Explorer Site"] = chart_df.PROGRAM_ID.apply(lambda x: f"https://solana.fm/address/{x}")
 
 chart = charts.alt_line_chart(chart_df, metric, log_scale)
@@ -181,6 +203,32 @@ with st.expander("View and Download Data Table"):
         "text/csv",
         key="download-program-ids",
     )
+if metric == "SIGNERS" and user_type == "Fee Payer":
+    with st.expander("Distinct Fee Payers over a custom date range"):
+        st.write(
+            "Signer Count above is per day; this estimates the number of distinct fee payers over the whole "
+            "range (HyperLogLog, ~2% error). Only programs in the Program Network data are available."
+        )
+        distinct_dates = st.date_input(
+            "Date range",
+            (chart_df.Date.min().date(), chart_df.Date.max().date()),
+            key="program_distinct_dates",
+        )
+        if len(distinct_dates) == 2:
+            distinct_df = utils.load_distinct_signers(
+                list(chart_df["Program ID"].unique()), *distinct_dates, new_users_only=new_users_only
+            )
+            distinct_df = (
+                distinct_df.merge(
+                    chart_df[["Program ID", "Name"]].drop_duplicates(subset="Program ID"),
+                    left_on="PROGRAM_ID",
+                    right_on="Program ID",
+                )[["Name", "Program ID", "SIGNERS"]]
+                .rename(columns={"SIGNERS": "Distinct Fee Payers"})
+                .sort_values(by="Distinct Fee Payers", ascending=False)
+                .reset_index(drop=True)
+            )
+            st.write(distinct_df)
 st.write("---")
 st.subheader("Deep dive")
 st.write("View more details on any Program ID by entering an address below.")
@@ -73,9 +73,8 @@ madlad_query_dict = {
         "datecols": ["DATETIME"],
     },
 }
-madlad_data_dict = {}
-for k, v in madlad_query_dict.items():
-    madlad_data_dict[k] = utils.load_flipside_api_data(v["api"], v["datecols"])
+madlad_data_dict = utils.load_flipside_api_data_dict(madlad_query_dict)
+for k in madlad_query_dict:
     try:
         madlad_data_dict[k]["Explorer URL"] = madlad_data_dict[k]["Tx Id"].apply(
             lambda x: f"https://solana.fm/tx/{x}"
@@ -51,6 +51,7 @@ Analysis performed by [@h4wk10](https://twitter.com/h4wk10), [@banbannard](https
 )
 
 staker_df = utils.load_staker_data()
+staker_dataset = utils.get_staker_dataset()
 staker_itneraction_df = utils.load_staker_interaction_data()
 token_name_dict = {x[1]: x[0] for x in utils.liquid_staking_tokens.values()}
 
@@ -96,7 +97,14 @@ lst = c2.selectbox(
 )
 
 staker_chart_df, token_chart_df = utils.get_stakers_chart_data(
-    staker_df, date_range, exclude_foundation, exclude_labeled, n_addresses, lst_user_type, lst
+    staker_df,
+    staker_dataset,
+    date_range,
+    exclude_foundation,
+    exclude_labeled,
+    n_addresses,
+    lst_user_type,
+    lst,
 )
 chart = charts.alt_line_chart(
     staker_chart_df,
@@ -5,7 +5,6 @@ import datetime
 import hashlib
 import json
 import logging
-import shutil
 from multiprocessing import Pool
 from pathlib import Path
 from time import sleep
@@ -16,13 +15,21 @@ import streamlit as st
 from flipside import Flipside
 from jinja2 import Environment, FileSystemLoader
 
+import spire_fyi.store as store
 import spire_fyi.utils as utils
+from spire_fyi.executor import run_queries
+from spire_fyi.manifest import JobManifest
 
 API_KEY = st.secrets["flipside"]["api_key"]
 sdk = Flipside(API_KEY)
 
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
+# Set in `__main__` when `use_manifest` is on; completed jobs are then looked up there instead of on disk
+manifest = None
+# "parquet" writes to the partitioned dataset under `data/flipside`, "csv" to `data/<template>/<template>_<params>.csv`
+output_formats = ("parquet",)
+
 
 # #TODO: move to utils and CLI
 
@@ -137,11 +144,21 @@ def create_query_by_date_and_wallets(date, wallets, query_basename):
     return query
 
 
+def needs_query(query, output_file, update_cache=False):
+    if update_cache:
+        return True
+    if manifest is not None:
+        return not manifest.is_done((query, output_file))
+    if "parquet" in output_formats:
+        return not store.get_partition_path(*store.split_output_file(output_file)).exists()
+    return not output_file.exists()
+
+
 def get_queries_by_date(date, query_basename, update_cache=False):
     query = create_query_by_date(date, query_basename)
     output_dir = Path(f"data/{query_basename}")
     output_file = Path(output_dir, f"{query_basename}_{date.replace(' ', '_')}.csv")
-    if update_cache or not output_file.exists():
+    if needs_query(query, output_file, update_cache):
         return query, output_file
 
 
@@ -153,7 +170,7 @@ def get_queries_by_date_and_wallets(
     output_file = Path(
         output_dir, f"{query_basename}_{n_wallets}wallets_sha1-{wallet_hash}_{date.replace(' ', '_')}.csv"
     )
-    if update_cache or not output_file.exists():
+    if needs_query(query, output_file, update_cache):
         return query, output_file
 
 
@@ -161,7 +178,7 @@ def get_queries_by_date_and_dex_program(date, query_basename, program, update_ca
     query = create_query_by_date_and_program(date, query_basename, program)
     output_dir = Path(f"data/{query_basename}")
     output_file = Path(output_dir, f"{query_basename}_{date.replace(' ', '_')}_{program}.csv")
-    if update_cache or not output_file.exists():
+    if needs_query(query, output_file, update_cache):
         return query, output_file
 
 
@@ -169,7 +186,7 @@ def get_queries_by_mint_list(mintlist, query_basename, update_cache=False):
     query = create_query_by_creator_address_and_mints(query_basename, "", mintlist)
     output_dir = Path(f"data/{query_basename}")
     output_file = Path(output_dir, f"{query_basename}_2022-12-01.csv")
-    if update_cache or not output_file.exists():
+    if needs_query(query, output_file, update_cache):
         return query, output_file
 
 
@@ -192,7 +209,7 @@ def get_nft_transfer_queries(unique_collection_mints, query_basename, update_cac
                 output_dir,
                 f"{query_basename}_{collection_name}-{creator_address}--{total_mints}mints_p1_first15000.csv",
             )
-            if update_cache or not output_file_p1.exists():
+            if needs_query(query_p1, output_file_p1, update_cache):
                 queries_to_do.append((query_p1, output_file_p1))
 
             query_p2 = create_query_by_creator_address_and_mints(query_basename, creator_address, mints_p2)
@@ -200,7 +217,7 @@ def get_nft_transfer_queries(unique_collection_mints, query_basename, update_cac
                 output_dir,
                 f"{query_basename}_{collection_name}-{creator_address}--{total_mints}mints_p2_last{mints_p2_len}.csv",
             )
-            if update_cache or not output_file_p2.exists():
+            if needs_query(query_p2, output_file_p2, update_cache):
                 queries_to_do.append((query_p2, output_file_p2))
         else:
             query = create_query_by_creator_address_and_mints(query_basename, creator_address, mints)
@@ -208,7 +225,7 @@ def get_nft_transfer_queries(unique_collection_mints, query_basename, update_cac
             output_file = Path(
                 output_dir, f"{query_basename}_{collection_name}-{creator_address}--{total_mints}mints.csv"
             )
-            if update_cache or not output_file.exists():
+            if needs_query(query, output_file, update_cache):
                 queries_to_do.append((query, output_file))
     return queries_to_do
 
@@ -221,27 +238,61 @@ def get_queries_by_date_and_programs(date, query_basename, df, update_cache=Fals
             query = create_query_by_date_and_program(date, query_basename, program)
             output_dir = Path(f"data/{query_basename}")
             output_file = Path(output_dir, f"{query_basename}_{date.replace(' ', '_')}_{program}.csv")
-            if update_cache or not output_file.exists():
+            if needs_query(query, output_file, update_cache):
                 pre_ran = Path(
                     "data/sdk_signers_by_programID_new_users_sol--all_user-programIDs",
                     f"{query_basename}_{date.replace(' ', '_')}_{program}.csv",
                 )
                 if pre_ran.exists():
                     logging.info(f"Copying {pre_ran} to {output_file}")
-                    shutil.copy(pre_ran, output_file)
+                    df = pd.read_csv(pre_ran)
+                    save_output(df, output_file)
+                    if manifest is not None:
+                        manifest.mark_done((query, output_file), len(df))
                 else:
                     queries_to_do.append((query, output_file))
     return queries_to_do
 
 
-def query_flipside_data(enumerated_query_info, save=True):
-    i, query_info = enumerated_query_info
+def save_output(df, output_file):
+    if "parquet" in output_formats:
+        store.write_flipside_partition(df, *store.split_output_file(output_file))
+    if "csv" in output_formats:
+        output_file.parent.mkdir(exist_ok=True, parents=True)
+        df.to_csv(
+            output_file,
+            index=False,
+        )
+
+
+def run_flipside_query(query_info, save=True):
     query, output_file = query_info
     query_file = Path(output_file.parent, "queries", f"{output_file.stem}.sql")
     logging.info(f"#@# Querying data for {output_file} ...")
     query_file.parent.mkdir(exist_ok=True, parents=True)
     with open(query_file, "w") as f:
         f.write(query)
+    query_result_set = sdk.query(
+        query,
+        ttl_minutes=120,
+        timeout_minutes=30,
+        retry_interval_seconds=1,
+        page_size=1000000,
+        page_number=1,
+        cached=False,
+    )
+    if save:
+        df = pd.DataFrame(
+            pd.DataFrame(query_result_set.rows, columns=query_result_set.columns)
+        )  # NOTE: flipside SDK v2.0 returns lowercase values, need to check these
+        save_output(df, output_file)
+    logging.info(f"#@# Saved {output_file}")
+    return len(query_result_set.rows or [])
+
+
+def query_flipside_data(enumerated_query_info, save=True):
+    i, query_info = enumerated_query_info
+    _, output_file = query_info
     # if i % 1 == 0:
     #     sleep(5)
     if i % 5 == 0:
@@ -251,28 +302,10 @@ def query_flipside_data(enumerated_query_info, save=True):
     if i % 100 == 0:
         sleep(15)
     try:
-        query_result_set = sdk.query(
-            query,
-            ttl_minutes=120,
-            timeout_minutes=30,
-            retry_interval_seconds=1,
-            page_size=1000000,
-            page_number=1,
-            cached=False,
-        )
-        if save:
-            df = pd.DataFrame(
-                pd.DataFrame(query_result_set.rows, columns=query_result_set.columns)
-            )  # NOTE: flipside SDK v2.0 returns lowercase values, need to check these
-            output_file.parent.mkdir(exist_ok=True, parents=True)
-            df.to_csv(
-                output_file,
-                index=False,
-            )
-        logging.info(f"#@# Saved {output_file}")
+        run_flipside_query(query_info, save=save)
         return output_file
     except Exception as e:
-        logging.info(f"[ERROR] ({query_file}) {e}")
+        logging.info(f"[ERROR] ({output_file}) {e}")
         return
 
 
@@ -288,7 +321,14 @@ if __name__ == "__main__":
     do_lst = False
     # main routines
     do_pull_flipside_data = True
-    do_pool = False
+    do_async = True
+    do_pool = False  # NOTE: legacy multiprocessing runner, superseded by `do_async`
+    max_concurrency = 8
+    queries_per_second = 0.5
+    use_manifest = True
+
+    if use_manifest:
+        manifest = JobManifest("data/job_manifest.sqlite")
 
     query_info = []
     if do_main:
@@ -417,6 +457,22 @@ if __name__ == "__main__":
             }
             json.dump(top_stakers_log, f, indent=2)
 
+    if manifest is not None:
+        query_info = manifest.import_existing(query_info)
+        manifest.register(query_info)
+        logging.info(f"Job manifest: {manifest.summary()}")
+
+    if do_async:
+        logging.info(f"Running {len(query_info)} queries with up to {max_concurrency} in flight...")
+        run_queries(
+            query_info,
+            run_flipside_query,
+            max_concurrency=max_concurrency,
+            rate=queries_per_second,
+            on_start=manifest.start if manifest is not None else None,
+            on_result=manifest.record if manifest is not None else None,
+        )
+
     if do_pool:
         logging.info(f"Running {len(query_info)} queries...")
         with Pool() as p:
@@ -0,0 +1,61 @@
+"""Persistent dictionary encoding of base58 addresses as compact int64 IDs"""
+
+from typing import Union
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "ADDRESS_IDS_FILE",
+    "AddressDictionary",
+]
+
+ADDRESS_IDS_FILE = Path("data/address_ids.parquet")
+
+
+class AddressDictionary:
+    """Maps addresses (program IDs, signers, mints, wallets) to int64 IDs and back.
+
+    IDs are assigned in the order addresses are first seen and never change, so ID columns written by
+    one run can be joined with those of another. Missing addresses encode to -1.
+    """
+
+    def __init__(self, path: Union[str, Path] = ADDRESS_IDS_FILE):
+        self.path = Path(path)
+        if self.path.exists():
+            addresses = pd.read_parquet(self.path).sort_values(by="ID").ADDRESS.values
+        else:
+            addresses = []
+        self.index = pd.Index(addresses, dtype=object)
+        self._n_saved = len(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def encode(self, addresses, add: bool = True) -> np.ndarray:
+        values = pd.Series(addresses, dtype=object).values
+        ids = self.index.get_indexer(values)
+        missing = (ids < 0) & pd.notna(values)
+        if add and missing.any():
+            new = pd.unique(values[missing])
+            self.index = self.index.append(pd.Index(new, dtype=object))
+            ids[missing] = len(self.index) - len(new) + pd.Index(new).get_indexer(values[missing])
+        return ids.astype(np.int64)
+
+    def decode(self, ids) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64)
+        addresses = (
+            self.index.values.take(np.where(ids < 0, 0, ids)) if len(self.index) else ids.astype(object)
+        )
+        return np.where(ids < 0, None, addresses)
+
+    def save(self) -> None:
+        if len(self.index) == self._n_saved and self.path.exists():
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(
+            {"ID": np.arange(len(self.index), dtype=np.int64), "ADDRESS": self.index.values}
+        ).to_parquet(self.path, index=False)
+        self._n_saved = len(self.index)
@@ -0,0 +1,299 @@
+"""On-disk snapshots of the Flipside `data/latest` API endpoints, refreshed in the background.
+
+Page loaders only ever read the latest good snapshot of an endpoint. When a snapshot is older than
+`STALE_AFTER`, it is still served while a background thread downloads a new one; only an endpoint that
+has never been fetched is downloaded on the request path. New downloads are validated and then swapped in
+atomically, so a bad or empty response never replaces good data.
+
+Endpoints are registered the first time a page asks for them, and `python -m spire_fyi.api_snapshots` runs
+a refresher that keeps every registered endpoint fresh so pages don't need to refresh them at all. A query
+whose columns were changed on purpose is refused as a bad response until it is refreshed once with
+`python -m spire_fyi.api_snapshots <url> ...`, which accepts the new columns.
+"""
+
+from typing import Dict, Iterable, List, Optional, Union
+
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import StringIO
+from pathlib import Path
+
+import pandas as pd
+
+from . import http_client
+
+__all__ = [
+    "REFRESH_INTERVAL",
+    "SNAPSHOT_DIR",
+    "STALE_AFTER",
+    "SnapshotStore",
+    "get_versions",
+    "read_latest",
+    "read_snapshot",
+    "refresh",
+    "run_refresher",
+]
+
+SNAPSHOT_DIR = Path("data/api_snapshots")
+# The refresher service keeps snapshots younger than `REFRESH_INTERVAL`, so pages only refresh an
+# endpoint themselves (after `STALE_AFTER`, the old `st.cache_data` ttl) if it isn't running
+REFRESH_INTERVAL = datetime.timedelta(minutes=30)
+STALE_AFTER = datetime.timedelta(hours=1)
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(sep=" ", timespec="microseconds")
+
+
+class SnapshotStore:
+    """Registered endpoints, and the json file, version and health of each one's latest good snapshot.
+
+    The version of a snapshot is when it was refreshed; `checked_at` is when it was last attempted, so an
+    endpoint that keeps failing isn't asked again on every page load.
+    """
+
+    def __init__(self, snapshot_dir: Union[str, Path] = SNAPSHOT_DIR):
+        self.snapshot_dir = Path(snapshot_dir)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(Path(self.snapshot_dir, "snapshots.sqlite"), timeout=30)
+        # Opened on every page run, so only write when the table is new
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshots'"
+        ).fetchone()
+        if exists is not None:
+            return
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS snapshots (
+                url TEXT PRIMARY KEY,
+                file TEXT,
+                rows INTEGER,
+                columns TEXT,
+                refreshed_at TEXT,
+                checked_at TEXT,
+                last_error TEXT
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def register(self, urls: Iterable[str]) -> None:
+        known = set(self.urls())
+        new = [x for x in dict.fromkeys(urls) if x not in known]
+        if len(new) == 0:
+            return
+        self.conn.executemany("INSERT OR IGNORE INTO snapshots (url) VALUES (?)", [(x,) for x in new])
+        self.conn.commit()
+
+    def urls(self) -> List[str]:
+        return [x for (x,) in self.conn.execute("SELECT url FROM snapshots")]
+
+    def version(self, url: str) -> Optional[str]:
+        row = self.conn.execute("SELECT refreshed_at FROM snapshots WHERE url = ?", (url,)).fetchone()
+        return None if row is None else row[0]
+
+    def stale(
+        self, urls: Iterable[str], max_age: datetime.timedelta, now: Optional[datetime.datetime] = None
+    ) -> List[str]:
+        """The `urls` not refreshed, or tried, within `max_age`"""
+        cutoff = ((now or datetime.datetime.now()) - max_age).isoformat(sep=" ", timespec="microseconds")
+        stale = []
+        for url in urls:
+            row = self.conn.execute("SELECT checked_at FROM snapshots WHERE url = ?", (url,)).fetchone()
+            if row is None or row[0] is None or row[0] < cutoff:
+                stale.append(url)
+        return stale
+
+    def read(self, url: str) -> pd.DataFrame:
+        row = self.conn.execute("SELECT file FROM snapshots WHERE url = ?", (url,)).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError(f"No snapshot of {url}")
+        # Kept as the json the API returned, since `pd.read_json` allows columns of mixed types that
+        # parquet doesn't
+        return pd.read_json(Path(self.snapshot_dir, row[0]))
+
+    def _validate(self, url: str, df: pd.DataFrame, accept_columns: bool = False) -> None:
+        if len(df) == 0:
+            raise ValueError("no rows")
+        if accept_columns:
+            return
+        row = self.conn.execute("SELECT columns FROM snapshots WHERE url = ?", (url,)).fetchone()
+        if row is not None and row[0] is not None:
+            missing = set(row[0].split(",")) - set(df.columns)
+            if missing:
+                raise ValueError(f"missing columns {sorted(missing)}")
+
+    def save(self, url: str, text: str, accept_columns: bool = False) -> None:
+        """Validate a downloaded json list of rows against the current snapshot and swap it in
+
+        With `accept_columns`, a response missing some of the current snapshot's columns is accepted.
+        """
+        df = pd.read_json(StringIO(text))
+        self._validate(url, df, accept_columns)
+        file = f"{hashlib.sha1(url.encode()).hexdigest()[:16]}.json"
+        tmp = Path(self.snapshot_dir, f"{file}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, Path(self.snapshot_dir, file))
+        now = _now()
+        self.conn.execute(
+            """
+            INSERT INTO snapshots (url, file, rows, columns, refreshed_at, checked_at, last_error)
+            VALUES (?, ?, ?, ?, ?, ?, NULL)
+            ON CONFLICT (url) DO UPDATE SET
+                file = excluded.file, rows = excluded.rows, columns = excluded.columns,
+                refreshed_at = excluded.refreshed_at, checked_at = excluded.checked_at, last_error = NULL
+            """,
+            (url, file, len(df), ",".join(df.columns), now, now),
+        )
+        self.conn.commit()
+
+    def record_error(self, url: str, error: str) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO snapshots (url, checked_at, last_error) VALUES (?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET checked_at = excluded.checked_at, last_error = excluded.last_error
+            """,
+            (url, _now(), error),
+        )
+        self.conn.commit()
+
+
+def _download(url: str) -> str:
+    r = http_client.request("GET", url)
+    r.raise_for_status()
+    if not r.text.lstrip().startswith("["):
+        raise ValueError(f"expected a list of rows, got {r.text[:100]!r}")
+    return r.text
+
+
+def refresh(
+    urls: Iterable[str],
+    snapshot_dir: Union[str, Path] = SNAPSHOT_DIR,
+    max_workers: int = 8,
+    accept_columns: bool = False,
+) -> Dict[str, Optional[str]]:
+    """Download `urls` concurrently and save each snapshot as it arrives; `{url: error}`, None if saved"""
+    urls = list(dict.fromkeys(urls))
+    errors = {}
+    store = SnapshotStore(snapshot_dir)
+    try:
+        with ThreadPoolExecutor(max_workers=max(min(len(urls), max_workers), 1)) as pool:
+            futures = {pool.submit(_download, x): x for x in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    store.save(url, future.result(), accept_columns)
+                    errors[url] = None
+                except Exception as e:
+                    # Pages keep serving the last good snapshot, so this is the only sign it is going stale
+                    logging.warning(f"[ERROR] (api_snapshots) {url} -- {e!r}")
+                    store.record_error(url, repr(e))
+                    errors[url] = repr(e)
+    finally:
+        store.close()
+    return errors
+
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _refresh_in_background(urls: List[str], snapshot_dir: Union[str, Path]) -> None:
+    """Refresh `urls` in a daemon thread, skipping any this process is already refreshing"""
+    with _refreshing_lock:
+        urls = [x for x in urls if x not in _refreshing]
+        _refreshing.update(urls)
+    if len(urls) == 0:
+        return
+
+    def run():
+        try:
+            refresh(urls, snapshot_dir)
+        finally:
+            with _refreshing_lock:
+                _refreshing.difference_update(urls)
+
+    threading.Thread(target=run, name="api-snapshot-refresh", daemon=True).start()
+
+
+def get_versions(
+    urls: Iterable[str],
+    stale_after: datetime.timedelta = STALE_AFTER,
+    snapshot_dir: Union[str, Path] = SNAPSHOT_DIR,
+) -> Dict[str, str]:
+    """The current snapshot version of each url, registering new ones.
+
+    Endpoints with no snapshot yet are downloaded now; stale ones are refreshed in the background.
+    """
+    urls = list(dict.fromkeys(urls))
+    store = SnapshotStore(snapshot_dir)
+    try:
+        store.register(urls)
+        missing = [x for x in urls if store.version(x) is None]
+        if missing:
+            logging.info(f"#@# No snapshots yet of {len(missing)} endpoints, fetching")
+            refresh(missing, snapshot_dir)
+        stale = [x for x in store.stale(urls, stale_after) if x not in missing]
+        if stale:
+            _refresh_in_background(stale, snapshot_dir)
+        versions = {x: store.version(x) for x in urls}
+    finally:
+        store.close()
+    failed = [k for k, v in versions.items() if v is None]
+    if failed:
+        raise RuntimeError(f"Could not fetch a first snapshot of {failed}")
+    return versions
+
+
+def read_snapshot(url: str, snapshot_dir: Union[str, Path] = SNAPSHOT_DIR) -> pd.DataFrame:
+    store = SnapshotStore(snapshot_dir)
+    try:
+        return store.read(url)
+    finally:
+        store.close()
+
+
+def read_latest(url: str, snapshot_dir: Union[str, Path] = SNAPSHOT_DIR, **kwargs) -> pd.DataFrame:
+    """`pd.read_json(url)`, from the latest good snapshot"""
+    get_versions([url], snapshot_dir=snapshot_dir, **kwargs)
+    return read_snapshot(url, snapshot_dir)
+
+
+def run_refresher(
+    interval: datetime.timedelta = REFRESH_INTERVAL,
+    snapshot_dir: Union[str, Path] = SNAPSHOT_DIR,
+    poll_seconds: float = 60,
+) -> None:
+    """Keep every registered endpoint's snapshot younger than `interval`, forever"""
+    while True:
+        store = SnapshotStore(snapshot_dir)
+        try:
+            urls = store.stale(store.urls(), interval)
+        finally:
+            store.close()
+        if urls:
+            errors = refresh(urls, snapshot_dir)
+            n_failed = sum(x is not None for x in errors.values())
+            logging.info(f"#@# Refreshed {len(urls) - n_failed} of {len(urls)} API snapshots")
+        time.sleep(poll_seconds)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    if len(sys.argv) > 1:
+        # Refresh the given urls once, accepting changed columns
+        errors = refresh(sys.argv[1:], accept_columns=True)
+        sys.exit(int(any(x is not None for x in errors.values())))
+    run_refresher()
@@ -0,0 +1,201 @@
+"""Backpack address <-> username resolution, through a persistent cache with negative results"""
+
+from typing import Dict, Iterable, Optional, Union
+
+import asyncio
+import datetime
+import logging
+import sqlite3
+from dataclasses import replace
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from .http_client import AsyncHttp, RequestFailed, get_policy
+
+__all__ = [
+    "BACKPACK_INFO_FILE",
+    "BACKPACK_USERS_FILE",
+    "NEGATIVE_TTL",
+    "POSITIVE_TTL",
+    "BackpackCache",
+    "resolve_addresses",
+    "resolve_usernames",
+]
+
+BACKPACK_USERS_FILE = Path("data/backpack_users.sqlite")
+BACKPACK_INFO_FILE = Path("data/backpack_info.csv")
+BACKPACK_API_URL = "https://xnft-api-server.xnfts.dev/v1/users"
+
+# Usernames are rarely changed, but most addresses have none and may register one later
+POSITIVE_TTL = datetime.timedelta(days=30)
+NEGATIVE_TTL = datetime.timedelta(days=3)
+
+# Cache keys are `(kind, key)`: kind "address" maps an address to its username, "username" the reverse
+_kinds = ("address", "username")
+
+
+class BackpackCache:
+    """Address -> username and username -> address lookups, with when each was checked.
+
+    A `None` value records that the API had no match, so it isn't asked again until `NEGATIVE_TTL` has
+    passed. The database is in WAL mode, so concurrent app sessions can read and write it at once.
+    """
+
+    def __init__(self, path: Union[str, Path] = BACKPACK_USERS_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backpack_users (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                checked_at TEXT NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM backpack_users").fetchone()[0]
+
+    def get(
+        self, kind: str, keys: Iterable[str], now: Optional[datetime.datetime] = None
+    ) -> Dict[str, Optional[str]]:
+        """The cached, unexpired values for `keys`; keys missing from the result need to be looked up"""
+        now = now or datetime.datetime.now()
+        keys = list(set(keys))
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.conn.execute(
+                f"""
+                SELECT key, value, checked_at FROM backpack_users WHERE kind = ? AND key IN ({placeholders})
+                """,
+                [kind, *chunk],
+            ).fetchall()
+            for key, value, checked_at in rows:
+                ttl = NEGATIVE_TTL if value is None else POSITIVE_TTL
+                if datetime.datetime.fromisoformat(checked_at) > now - ttl:
+                    found[key] = value
+        return found
+
+    def put(
+        self, kind: str, values: Dict[str, Optional[str]], checked_at: Optional[datetime.datetime] = None
+    ) -> None:
+        """Cache lookups of `kind`; found pairs are cached in the other direction too"""
+        if kind not in _kinds:
+            raise ValueError(f"Unknown lookup kind {kind}, expected one of {_kinds}")
+        checked_at = (checked_at or datetime.datetime.now()).isoformat(sep=" ", timespec="seconds")
+        other = _kinds[1 - _kinds.index(kind)]
+        rows = [(kind, k, v, checked_at) for k, v in values.items()]
+        rows += [(other, v, k, checked_at) for k, v in values.items() if v is not None]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO backpack_users (kind, key, value, checked_at) VALUES (?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+
+    def import_csv(self, path: Union[str, Path] = BACKPACK_INFO_FILE) -> int:
+        """Seed the cache with the `user, address` pairs of the old csv cache"""
+        path = Path(path)
+        if not path.exists():
+            return 0
+        df = pd.read_csv(path).dropna()
+        self.put("address", dict(zip(df.address, df.user)))
+        return len(df)
+
+
+class _LookupError(Exception):
+    """The API couldn't be asked, as opposed to answering that there is no match"""
+
+
+async def _get_json(http: AsyncHttp, path: str, params: dict) -> dict:
+    try:
+        r = await http.request("GET", f"{BACKPACK_API_URL}/{path}", params=params)
+        return r.json()
+    except (RequestFailed, ValueError) as e:
+        raise _LookupError(repr(e))
+
+
+async def _fetch_username(http: AsyncHttp, address: str) -> Optional[str]:
+    j = await _get_json(http, "fromPubkey", {"publicKey": address, "blockchain": "solana"})
+    try:
+        return j["user"]["username"]
+    except (KeyError, TypeError):
+        return None
+
+
+async def _fetch_address(http: AsyncHttp, username: str) -> Optional[str]:
+    j = await _get_json(http, "fromUsername", {"username": username})
+    try:
+        public_keys = j["user"]["public_keys"]
+    except (KeyError, TypeError):
+        return None
+    for x in public_keys:
+        if x["blockchain"] == "solana":
+            return x["public_key"]
+    return None
+
+
+async def _fetch_all(fetch, keys, max_concurrency: int) -> Dict[str, Optional[str]]:
+    host = urlparse(BACKPACK_API_URL).netloc
+    async with AsyncHttp({host: replace(get_policy(host), max_connections=max_concurrency)}) as http:
+
+        async def run(key):
+            return key, await fetch(http, key)
+
+        results = await asyncio.gather(*[run(x) for x in keys], return_exceptions=True)
+    found = {}
+    n_failed = 0
+    for x in results:
+        if isinstance(x, _LookupError):
+            n_failed += 1
+        elif isinstance(x, Exception):
+            raise x
+        else:
+            found[x[0]] = x[1]
+    if n_failed > 0:
+        logging.info(f"[ERROR] (backpack) {n_failed} of {len(keys)} lookups failed, not cached")
+    return found
+
+
+def _resolve(kind: str, fetch, keys: Iterable[str], max_concurrency: int, path) -> Dict[str, Optional[str]]:
+    keys = [x for x in pd.unique(pd.Series(list(keys), dtype=object).dropna()) if x != ""]
+    cache = BackpackCache(path)
+    try:
+        if len(cache) == 0:
+            cache.import_csv()
+        found = cache.get(kind, keys)
+        misses = [x for x in keys if x not in found]
+        if len(misses) > 0:
+            logging.info(f"#@# {len(misses)} of {len(keys)} Backpack {kind} lookups not cached, fetching")
+            fetched = asyncio.run(_fetch_all(fetch, misses, max_concurrency))
+            cache.put(kind, fetched)
+            found.update(fetched)
+    finally:
+        cache.close()
+    found[""] = ""
+    return found
+
+
+def resolve_usernames(
+    addresses: Iterable[str], max_concurrency: int = 16, path: Union[str, Path] = BACKPACK_USERS_FILE
+) -> Dict[str, Optional[str]]:
+    """`{address: username}`, None where the address has no Backpack username (or the lookup failed)"""
+    return _resolve("address", _fetch_username, addresses, max_concurrency, path)
+
+
+def resolve_addresses(
+    usernames: Iterable[str], max_concurrency: int = 16, path: Union[str, Path] = BACKPACK_USERS_FILE
+) -> Dict[str, Optional[str]]:
+    """`{username: address}`, None where the username doesn't exist (or the lookup failed)"""
+    return _resolve("username", _fetch_address, usernames, max_concurrency, path)
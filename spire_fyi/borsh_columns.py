@@ -0,0 +1,146 @@
+"""Batch Borsh decoding of many account buffers straight into columns.
+
+Runs of fixed size fields are read for every account at once through a NumPy structured dtype view; only
+variable length fields (strings and Options) move each account's read offset, and only strings are
+walked per account.
+
+A layout is a list of `(name, kind)` fields, where `kind` is one of:
+
+- a NumPy dtype string for a little endian scalar, e.g. `"<u8"`, `"<i8"`, `"u1"`, `"?"`
+- `PUBKEY`, 32 bytes decoded to a base58 string
+- `("pad", n)`, n bytes that are skipped
+- `("enum", names)`, a one byte index into `names` (enums without fields)
+- `STRING`, a u32 length prefixed utf-8 string
+- `("option", kind)`, a one byte flag then `kind` if it is 1; `kind` is a fixed kind, `STRING`, or a list
+  of fixed `(name, kind)` fields, which become columns of their own
+"""
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import based58
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "PUBKEY",
+    "STRING",
+    "decode_columns",
+]
+
+PUBKEY = "pubkey"
+STRING = "string"
+
+Field = Tuple[str, Any]
+
+
+def _is_fixed(kind) -> bool:
+    if isinstance(kind, tuple):
+        return kind[0] in ("pad", "enum")
+    return kind != STRING
+
+
+def _fixed_dtype(kind) -> Any:
+    if kind == PUBKEY:
+        return (np.uint8, 32)
+    if isinstance(kind, tuple):
+        return f"V{kind[1]}" if kind[0] == "pad" else "u1"
+    return kind
+
+
+def _convert(values: np.ndarray, kind) -> np.ndarray:
+    if kind == PUBKEY:
+        b = np.ascontiguousarray(values).tobytes()
+        return np.array(
+            [based58.b58encode(b[i : i + 32]).decode() for i in range(0, len(b), 32)], dtype=object
+        )
+    if isinstance(kind, tuple) and kind[0] == "enum":
+        return np.asarray(kind[1], dtype=object)[values]
+    return values
+
+
+def _take(buf: np.ndarray, rows: np.ndarray, pos: np.ndarray, size: int) -> np.ndarray:
+    """`size` bytes from each row of `buf` at that row's offset, as a contiguous `(len(rows), size)` block"""
+    if len(rows) == len(buf) and len(rows) > 0 and (pos == pos[0]).all():
+        return np.ascontiguousarray(buf[:, pos[0] : pos[0] + size])
+    return buf[rows[:, None], pos[:, None] + np.arange(size)]
+
+
+def _read_fixed(buf, rows, pos, fields: List[Field]) -> Tuple[Dict[str, np.ndarray], int]:
+    dtype = np.dtype([(name, _fixed_dtype(kind)) for name, kind in fields])
+    records = _take(buf, rows, pos, dtype.itemsize).view(dtype).ravel()
+    columns = {}
+    for name, kind in fields:
+        if not (isinstance(kind, tuple) and kind[0] == "pad"):
+            columns[name] = _convert(records[name], kind)
+    return columns, dtype.itemsize
+
+
+def _read_strings(data: Sequence[bytes], buf, rows, pos) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = _take(buf, rows, pos, 4).view("<u4").ravel().astype(np.int64)
+    start = pos + 4
+    values = np.array(
+        [data[r][s : s + n].decode("utf-8") for r, s, n in zip(rows, start, lengths)], dtype=object
+    )
+    return values, start + lengths
+
+
+def _nullable(values: np.ndarray, present: np.ndarray) -> Any:
+    if values.dtype.kind in "iu":
+        full = np.zeros(len(present), dtype=values.dtype)
+        full[present] = values
+        return pd.arrays.IntegerArray(full, ~present)
+    out = np.full(len(present), None, dtype=object)
+    out[present] = values
+    return out
+
+
+def decode_columns(data: Sequence[bytes], layout: List[Field], offset: int = 8) -> pd.DataFrame:
+    """Decode `layout` from every buffer in `data`, starting `offset` bytes in (after the discriminator)"""
+    n = len(data)
+    lengths = np.fromiter((len(x) for x in data), dtype=np.int64, count=n)
+    width = int(lengths.max()) if n > 0 else 0
+    if n > 0 and (lengths == width).all():
+        # Accounts of one type are usually allocated the same size, so this is one copy of the joined data
+        buf = np.frombuffer(b"".join(data), dtype=np.uint8).reshape(n, width)
+    else:
+        buf = np.zeros((n, width), dtype=np.uint8)
+        for i, x in enumerate(data):
+            buf[i, : len(x)] = np.frombuffer(x, dtype=np.uint8)
+
+    rows = np.arange(n)
+    pos = np.full(n, offset, dtype=np.int64)
+    columns = {}
+    i = 0
+    while i < len(layout):
+        fixed = []
+        while i < len(layout) and _is_fixed(layout[i][1]):
+            fixed.append(layout[i])
+            i += 1
+        if fixed:
+            values, size = _read_fixed(buf, rows, pos, fixed)
+            columns.update(values)
+            pos = pos + size
+            continue
+
+        name, kind = layout[i]
+        i += 1
+        if kind == STRING:
+            columns[name], pos = _read_strings(data, buf, rows, pos)
+            continue
+        # Option
+        inner = kind[1]
+        present = buf[rows, pos].astype(bool)
+        pos = pos + 1
+        some = rows[present]
+        if inner == STRING:
+            values, end = _read_strings(data, buf, some, pos[present])
+            columns[name] = _nullable(values, present)
+            pos[present] = end
+            continue
+        fields = inner if isinstance(inner, list) else [(name, inner)]
+        values, size = _read_fixed(buf, some, pos[present], fields)
+        for field_name, _ in fields:
+            if field_name in values:
+                columns[field_name] = _nullable(values[field_name], present)
+        pos[present] += size
+    return pd.DataFrame(columns)
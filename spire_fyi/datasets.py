@@ -0,0 +1,35 @@
+"""Lightweight handles for DataFrames passed to cached functions.
+
+`st.cache_data` hashes every argument to build its cache key, which for a multi-million row frame costs
+more than most of the aggregations themselves. Cached functions instead take the frame as an unhashed
+`_df` argument (Streamlit, and `disk_cache.persist`, skip arguments starting with `_`) alongside a
+`Dataset`, a name and a version that is all that gets hashed. The version comes from the files the frame
+is loaded from, so it changes whenever they are rewritten.
+"""
+
+from typing import Iterable, Union
+
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+__all__ = [
+    "Dataset",
+    "from_files",
+]
+
+
+@dataclass(frozen=True)
+class Dataset:
+    name: str
+    version: str
+
+
+def from_files(name: str, files: Iterable[Union[str, Path]]) -> Dataset:
+    """A handle versioned by the size and mtime of `files`, e.g. a combined output's csv and Feather copy"""
+    h = hashlib.sha256()
+    for path in files:
+        path = Path(path)
+        stat = path.stat() if path.exists() else None
+        h.update(f"{path}:{stat and (stat.st_size, stat.st_mtime_ns)}".encode())
+    return Dataset(name, h.hexdigest()[:16])
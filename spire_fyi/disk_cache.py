@@ -0,0 +1,260 @@
+"""Persistent on-disk cache for expensive loaders and aggregations, shared by every app process.
+
+`st.cache_data` only keeps results in the memory of one process, so they are lost on restart and every
+replica computes its own. Functions decorated with `persist` (under their `st.cache_data`) also look in a
+cache directory on the shared data volume. DataFrames, and tuples of them, are stored as uncompressed
+Feather (Arrow IPC) files, which are fast to write and to map back in; anything else is pickled. An
+index of entries in SQLite tracks their size and last use, and the least recently used are evicted once
+the cache is over `max_bytes`.
+"""
+
+from typing import Any, Callable, Iterable, Optional, Tuple, Union
+
+import datetime
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+__all__ = [
+    "DISK_CACHE_DIR",
+    "MAX_BYTES",
+    "DiskCache",
+    "get_cache",
+    "make_key",
+    "persist",
+]
+
+DISK_CACHE_DIR = Path("data/cache/functions")
+MAX_BYTES = 2 * 1024**3
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(sep=" ", timespec="microseconds")
+
+
+def _hash_value(h, x) -> None:
+    """Feed a stable representation of an argument into `h`"""
+    if isinstance(x, pd.DataFrame):
+        h.update(b"frame")
+        h.update(repr((list(x.columns), x.dtypes.astype(str).tolist(), x.shape)).encode())
+        h.update(pd.util.hash_pandas_object(x, index=True).values.tobytes())
+    elif isinstance(x, (pd.Series, pd.Index)):
+        h.update(b"series")
+        h.update(pd.util.hash_pandas_object(x).values.tobytes())
+    elif isinstance(x, (list, tuple)):
+        h.update(f"{type(x).__name__}{len(x)}".encode())
+        for y in x:
+            _hash_value(h, y)
+    elif isinstance(x, dict):
+        h.update(f"dict{len(x)}".encode())
+        for k in sorted(x, key=repr):
+            _hash_value(h, k)
+            _hash_value(h, x[k])
+    else:
+        h.update(f"{type(x).__name__}:{x!r}".encode())
+
+
+def make_key(func: Callable, args: tuple, kwargs: dict, files: Iterable[Union[str, Path]] = ()) -> str:
+    """Key of a call: the function, its arguments, and the size and mtime of the files it reads.
+
+    Like `st.cache_data`, arguments whose names start with `_` are left out, see `datasets.Dataset`.
+    """
+    h = hashlib.sha256(f"{func.__module__}.{func.__qualname__}".encode())
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    _hash_value(h, {k: v for k, v in bound.arguments.items() if not k.startswith("_")})
+    for path in files:
+        path = Path(path)
+        stat = path.stat() if path.exists() else None
+        h.update(f"{path}:{stat and (stat.st_size, stat.st_mtime_ns)}".encode())
+    return h.hexdigest()
+
+
+class DiskCache:
+    """Cached values by key, as Feather or pickle files in `cache_dir`, evicted least recently used first.
+
+    Every process (and replica) using the same `cache_dir` shares entries. Files are written under a
+    temporary name and renamed into place, and the index is in WAL mode, so readers never see a partly
+    written entry.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = DISK_CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(Path(self.cache_dir, "index.sqlite"), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                parts INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                accessed_at TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def size(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _paths(self, key: str, kind: str, parts: int):
+        suffix = "pickle" if kind == "pickle" else "feather"
+        return [Path(self.cache_dir, f"{key}.{i}.{suffix}") for i in range(parts)]
+
+    def get(self, key: str, ttl: Optional[datetime.timedelta] = None) -> Tuple[bool, Any]:
+        """`(True, value)` for a cached, unexpired key, else `(False, None)`"""
+        row = self.conn.execute(
+            "SELECT kind, parts, created_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return False, None
+        kind, parts, created_at = row
+        if ttl is not None and datetime.datetime.fromisoformat(created_at) < datetime.datetime.now() - ttl:
+            return False, None
+        try:
+            if kind == "pickle":
+                with open(self._paths(key, kind, 1)[0], "rb") as f:
+                    value = pickle.load(f)
+            else:
+                frames = [feather.read_feather(x) for x in self._paths(key, kind, parts)]
+                value = frames[0] if kind == "frame" else tuple(frames)
+        except (OSError, pa.ArrowInvalid, pickle.UnpicklingError, EOFError):
+            # Evicted by another process since the lookup
+            return False, None
+        self.conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (_now(), key))
+        self.conn.commit()
+        return True, value
+
+    def _write(self, key: str, value: Any) -> Tuple[str, int]:
+        frames = None
+        if isinstance(value, pd.DataFrame):
+            kind, frames = "frame", [value]
+        elif isinstance(value, tuple) and len(value) > 0 and all(isinstance(x, pd.DataFrame) for x in value):
+            kind, frames = "tuple", list(value)
+        if frames is not None:
+            try:
+                for df, path in zip(frames, self._paths(key, kind, len(frames))):
+                    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                    feather.write_feather(df, tmp, compression="uncompressed")
+                    os.replace(tmp, path)
+                return kind, len(frames)
+            except (pa.ArrowException, ValueError):
+                # e.g. object columns of mixed types, or duplicate column names
+                tmp.unlink(missing_ok=True)
+                for path in self._paths(key, kind, len(frames)):
+                    path.unlink(missing_ok=True)
+        path = self._paths(key, "pickle", 1)[0]
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, path)
+        return "pickle", 1
+
+    def put(self, key: str, value: Any, name: str = "") -> None:
+        kind, parts = self._write(key, value)
+        size = sum(x.stat().st_size for x in self._paths(key, kind, parts))
+        now = _now()
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO entries (key, name, kind, parts, size, created_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key, name, kind, parts, size, now, now),
+        )
+        self.conn.commit()
+        self.evict()
+
+    def delete(self, key: str) -> None:
+        row = self.conn.execute("SELECT kind, parts FROM entries WHERE key = ?", (key,)).fetchone()
+        self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.conn.commit()
+        if row is not None:
+            for path in self._paths(key, *row):
+                path.unlink(missing_ok=True)
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the cache fits in `max_bytes`"""
+        total = self.size()
+        n = 0
+        if total <= self.max_bytes:
+            return n
+        rows = self.conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.delete(key)
+            total -= size
+            n += 1
+        logging.info(f"#@# Evicted {n} disk cache entries, {total / 1024**2:.0f}MB left")
+        return n
+
+
+_caches = threading.local()
+
+
+def get_cache(cache_dir: Union[str, Path] = DISK_CACHE_DIR) -> DiskCache:
+    """This thread's `DiskCache` for `cache_dir`, since SQLite connections can't be shared between threads"""
+    caches = _caches.__dict__.setdefault("caches", {})
+    cache_dir = str(cache_dir)
+    if cache_dir not in caches:
+        caches[cache_dir] = DiskCache(cache_dir)
+    return caches[cache_dir]
+
+
+def persist(
+    ttl: Optional[Union[int, datetime.timedelta]] = None,
+    files: Iterable[Union[str, Path]] = (),
+    cache_dir: Union[str, Path] = DISK_CACHE_DIR,
+):
+    """Cache a function's results on disk, for `ttl` (seconds or a timedelta) or until `files` change.
+
+    Put it under `st.cache_data`, which then only calls through to the disk cache when its own in-memory
+    copy is missing.
+    """
+    ttl = datetime.timedelta(seconds=ttl) if isinstance(ttl, (int, float)) else ttl
+    files = list(files)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(func, args, kwargs, files)
+            cache = get_cache(cache_dir)
+            hit, value = cache.get(key, ttl)
+            if hit:
+                return value
+            value = func(*args, **kwargs)
+            try:
+                cache.put(key, value, name=func.__qualname__)
+            except Exception as e:
+                # The value is already computed, so a failure to cache it mustn't fail the page
+                logging.info(f"[ERROR] (disk_cache) Not caching {func.__qualname__}: {e!r}")
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,190 @@
+"""Async executor for running batches of Flipside queries with adaptive rate limiting"""
+
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from flipside.errors import ApiError, QueryRunRateLimitError, QueryRunTimeoutError, ServerError
+
+__all__ = [
+    "QueryResult",
+    "TokenBucket",
+    "is_throttle_error",
+    "run_queries",
+    "run_queries_async",
+]
+
+QueryInfo = Tuple[str, Path]
+
+
+def is_throttle_error(e: Exception) -> bool:
+    """Whether an error means Flipside is asking us to slow down, rather than the query being bad"""
+    if isinstance(e, (QueryRunRateLimitError, QueryRunTimeoutError, ServerError)):
+        return True
+    if isinstance(e, ApiError) and "MaxConcurrentQueries" in str(e):
+        return True
+    # Raw HTTP errors (e.g. `requests.HTTPError`) carry the response, other messages may quote a 429
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    `rate` tokens are added per second, up to `capacity`. When the API pushes back, `backoff` halves the
+    rate and blocks all callers for `delay` seconds; each success then adds `recovery` back to the rate
+    until `max_rate` is reached again.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.5,
+        capacity: int = 5,
+        min_rate: float = 0.02,
+        max_rate: Optional[float] = None,
+        recovery: float = 0.02,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = rate if max_rate is None else max_rate
+        self.recovery = recovery
+        self.tokens = float(capacity)
+        self.blocked_until = 0.0
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def backoff(self, delay: float) -> None:
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+    def recover(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+
+@dataclass
+class QueryResult:
+    query_info: QueryInfo
+    result: Any = None
+    error: Optional[Exception] = None
+    attempts: int = 0
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def _run_one(
+    query_info: QueryInfo,
+    run_query: Callable[[QueryInfo], Any],
+    bucket: TokenBucket,
+    semaphore: asyncio.Semaphore,
+    max_retries: int,
+    base_delay: float,
+    on_start: Optional[Callable[[QueryInfo], None]] = None,
+    on_result: Optional[Callable[[QueryResult], None]] = None,
+) -> QueryResult:
+    _, output_file = query_info
+    res = QueryResult(query_info)
+    async with semaphore:
+        if on_start is not None:
+            on_start(query_info)
+        for attempt in range(1, max_retries + 1):
+            await bucket.acquire()
+            res.attempts = attempt
+            start = time.monotonic()
+            try:
+                res.result = await asyncio.get_running_loop().run_in_executor(None, run_query, query_info)
+                res.error = None
+            except Exception as e:
+                res.error = e
+                if is_throttle_error(e) and attempt < max_retries:
+                    delay = base_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                    logging.info(f"[THROTTLED] ({output_file}) {e} -- retrying in {delay:.0f}s")
+                    bucket.backoff(delay)
+                    continue
+                logging.info(f"[ERROR] ({output_file}) {e}")
+            finally:
+                res.duration = time.monotonic() - start
+            if res.ok:
+                bucket.recover()
+            break
+    if on_result is not None:
+        on_result(res)
+    return res
+
+
+async def run_queries_async(
+    query_info: Iterable[QueryInfo],
+    run_query: Callable[[QueryInfo], Any],
+    max_concurrency: int = 8,
+    rate: float = 0.5,
+    capacity: int = 5,
+    max_retries: int = 5,
+    base_delay: float = 10.0,
+    on_start: Optional[Callable[[QueryInfo], None]] = None,
+    on_result: Optional[Callable[[QueryResult], None]] = None,
+) -> List[QueryResult]:
+    """Run `(query, output_file)` tuples through `run_query` concurrently.
+
+    `run_query` is a blocking callable (e.g. a Flipside SDK call), run in a thread pool sized to
+    `max_concurrency`. Queries are started at most `rate` per second, and rate limit / timeout errors back
+    off the whole executor before the query is retried.
+
+    `on_start` and `on_result` are called from the event loop thread as each query starts and finishes,
+    e.g. to record progress in a `JobManifest`.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_concurrency))
+    bucket = TokenBucket(rate=rate, capacity=capacity)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [
+        _run_one(
+            x,
+            run_query,
+            bucket,
+            semaphore,
+            max_retries=max_retries,
+            base_delay=base_delay,
+            on_start=on_start,
+            on_result=on_result,
+        )
+        for x in query_info
+    ]
+    results = await asyncio.gather(*tasks)
+    n_failed = sum(1 for x in results if not x.ok)
+    logging.info(f"#@# Finished {len(results)} queries, {n_failed} failed")
+    return list(results)
+
+
+def run_queries(
+    query_info: Iterable[QueryInfo], run_query: Callable[[QueryInfo], Any], **kwargs
+) -> List[QueryResult]:
+    return asyncio.run(run_queries_async(query_info, run_query, **kwargs))
@@ -0,0 +1,334 @@
+"""Shared pooled HTTP clients for the external APIs, with per-host limits, retries and request metrics.
+
+Pages and batch jobs ask for urls through `request`/`get_json`/`read_json` (one process wide keep-alive
+pool, safe to share between Streamlit sessions) or through an `AsyncHttp` client (one pool per event
+loop, for concurrent batch jobs). Both look up the `HostPolicy` of the url's host for how many requests
+may be in flight, how fast they may start, the timeout and the retries, and record every attempt in
+`metrics`.
+"""
+
+from typing import Any, Dict, Optional
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from io import StringIO
+from urllib.parse import urlparse
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from .executor import TokenBucket
+
+__all__ = [
+    "DEFAULT_POLICY",
+    "HOST_POLICIES",
+    "AsyncHttp",
+    "HostPolicy",
+    "RequestFailed",
+    "RequestMetrics",
+    "get_json",
+    "get_policy",
+    "metrics",
+    "read_json",
+    "request",
+]
+
+
+@dataclass(frozen=True)
+class HostPolicy:
+    """How one host is called: `rate` is in requests per second, None for no limit"""
+
+    max_connections: int = 8
+    rate: Optional[float] = None
+    capacity: int = 4
+    timeout: float = 30.0
+    max_retries: int = 3
+    base_delay: float = 1.0
+
+
+DEFAULT_POLICY = HostPolicy()
+HOST_POLICIES = {
+    "api.flipsidecrypto.com": HostPolicy(max_connections=8, timeout=60.0),
+    "api.solana.fm": HostPolicy(max_connections=8, rate=4.0, max_retries=5, base_delay=2.0),
+    "api.helius.xyz": HostPolicy(max_connections=4, timeout=60.0, max_retries=5, base_delay=2.0),
+    "xnft-api-server.xnfts.dev": HostPolicy(max_connections=16, timeout=15.0),
+    "api.howrare.is": HostPolicy(max_connections=2, timeout=60.0),
+    "cloudflare-ipfs.com": HostPolicy(max_connections=16, timeout=20.0, max_retries=1),
+    "ipfs.io": HostPolicy(max_connections=16, timeout=20.0, max_retries=1),
+}
+
+
+def get_policy(host: str, policies: Optional[Dict[str, HostPolicy]] = None) -> HostPolicy:
+    policies = HOST_POLICIES if policies is None else {**HOST_POLICIES, **policies}
+    return policies.get(host, DEFAULT_POLICY)
+
+
+class RequestFailed(httpx.HTTPError):
+    """A request still throttled, failing with a 5xx, or not connecting after all its retries"""
+
+
+class RequestMetrics:
+    """Attempts, retries, failures and latencies of requests by host, for the sync and async clients"""
+
+    def __init__(self, max_samples: int = 10000):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: {"requests": 0, "retries": 0, "failures": 0})
+        self._latencies = defaultdict(lambda: deque(maxlen=max_samples))
+
+    def record(self, host: str, seconds: float, outcome: str) -> None:
+        """`outcome` is "ok", "retry" or "failure" """
+        with self._lock:
+            counts = self._counts[host]
+            counts["requests"] += 1
+            if outcome == "retry":
+                counts["retries"] += 1
+            elif outcome == "failure":
+                counts["failures"] += 1
+            self._latencies[host].append(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self._latencies.clear()
+
+    def summary(self) -> pd.DataFrame:
+        with self._lock:
+            rows = []
+            for host, counts in self._counts.items():
+                latencies = np.array(self._latencies[host]) * 1000
+                rows.append(
+                    {
+                        "host": host,
+                        **counts,
+                        "p50_ms": np.percentile(latencies, 50),
+                        "p95_ms": np.percentile(latencies, 95),
+                        "max_ms": latencies.max(),
+                    }
+                )
+        return pd.DataFrame(
+            rows, columns=["host", "requests", "retries", "failures", "p50_ms", "p95_ms", "max_ms"]
+        )
+
+    def log_summary(self) -> None:
+        for x in self.summary().itertuples():
+            logging.info(
+                f"#@# {x.host}: {x.requests} requests, {x.retries} retried, {x.failures} failed, "
+                f"p50 {x.p50_ms:.0f}ms, p95 {x.p95_ms:.0f}ms"
+            )
+
+
+metrics = RequestMetrics()
+
+
+def _is_retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _strip_query(url: str) -> str:
+    """The url for logs, without a query string that may hold an api key"""
+    return url.split("?")[0]
+
+
+def _retry_delay(r: Optional[httpx.Response], attempt: int, base_delay: float) -> float:
+    """Retry-After if the server sent one, else exponential backoff with jitter"""
+    if r is not None:
+        try:
+            return float(r.headers["Retry-After"])
+        except (KeyError, ValueError):
+            pass
+    return base_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+# #---
+# Sync client, shared by the whole process
+
+
+class _SyncBucket:
+    """Thread safe token bucket; a `backoff` blocks every caller for `delay` seconds"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.blocked_until = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+                self._last = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def backoff(self, delay: float) -> None:
+        with self._lock:
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+
+class _SyncHost:
+    def __init__(self, policy: HostPolicy):
+        self.policy = policy
+        self.semaphore = threading.BoundedSemaphore(policy.max_connections)
+        self.bucket = None if policy.rate is None else _SyncBucket(policy.rate, policy.capacity)
+
+
+_sync_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+_sync_hosts: Dict[Optional[str], _SyncHost] = {}
+
+
+def _get_sync(host: str):
+    global _sync_client
+    # Hosts without a policy (e.g. NFT metadata on arbitrary hosts) share one `DEFAULT_POLICY` entry
+    key = host if host in HOST_POLICIES else None
+    with _sync_lock:
+        if _sync_client is None:
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+            _sync_client = httpx.Client(limits=limits, follow_redirects=True)
+        if key not in _sync_hosts:
+            _sync_hosts[key] = _SyncHost(get_policy(host))
+        return _sync_client, _sync_hosts[key]
+
+
+def request(method: str, url: str, max_retries: Optional[int] = None, **kwargs) -> httpx.Response:
+    """Send a request through the shared pool, retrying 429s, 5xxs and connection errors.
+
+    Other responses are returned as they are; raises `RequestFailed` once the retries run out.
+    """
+    host = urlparse(url).netloc
+    client, state = _get_sync(host)
+    policy = state.policy
+    max_retries = policy.max_retries if max_retries is None else max_retries
+    kwargs.setdefault("timeout", policy.timeout)
+    for attempt in range(1, max_retries + 1):
+        if state.bucket is not None:
+            state.bucket.acquire()
+        r = None
+        try:
+            with state.semaphore:
+                start = time.monotonic()
+                r = client.request(method, url, **kwargs)
+            if not _is_retryable(r.status_code):
+                metrics.record(host, time.monotonic() - start, "ok")
+                return r
+            error = f"HTTP {r.status_code}"
+        except httpx.TransportError as e:
+            error = repr(e)
+        if attempt == max_retries:
+            metrics.record(host, time.monotonic() - start, "failure")
+            raise RequestFailed(f"{method} {_strip_query(url)} failed after {attempt} attempts: {error}")
+        metrics.record(host, time.monotonic() - start, "retry")
+        delay = _retry_delay(r, attempt, policy.base_delay)
+        logging.info(f"[THROTTLED] ({host}) {error} -- retrying in {delay:.1f}s")
+        if state.bucket is not None:
+            state.bucket.backoff(delay)
+        else:
+            time.sleep(delay)
+
+
+def get_json(url: str, **kwargs) -> Any:
+    r = request("GET", url, **kwargs)
+    r.raise_for_status()
+    return r.json()
+
+
+def read_json(url: str, **kwargs) -> pd.DataFrame:
+    """`pd.read_json(url)`, fetched through the shared pool"""
+    r = request("GET", url)
+    r.raise_for_status()
+    return pd.read_json(StringIO(r.text), **kwargs)
+
+
+# #---
+# Async client, one per event loop
+
+
+class AsyncHttp:
+    """A pooled async client for one batch job, limiting each host by its `HostPolicy`.
+
+    `policies` overrides `HOST_POLICIES` for this client, e.g. a job's own concurrency. Hosts with a
+    `rate` share a `TokenBucket`, so a 429 slows every request to that host, not just the one retried.
+    """
+
+    def __init__(self, policies: Optional[Dict[str, HostPolicy]] = None, **client_kwargs):
+        self.policies = {} if policies is None else policies
+        self._client_kwargs = client_kwargs
+        self._client: Optional[httpx.AsyncClient] = None
+        self._hosts: Dict[str, Any] = {}
+
+    async def __aenter__(self) -> "AsyncHttp":
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+        self._client = httpx.AsyncClient(limits=limits, follow_redirects=True, **self._client_kwargs)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+        self._client = None
+
+    def _host(self, host: str):
+        if host not in self._hosts:
+            policy = get_policy(host, self.policies)
+            bucket = None
+            if policy.rate is not None:
+                # Recover from a 429 within a few dozen requests, not the slow ramp of Flipside queries
+                bucket = TokenBucket(
+                    rate=policy.rate,
+                    capacity=policy.capacity,
+                    min_rate=policy.rate / 8,
+                    recovery=policy.rate / 20,
+                )
+            self._hosts[host] = (policy, asyncio.Semaphore(policy.max_connections), bucket)
+        return self._hosts[host]
+
+    async def request(
+        self, method: str, url: str, max_retries: Optional[int] = None, **kwargs
+    ) -> httpx.Response:
+        """Like `request`, but async and through this client's pool"""
+        host = urlparse(url).netloc
+        policy, semaphore, bucket = self._host(host)
+        max_retries = policy.max_retries if max_retries is None else max_retries
+        kwargs.setdefault("timeout", policy.timeout)
+        for attempt in range(1, max_retries + 1):
+            r = None
+            async with semaphore:
+                if bucket is not None:
+                    await bucket.acquire()
+                start = time.monotonic()
+                try:
+                    r = await self._client.request(method, url, **kwargs)
+                    if not _is_retryable(r.status_code):
+                        metrics.record(host, time.monotonic() - start, "ok")
+                        if bucket is not None:
+                            bucket.recover()
+                        return r
+                    error = f"HTTP {r.status_code}"
+                except httpx.TransportError as e:
+                    error = repr(e)
+            if attempt == max_retries:
+                metrics.record(host, time.monotonic() - start, "failure")
+                raise RequestFailed(f"{method} {_strip_query(url)} failed after {attempt} attempts: {error}")
+            metrics.record(host, time.monotonic() - start, "retry")
+            delay = _retry_delay(r, attempt, policy.base_delay)
+            logging.info(f"[THROTTLED] ({host}) {error} -- retrying in {delay:.1f}s")
+            if bucket is not None:
+                bucket.backoff(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        r = await self.request("GET", url, **kwargs)
+        r.raise_for_status()
+        return r.json()
@@ -0,0 +1,228 @@
+"""Incremental combine: fold only new query output partitions into the combined datasets"""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import datetime
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from . import store
+
+__all__ = [
+    "COMBINE_STATE_FILE",
+    "WEEKLY_USER_BUCKETS_FILE",
+    "CombineState",
+    "append_csv",
+    "get_weekly_user_stats",
+    "list_partitions",
+    "merge_csv",
+    "read_new_partitions",
+    "read_partitions",
+    "update_weekly_user_buckets",
+]
+
+COMBINE_STATE_FILE = Path("data/combine_state.json")
+WEEKLY_USER_BUCKETS_FILE = Path("data/weekly_user_buckets.csv")
+
+Partitions = Dict[str, int]
+
+
+def list_partitions(data_dir: Union[str, Path]) -> Partitions:
+    """`{partition: mtime}` for a query output dir, from the parquet dataset if there is one, else the CSVs"""
+    d = Path(data_dir)
+    if store.has_flipside_dataset(d.name):
+        base_dir = Path(store.FLIPSIDE_DATASET_DIR, f"template={d.name}")
+        files = base_dir.glob("date=*/*.parquet")
+        return {str(x.relative_to(base_dir)): x.stat().st_mtime_ns for x in files}
+    return {x.name: x.stat().st_mtime_ns for x in d.glob("*.csv")}
+
+
+def read_partitions(data_dir: Union[str, Path], names: List[str], add_date: bool = False) -> pd.DataFrame:
+    """Read the named partitions; `add_date` adds each partition's date as a `DATE` column"""
+    d = Path(data_dir)
+    if len(names) == 0:
+        return pd.DataFrame()
+    if store.has_flipside_dataset(d.name):
+        df = store.read_flipside_partitions(d.name, names)
+        return df.rename(columns={"date": "DATE"}) if add_date else df.drop(columns="date")
+    dfs = []
+    for x in names:
+        df = pd.read_csv(Path(d, x))
+        if add_date:
+            df["DATE"] = store.get_partition_date(Path(x).stem)
+        dfs.append(df)
+    return pd.concat(dfs)
+
+
+class CombineState:
+    """Which source partitions (and their mtimes) have been folded into each combined output file.
+
+    The output's own mtime is recorded too, so an output rewritten outside of the incremental path (or
+    left half-written by an interrupted run) is rebuilt rather than appended to.
+    """
+
+    def __init__(self, path=COMBINE_STATE_FILE):
+        self.path = Path(path)
+        self.outputs = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.outputs = json.load(f)
+
+    def folded(self, output_file: Union[str, Path]) -> Optional[Partitions]:
+        """Partitions folded into `output_file`, or None if it must be rebuilt"""
+        output_file = Path(output_file)
+        info = self.outputs.get(str(output_file))
+        if info is None or not output_file.exists():
+            return None
+        if output_file.stat().st_mtime_ns != info["mtime"]:
+            return None
+        return info["partitions"]
+
+    def mark(self, output_file: Union[str, Path], partitions: Partitions) -> None:
+        output_file = Path(output_file)
+        self.outputs[str(output_file)] = {"mtime": output_file.stat().st_mtime_ns, "partitions": partitions}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.outputs, f)
+
+
+def read_new_partitions(
+    data_dir: Union[str, Path],
+    output_files: List[Union[str, Path]],
+    state: CombineState,
+    full: bool = False,
+    replace: bool = False,
+    add_date: bool = False,
+    start_date: Optional[datetime.date] = None,
+) -> Tuple[pd.DataFrame, Partitions, bool]:
+    """Rows from the partitions of `data_dir` not yet folded into all of `output_files`.
+
+    Returns `(rows, partitions, full)`: `partitions` is the current listing, to `state.mark` each output
+    with once it is written, and `full` means every partition was read and the outputs must be rewritten.
+    A partition that changed since it was folded forces a full rebuild, unless `replace` is set (for
+    outputs merged by key, where the new rows replace the old ones). Partitions dated before `start_date`
+    are never read.
+    """
+    partitions = list_partitions(data_dir)
+    folded = [state.folded(x) for x in output_files]
+    if not full and any(x is None for x in folded):
+        full = True
+    if not full and folded[1:] != folded[:-1]:
+        # The outputs were folded from different partitions, e.g. an interrupted run
+        full = True
+    if not full:
+        folded = folded[0]
+        changed = [k for k, v in folded.items() if partitions.get(k) != v]
+        if changed and not replace:
+            logging.info(f"#@# {len(changed)} folded partitions in {data_dir} changed, rebuilding")
+            full = True
+    if full:
+        names = sorted(partitions)
+    else:
+        names = sorted(k for k, v in partitions.items() if folded.get(k) != v)
+    if start_date is not None:
+        names = [x for x in names if store.get_partition_date(Path(x).stem) >= f"{start_date:%Y-%m-%d}"]
+    logging.info(f"#@# Reading {len(names)} of {len(partitions)} partitions from {data_dir}")
+    return read_partitions(data_dir, names, add_date=add_date), partitions, full
+
+
+def append_csv(df: pd.DataFrame, output_file: Union[str, Path]) -> None:
+    """Append rows to a (possibly gzipped) csv, in the existing file's column order
+
+    If the output has a Feather copy it is rewritten too, from the existing copy rather than the csv.
+    """
+    if len(df) == 0:
+        return
+    columns = pd.read_csv(output_file, nrows=0).columns
+    df = df.reindex(columns=columns)
+    feather_path = store.get_feather_path(output_file)
+    if feather_path.exists():
+        existing = store.read_output(output_file)
+    compression = "gzip" if str(output_file).endswith(".gz") else None
+    df.to_csv(output_file, mode="a", header=False, index=False, compression=compression)
+    if feather_path.exists():
+        store.write_feather(pd.concat([existing, df]), output_file)
+
+
+def merge_csv(df: pd.DataFrame, output_file: Union[str, Path], key: List[str], template: str) -> pd.DataFrame:
+    """Merge rows into a small csv, replacing any existing rows with the same `key`"""
+    existing = store.apply_column_types(pd.read_csv(output_file), template)
+    if len(df) > 0:
+        df = store.apply_column_types(df, template)
+        existing = pd.concat([existing, df]).drop_duplicates(subset=key, keep="last")
+    existing.to_csv(output_file, index=False)
+    return existing
+
+
+_user_bucket_cols = {"creation": "CREATION_DATE", "last_use": "LAST_USE"}
+_epoch = pd.Timestamp("1970-01-01")
+_week = pd.Timedelta("7d")
+
+
+def update_weekly_user_buckets(users: pd.DataFrame, buckets: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Add users to the weekly bucket sums behind the weekly user csvs.
+
+    Buckets are 7 day bins from the first day in the data, the same as `pd.Grouper(freq="7d")`, keyed by
+    creation date and by last use. Each bucket holds counts and sums of timestamps rather than means, so
+    a day of new users can be added without rereading the rest.
+    """
+    dfs = []
+    for kind, col in _user_bucket_cols.items():
+        x = users[users[col].notna()]
+        if buckets is None:
+            origin = x[col].min().normalize()
+        else:
+            origin = buckets.loc[buckets.kind == kind, "bucket"].min()
+        dfs.append(
+            pd.DataFrame(
+                {
+                    "kind": kind,
+                    "bucket": origin + ((x[col] - origin) // _week) * _week,
+                    "users": x.ADDRESS.notna().astype(int),
+                    "last_use_users": x.LAST_USE.notna().astype(int),
+                    "last_use_seconds": (x.LAST_USE - _epoch).dt.total_seconds(),
+                    "active_seconds": (x.LAST_USE - x.CREATION_DATE).dt.total_seconds(),
+                }
+            )
+        )
+    if buckets is not None:
+        dfs.append(buckets)
+    return pd.concat(dfs).groupby(["kind", "bucket"]).sum().reset_index()
+
+
+def get_weekly_user_stats(buckets: pd.DataFrame, today: pd.Timestamp) -> Dict[str, pd.DataFrame]:
+    """The weekly user csvs from the bucket sums, with empty weeks filled in like `pd.Grouper`"""
+    yesterday = today - pd.Timedelta("1d")
+    stats = {}
+    for kind, col in _user_bucket_cols.items():
+        b = buckets[buckets.kind == kind].set_index("bucket").sort_index()
+        b = b.reindex(pd.date_range(b.index.min(), b.index.max(), freq="7d"))
+        b.index.name = col
+        stats[kind] = b.fillna(0).reset_index()
+
+    last_use = stats["last_use"]
+    stats["weekly_users_last_use"] = pd.DataFrame(
+        {"LAST_USE": last_use.LAST_USE, "ADDRESS": last_use.users.astype(int)}
+    )
+
+    creation = stats.pop("creation")
+    n = creation.last_use_users.where(creation.last_use_users > 0)
+    mean_last_use = _epoch + pd.to_timedelta(creation.last_use_seconds / n, unit="s")
+    stats["weekly_days_since_last_use"] = pd.DataFrame(
+        {
+            "CREATION_DATE": creation.CREATION_DATE,
+            "Days since last use": (yesterday - mean_last_use).dt.total_seconds() / 3600 / 24,
+            "Days since creation": (yesterday - creation.CREATION_DATE).dt.total_seconds() / 3600 / 24,
+        }
+    )
+    stats["weekly_days_active"] = pd.DataFrame(
+        {
+            "CREATION_DATE": creation.CREATION_DATE,
+            "Days Active": creation.active_seconds / n / 3600 / 24,
+        }
+    )
+    del stats["last_use"]
+    return stats
@@ -0,0 +1,176 @@
+"""Concurrent JSON metadata fetching from IPFS, hedged across resolvers, with a cache keyed by CID"""
+
+from typing import Dict, Iterable, List, Optional, Union
+
+import asyncio
+import datetime
+import json
+import logging
+import sqlite3
+from dataclasses import replace
+from pathlib import Path
+from urllib.parse import urlparse
+
+import httpx
+
+from .http_client import AsyncHttp, get_policy
+
+__all__ = [
+    "IPFS_CACHE_FILE",
+    "IPFS_RESOLVERS",
+    "IPFS_RESOLVER_ALT_URL",
+    "IPFS_RESOLVER_URL",
+    "IpfsCache",
+    "fetch_json",
+    "fetch_json_async",
+    "get_cid",
+    "get_resolver_urls",
+]
+
+IPFS_RESOLVER_URL = "https://cloudflare-ipfs.com/ipfs"
+IPFS_RESOLVER_ALT_URL = "https://ipfs.io/ipfs"
+# In order of preference
+IPFS_RESOLVERS = [IPFS_RESOLVER_URL, IPFS_RESOLVER_ALT_URL]
+IPFS_CACHE_FILE = Path("data/ipfs_cache.sqlite")
+
+
+def get_cid(uri: str) -> Optional[str]:
+    """The `<cid>/<path>` an `ipfs://` uri or IPFS gateway url points to, None for other urls"""
+    parsed = urlparse(uri)
+    if parsed.scheme == "ipfs":
+        return f"{parsed.netloc}{parsed.path}".strip("/")
+    if "/ipfs/" in parsed.path:
+        return parsed.path.split("/ipfs/", 1)[1].strip("/")
+    return None
+
+
+def get_resolver_urls(uri: str) -> List[str]:
+    cid = get_cid(uri)
+    if cid is None:
+        return [uri]
+    return [f"{x}/{cid}" for x in IPFS_RESOLVERS]
+
+
+class IpfsCache:
+    """JSON documents by CID. IPFS content never changes, so entries never expire."""
+
+    def __init__(self, path: Union[str, Path] = IPFS_CACHE_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS content (
+                cid TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, cids: Iterable[str]) -> Dict[str, dict]:
+        cids = list(set(cids))
+        found = {}
+        for i in range(0, len(cids), 500):
+            chunk = cids[i : i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.conn.execute(f"SELECT cid, data FROM content WHERE cid IN ({placeholders})", chunk)
+            found.update({cid: json.loads(data) for cid, data in rows})
+        return found
+
+    def put(self, documents: Dict[str, dict]) -> None:
+        fetched_at = datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO content (cid, data, fetched_at) VALUES (?, ?, ?)",
+            [(k, json.dumps(v), fetched_at) for k, v in documents.items()],
+        )
+        self.conn.commit()
+
+
+async def _get_json(http: AsyncHttp, url: str, timeout: float) -> dict:
+    # Hedging is the retry, so each resolver is asked once
+    r = await http.request("GET", url, max_retries=1, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+async def _get_hedged(http: AsyncHttp, urls: List[str], hedge_delay: float, timeout: float) -> dict:
+    """The first good response, asking the next url whenever one fails or is slower than `hedge_delay`"""
+    pending = set()
+    error = None
+    try:
+        for url in urls:
+            pending.add(asyncio.create_task(_get_json(http, url, timeout)))
+            done, pending = await asyncio.wait(
+                pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_json_async(
+    uris: Iterable[str],
+    max_concurrency: int = 16,
+    hedge_delay: float = 2.0,
+    timeout: float = 20.0,
+    max_retries: int = 2,
+    cache_path: Union[str, Path] = IPFS_CACHE_FILE,
+) -> Dict[str, Optional[dict]]:
+    """`{uri: json}` for each uri, None where every resolver failed.
+
+    IPFS uris are answered from the cache where possible. Otherwise the preferred resolver is asked
+    first, and the next is raced against it if it hasn't answered within `hedge_delay` seconds (or as soon
+    as it fails). Fetched IPFS documents are cached by CID; other urls are always fetched.
+    """
+    uris = list(dict.fromkeys(uris))
+    cids = {x: get_cid(x) for x in uris}
+    cache = IpfsCache(cache_path)
+    try:
+        cached = cache.get(x for x in cids.values() if x is not None)
+        results = {x: cached[cids[x]] for x in uris if cids[x] in cached}
+        misses = [x for x in uris if x not in results]
+        logging.info(f"#@# Fetching {len(misses)} of {len(uris)} uris, the rest are cached")
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        resolver_hosts = [urlparse(x).netloc for x in IPFS_RESOLVERS]
+        policies = {x: replace(get_policy(x), max_connections=max_concurrency) for x in resolver_hosts}
+        async with AsyncHttp(policies) as http:
+
+            async def fetch(uri):
+                async with semaphore:
+                    for attempt in range(1, max_retries + 1):
+                        try:
+                            return uri, await _get_hedged(http, get_resolver_urls(uri), hedge_delay, timeout)
+                        except (httpx.HTTPError, ValueError) as e:
+                            if attempt == max_retries:
+                                logging.warning(f"Request failed for: {uri} -- {e!r}")
+                                return uri, None
+                            await asyncio.sleep(2**attempt)
+
+            fetched = dict(await asyncio.gather(*[fetch(x) for x in misses]))
+        cache.put({cids[k]: v for k, v in fetched.items() if v is not None and cids[k] is not None})
+    finally:
+        cache.close()
+    results.update(fetched)
+    return results
+
+
+def fetch_json(uris: Iterable[str], **kwargs) -> Dict[str, Optional[dict]]:
+    return asyncio.run(fetch_json_async(uris, **kwargs))
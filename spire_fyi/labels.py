@@ -0,0 +1,216 @@
+"""One label table for every address, from the manual, Flipside and solana.fm label sources"""
+
+from typing import Iterable, List, Optional, Sequence, Union
+
+import datetime
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "FLIPSIDE_COLUMNS",
+    "LABELS_FILE",
+    "LABEL_TTL",
+    "SOLANA_FM_COLUMNS",
+    "SOURCES",
+    "LabelStore",
+]
+
+LABELS_FILE = Path("data/labels.sqlite")
+
+# In order of precedence
+SOURCES = ("manual", "flipside", "solana_fm")
+FLIPSIDE_COLUMNS = ["BLOCKCHAIN", "CREATOR", "LABEL_TYPE", "LABEL_SUBTYPE", "LABEL", "ADDRESS_NAME"]
+SOLANA_FM_COLUMNS = [
+    "FriendlyName",
+    "Abbreviation",
+    "Category",
+    "VoteKey",
+    "Network",
+    "Tags",
+    "LogoURI",
+    "Flag",
+]
+# How long a fetched label (or the absence of one) is trusted before the address is asked about again
+LABEL_TTL = {
+    "flipside": datetime.timedelta(days=30),
+    "solana_fm": datetime.timedelta(days=7),
+}
+# Manual labels use the Flipside columns, and override them
+_column_groups = [
+    (FLIPSIDE_COLUMNS, ("manual", "flipside")),
+    (SOLANA_FM_COLUMNS, ("solana_fm",)),
+]
+
+
+def _to_json(row: dict) -> str:
+    return json.dumps(
+        {k: (None if not isinstance(v, (list, dict)) and pd.isna(v) else v) for k, v in row.items()}
+    )
+
+
+def _unpack(rows: pd.DataFrame) -> pd.DataFrame:
+    data = pd.DataFrame([json.loads(x) for x in rows.data], index=rows.index)
+    return pd.concat([rows.drop(columns="data"), data], axis=1)
+
+
+class LabelStore:
+    """Labels keyed by `(address, source)`, each with the time it was last refreshed.
+
+    `lookup` resolves one row per address: the Flipside label columns come from a manual label if there is
+    one, else Flipside, and the solana.fm columns from solana.fm. Addresses a source was asked about but
+    had no label for are kept as empty rows, so they aren't asked about again until they are `stale`.
+    """
+
+    def __init__(self, path=LABELS_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS labels (
+                address TEXT NOT NULL,
+                source TEXT NOT NULL,
+                data TEXT NOT NULL,
+                refreshed_at TEXT NOT NULL,
+                PRIMARY KEY (address, source)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def upsert(
+        self,
+        df: pd.DataFrame,
+        source: str,
+        address_col: str = "ADDRESS",
+        replace: bool = False,
+        refreshed_at: Optional[datetime.datetime] = None,
+    ) -> None:
+        """Add or update labels from `source`; with `replace`, labels from that source not in `df` are removed"""
+        if source not in SOURCES:
+            raise ValueError(f"Unknown label source {source}, expected one of {SOURCES}")
+        refreshed_at = (refreshed_at or datetime.datetime.now()).isoformat(sep=" ", timespec="seconds")
+        df = df.drop_duplicates(subset=address_col, keep="last")
+        records = df.drop(columns=address_col).to_dict(orient="records")
+        if replace:
+            self.conn.execute("DELETE FROM labels WHERE source = ?", (source,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO labels (address, source, data, refreshed_at) VALUES (?, ?, ?, ?)",
+            [(a, source, _to_json(x), refreshed_at) for a, x in zip(df[address_col], records)],
+        )
+        self.conn.commit()
+
+    def _query(self, sql: str, addresses: Iterable[str], params: Sequence = ()) -> pd.DataFrame:
+        # Join against a temp table rather than a huge `IN (...)` list
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (address TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM temp.lookup")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO temp.lookup (address) VALUES (?)", [(x,) for x in addresses if pd.notna(x)]
+        )
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def lookup(self, addresses: Iterable[str], sources: Sequence[str] = SOURCES) -> pd.DataFrame:
+        """One row of label columns per labeled address, with the address in an `ADDRESS` column"""
+        placeholders = ", ".join("?" for _ in sources)
+        rows = self._query(
+            f"""
+            SELECT l.address, l.source, l.data FROM labels l JOIN temp.lookup USING (address)
+            WHERE l.source IN ({placeholders}) AND l.data != '{{}}'
+            """,
+            addresses,
+            params=list(sources),
+        )
+        rows = _unpack(rows)
+        rows["precedence"] = rows.source.map({x: i for i, x in enumerate(SOURCES)})
+        rows = rows.sort_values(by="precedence", kind="stable")
+
+        labels = pd.DataFrame({"ADDRESS": pd.Series(pd.unique(rows.address), dtype=object)})
+        for columns, group_sources in _column_groups:
+            if not any(x in sources for x in group_sources):
+                continue
+            group = rows[rows.source.isin(group_sources)].drop_duplicates(subset="address")
+            group = group.reindex(columns=["address", *columns]).rename(columns={"address": "ADDRESS"})
+            labels = labels.merge(group, on="ADDRESS", how="left")
+        return labels
+
+    def refreshed_at(self, addresses: Iterable[str], source: str) -> pd.Series:
+        """When each address was last labeled by `source`, NaT if never"""
+        addresses = list(addresses)
+        rows = self._query(
+            """
+            SELECT l.address, l.refreshed_at FROM labels l JOIN temp.lookup USING (address)
+            WHERE l.source = ?
+            """,
+            addresses,
+            params=[source],
+        )
+        refreshed = pd.to_datetime(rows.set_index("address").refreshed_at)
+        return refreshed.reindex(addresses)
+
+    def stale(
+        self,
+        addresses: Iterable[str],
+        source: str,
+        ttl: Optional[datetime.timedelta] = None,
+        now: Optional[datetime.datetime] = None,
+    ) -> np.ndarray:
+        """The unique addresses `source` hasn't been asked about within `ttl` (default `LABEL_TTL[source]`)"""
+        ttl = LABEL_TTL[source] if ttl is None else ttl
+        now = now or datetime.datetime.now()
+        addresses = pd.unique(pd.Series(addresses, dtype=object).dropna())
+        refreshed = self.refreshed_at(addresses, source)
+        return addresses[(refreshed.isna() | (refreshed <= now - ttl)).values]
+
+    def mark_checked(
+        self, addresses: Iterable[str], source: str, refreshed_at: Optional[datetime.datetime] = None
+    ) -> None:
+        """Record that `source` was asked about `addresses`, whether or not it had labels for them"""
+        refreshed_at = (refreshed_at or datetime.datetime.now()).isoformat(sep=" ", timespec="seconds")
+        self.conn.executemany(
+            """
+            INSERT INTO labels (address, source, data, refreshed_at) VALUES (?, ?, '{}', ?)
+            ON CONFLICT (address, source) DO UPDATE SET refreshed_at = excluded.refreshed_at
+            """,
+            [(x, source, refreshed_at) for x in pd.unique(pd.Series(addresses, dtype=object).dropna())],
+        )
+        self.conn.commit()
+
+    def export_csv(
+        self, addresses: Iterable[str], source: str, output_file: Union[str, Path]
+    ) -> pd.DataFrame:
+        """Write `source`'s labels for `addresses`, and those already in `output_file`, to `output_file`"""
+        addresses = pd.Series(addresses, dtype=object)
+        if Path(output_file).exists():
+            addresses = pd.concat([addresses, pd.read_csv(output_file, usecols=["ADDRESS"]).ADDRESS])
+        rows = self._query(
+            """
+            SELECT l.address AS ADDRESS, l.data FROM labels l JOIN temp.lookup USING (address)
+            WHERE l.source = ? AND l.data != '{}' ORDER BY l.address
+            """,
+            addresses.unique(),
+            params=[source],
+        )
+        df = _unpack(rows)
+        df.to_csv(output_file, index=False)
+        return df
+
+    def import_csvs(self, data_dir: Union[str, Path] = "data") -> List[Path]:
+        """Load the `<prefix>_{manual,flipside,solana_fm}_labels.csv` files, dated by their mtimes"""
+        files = []
+        for source in SOURCES:
+            for x in sorted(Path(data_dir).glob(f"*_{source}_labels.csv"), key=lambda x: x.stat().st_mtime):
+                df = pd.read_csv(x)
+                refreshed_at = datetime.datetime.fromtimestamp(x.stat().st_mtime)
+                self.upsert(df, source, refreshed_at=refreshed_at)
+                files.append(x)
+        return files
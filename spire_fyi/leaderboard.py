@@ -0,0 +1,140 @@
+"""Precomputed per-program aggregates ("leaderboard cube") for the top programs on Program Activity.
+
+For each date range preset, and each combination of the solana and oracle exclusions, the cube holds
+every program's mean, sum and max daily TX_COUNT and SIGNERS. Picking the top programs for a metric is
+then a lookup and a sort of a few thousand rows, instead of a filter and groupby of the whole labeled
+program frame. The presets are relative to today, so the combine step builds the cube for the start
+dates of today and the next few days; a page on a day the cube doesn't cover falls back to the groupby.
+"""
+
+from typing import List, Optional, Union
+
+import datetime
+import itertools
+from pathlib import Path
+
+import pandas as pd
+
+__all__ = [
+    "AGG_METHODS",
+    "COLUMNS",
+    "DATE_RANGES",
+    "METRICS",
+    "build_cube",
+    "filter_programs",
+    "get_cube_path",
+    "get_start_date",
+    "read_cube",
+    "top_programs",
+    "write_cube",
+]
+
+DATE_RANGES = ["90d", "60d", "30d", "14d", "7d"]
+METRICS = ["TX_COUNT", "SIGNERS"]
+AGG_METHODS = ["mean", "sum", "max"]
+# Columns of the labeled program frames the cube is built from
+COLUMNS = ["Date", "PROGRAM_ID", *METRICS, "LABEL", "LABEL_SUBTYPE", "FriendlyName"]
+_key = ["DATE_RANGE", "START_DATE", "EXCLUDE_SOLANA", "EXCLUDE_ORACLE"]
+
+
+def get_cube_path(output_file: Union[str, Path]) -> Path:
+    """`data/<name>_leaderboard.parquet` for a labeled program output `data/<name>.csv(.gz)`"""
+    output_file = Path(output_file)
+    name = output_file.name.removesuffix(".gz").removesuffix(".csv")
+    return output_file.with_name(f"{name}_leaderboard.parquet")
+
+
+def get_start_date(date_range: str, now: Optional[datetime.datetime] = None) -> Optional[pd.Timestamp]:
+    """First date in a date range, None for "All dates".
+
+    Dates are whole days, so `Date >= now - date_range` is `Date >= ` this.
+    """
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    if date_range == "All dates":
+        return None
+    if date_range == "Year to Date":
+        return pd.Timestamp("2022-01-01")
+    return (now - pd.Timedelta(date_range)).ceil("D")
+
+
+def filter_programs(
+    df: pd.DataFrame,
+    date_range: str,
+    exclude_solana: bool,
+    exclude_oracle: bool,
+    now: Optional[datetime.datetime] = None,
+) -> pd.DataFrame:
+    """Rows of a labeled program frame in `date_range`, without solana system programs or oracles"""
+    start_date = get_start_date(date_range, now)
+    if start_date is not None:
+        df = df[df.Date >= start_date]
+    if exclude_solana:
+        df = df[df.LABEL != "solana"]
+    if exclude_oracle:
+        df = df[
+            ~df.LABEL.isin(["pyth", "switchboard"])
+            & ~df.FriendlyName.isin(["SwitchBoard V2 Program", "Chainlink Program"])
+            & ~df.LABEL_SUBTYPE.isin(["oracle"])
+        ]
+    return df
+
+
+def build_cube(df: pd.DataFrame, now: Optional[datetime.datetime] = None, days: int = 3) -> pd.DataFrame:
+    """Aggregates of each program for each preset, exclusion combination and the start dates of `days` days
+
+    Columns are the `_key` columns, PROGRAM_ID, and `<metric>_<agg_method>` for each metric and method.
+    """
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    df = df[COLUMNS].copy()
+    df["Date"] = pd.to_datetime(df["Date"])
+    # Only the widest range is ever needed
+    df = df[df.Date >= get_start_date(DATE_RANGES[0], now)]
+    cubes = []
+    for exclude_solana, exclude_oracle in itertools.product([False, True], repeat=2):
+        excluded = filter_programs(df, "All dates", exclude_solana, exclude_oracle)
+        for date_range, day in itertools.product(DATE_RANGES, range(days)):
+            start_date = get_start_date(date_range, now + pd.Timedelta(days=day))
+            agg = excluded[excluded.Date >= start_date].groupby("PROGRAM_ID")[METRICS].agg(AGG_METHODS)
+            agg.columns = [f"{metric}_{agg_method}" for metric, agg_method in agg.columns]
+            cubes.append(
+                agg.reset_index().assign(
+                    DATE_RANGE=date_range,
+                    START_DATE=start_date,
+                    EXCLUDE_SOLANA=exclude_solana,
+                    EXCLUDE_ORACLE=exclude_oracle,
+                )
+            )
+    columns = [*_key, "PROGRAM_ID", *[f"{x}_{y}" for x in METRICS for y in AGG_METHODS]]
+    return pd.concat(cubes, ignore_index=True)[columns]
+
+
+def write_cube(cube: pd.DataFrame, output_file: Union[str, Path]) -> Path:
+    path = get_cube_path(output_file)
+    cube.to_parquet(path, index=False)
+    return path
+
+
+def read_cube(output_file: Union[str, Path]) -> Optional[pd.DataFrame]:
+    """The cube of a labeled program output, indexed by `_key` for lookups, or None if there isn't one"""
+    path = get_cube_path(output_file)
+    if not path.exists():
+        return None
+    return pd.read_parquet(path).set_index(_key).sort_index()
+
+
+def top_programs(
+    cube: pd.DataFrame,
+    metric: str,
+    agg_method: str,
+    date_range: str,
+    exclude_solana: bool,
+    exclude_oracle: bool,
+    n: int,
+    now: Optional[datetime.datetime] = None,
+) -> Optional[List[str]]:
+    """The top `n` program ids by `agg_method` of `metric`, or None if the cube doesn't cover the request"""
+    key = (date_range, get_start_date(date_range, now), exclude_solana, exclude_oracle)
+    if date_range not in DATE_RANGES or key not in cube.index:
+        return None
+    programs = cube.loc[key]
+    return programs.sort_values(by=f"{metric}_{agg_method}", ascending=False).PROGRAM_ID.iloc[:n].tolist()
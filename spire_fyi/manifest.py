@@ -0,0 +1,156 @@
+"""Persistent record of Flipside query jobs, so interrupted backfills can resume where they stopped"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import datetime
+import hashlib
+import sqlite3
+from pathlib import Path
+
+from .executor import QueryInfo, QueryResult
+from .store import get_partition_path, split_output_file
+
+__all__ = [
+    "JobManifest",
+    "job_key",
+]
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JobKey = Tuple[str, str, str]
+
+
+def job_key(query_info: QueryInfo) -> JobKey:
+    """`(template, params, sql_hash)` for a `(query, output_file)` tuple.
+
+    Output files are always `data/<template>/<template>_<params>.csv`, where params are the
+    date/program/wallet parts of the file name.
+    """
+    query, output_file = query_info
+    template, params = split_output_file(output_file)
+    sql_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+    return template, params, sql_hash
+
+
+class JobManifest:
+    def __init__(self, path="data/job_manifest.sqlite"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                template TEXT NOT NULL,
+                params TEXT NOT NULL,
+                sql_hash TEXT NOT NULL,
+                output_file TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                row_count INTEGER,
+                duration REAL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (template, params, sql_hash)
+            )
+            """
+        )
+        self.conn.commit()
+        self._done = set(
+            self.conn.execute("SELECT template, params, sql_hash FROM jobs WHERE status = ?", (DONE,))
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _now(self) -> str:
+        return datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
+
+    def is_done(self, query_info: QueryInfo) -> bool:
+        return job_key(query_info) in self._done
+
+    def register(self, query_info: Iterable[QueryInfo]) -> None:
+        now = self._now()
+        self.conn.executemany(
+            """
+            INSERT OR IGNORE INTO jobs (template, params, sql_hash, output_file, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(*job_key(x), str(x[1]), PENDING, now) for x in query_info],
+        )
+        self.conn.commit()
+
+    def import_existing(self, query_info: Iterable[QueryInfo]) -> List[QueryInfo]:
+        """Mark jobs with an output file already on disk, but no manifest entry for that output, as done.
+
+        Only needed when first moving a data directory over to the manifest. An output with an entry under
+        another `sql_hash` was made by an older version of the query, so that job is left to run. Returns
+        the jobs still to run.
+        """
+        known = set(self.conn.execute("SELECT template, params FROM jobs"))
+        todo = []
+        existing = []
+        for x in query_info:
+            key = job_key(x)
+            output_exists = Path(x[1]).exists() or get_partition_path(*split_output_file(x[1])).exists()
+            if key[:2] not in known and output_exists:
+                existing.append((*key, str(x[1]), DONE, self._now()))
+                self._done.add(key)
+            else:
+                todo.append(x)
+        self.conn.executemany(
+            """
+            INSERT OR IGNORE INTO jobs (template, params, sql_hash, output_file, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            existing,
+        )
+        self.conn.commit()
+        return todo
+
+    def mark_done(self, query_info: QueryInfo, row_count: Optional[int] = None) -> None:
+        """Record a job whose output was made without running it, e.g. copied from an earlier run"""
+        key = job_key(query_info)
+        self.conn.execute(
+            """
+            INSERT INTO jobs (template, params, sql_hash, output_file, status, row_count, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (template, params, sql_hash) DO UPDATE SET
+                status = excluded.status, row_count = excluded.row_count, updated_at = excluded.updated_at
+            """,
+            (*key, str(query_info[1]), DONE, row_count, self._now()),
+        )
+        self.conn.commit()
+        self._done.add(key)
+
+    def start(self, query_info: QueryInfo) -> None:
+        self.conn.execute(
+            """
+            UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?
+            WHERE template = ? AND params = ? AND sql_hash = ?
+            """,
+            (RUNNING, self._now(), *job_key(query_info)),
+        )
+        self.conn.commit()
+
+    def record(self, result: QueryResult) -> None:
+        key = job_key(result.query_info)
+        if result.ok:
+            status, error, row_count = DONE, None, result.result
+            self._done.add(key)
+        else:
+            status, error, row_count = FAILED, str(result.error), None
+        self.conn.execute(
+            """
+            UPDATE jobs
+            SET status = ?, attempts = attempts + ?, last_error = ?, row_count = ?, duration = ?, updated_at = ?
+            WHERE template = ? AND params = ? AND sql_hash = ?
+            """,
+            (status, max(result.attempts - 1, 0), error, row_count, result.duration, self._now(), *key),
+        )
+        self.conn.commit()
+
+    def summary(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
@@ -0,0 +1,128 @@
+"""Program overlap networks: the share of signers each pair of programs has in common"""
+
+from typing import Optional, Sequence, Tuple
+
+import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+__all__ = [
+    "get_incidence_matrix",
+    "get_last_seen_matrix",
+    "get_overlap_network",
+    "get_window_incidence",
+    "update_last_seen",
+]
+
+
+def get_incidence_matrix(
+    df: pd.DataFrame, programs: Sequence[str], program_col="Program ID", address_col="Address"
+) -> sparse.csr_matrix:
+    """Program x signer matrix with a 1 where the signer used the program; rows are in `programs` order"""
+    program_idx = pd.Categorical(df[program_col], categories=programs).codes
+    keep = program_idx >= 0
+    address_idx, addresses = pd.factorize(df[address_col][keep])
+    incidence = sparse.csr_matrix(
+        (np.ones(len(address_idx), dtype=np.int64), (program_idx[keep], address_idx)),
+        shape=(len(programs), len(addresses)),
+    )
+    # Duplicate (program, signer) rows are summed when building the matrix
+    incidence.data[:] = 1
+    return incidence
+
+
+def update_last_seen(
+    signers: pd.DataFrame,
+    last_seen: Optional[pd.DataFrame] = None,
+    start_date: Optional[datetime.date] = None,
+) -> pd.DataFrame:
+    """Latest `Date` each signer used each program, from `Date, Program ID, Address` rows.
+
+    New days of signers are folded into an existing `last_seen`, and pairs not seen since `start_date`
+    are dropped, so the table only ever holds the longest window.
+    """
+    cols = ["Program ID", "Address", "Date"]
+    dfs = [x[cols] for x in [last_seen, signers] if x is not None and len(x) > 0]
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=cols)
+    df = pd.concat(dfs)
+    df["Date"] = pd.to_datetime(df.Date)
+    if start_date is not None:
+        df = df[df.Date >= pd.Timestamp(start_date)]
+    return df.groupby(["Program ID", "Address"], as_index=False, sort=False).Date.max()
+
+
+def get_last_seen_matrix(last_seen: pd.DataFrame) -> Tuple[sparse.csr_matrix, pd.Index]:
+    """Program x signer matrix holding the last date (as int64 ns) each signer used each program"""
+    program_idx, programs = pd.factorize(last_seen["Program ID"])
+    address_idx, addresses = pd.factorize(last_seen.Address)
+    matrix = sparse.csr_matrix(
+        (pd.to_datetime(last_seen.Date).values.astype(np.int64), (program_idx, address_idx)),
+        shape=(len(programs), len(addresses)),
+    )
+    return matrix, pd.Index(programs)
+
+
+def get_window_incidence(
+    last_seen_matrix: sparse.csr_matrix,
+    matrix_programs: pd.Index,
+    programs: Sequence[str],
+    cutoff_date: datetime.datetime,
+) -> sparse.csr_matrix:
+    """Incidence matrix for signers active on or after `cutoff_date`, with rows in `programs` order
+
+    Every window is a threshold on the same last seen matrix, so the signer data is only grouped once.
+    """
+    incidence = last_seen_matrix.copy()
+    incidence.data = (incidence.data >= pd.Timestamp(cutoff_date).value).astype(np.int64)
+    incidence.eliminate_zeros()
+    rows = matrix_programs.get_indexer(programs)
+    keep = np.flatnonzero(rows >= 0)
+    select = sparse.csr_matrix(
+        (np.ones(len(keep), dtype=np.int64), (keep, rows[keep])),
+        shape=(len(programs), len(matrix_programs)),
+    )
+    return (select @ incidence).tocsr()
+
+
+def get_overlap_network(
+    incidence: sparse.csr_matrix,
+    programs: Sequence[str],
+    names: Sequence[str],
+    min_users: int = 10,
+    min_overlap: int = 0,
+) -> pd.DataFrame:
+    """Jaccard weight (shared signers / all signers) for each pair of programs with `min_users` signers
+
+    All pairwise intersections come from one sparse product of the incidence matrix with its transpose.
+    Pairs with no shared signers are included (weight 0) unless `min_overlap` is set.
+    """
+    programs = np.asarray(programs)
+    names = np.asarray(names)
+    n_users = np.asarray(incidence.sum(axis=1)).ravel()
+    overlap = (incidence @ incidence.T).tocsr()
+
+    if min_overlap > 0:
+        pairs = sparse.triu(overlap, k=1).tocoo()
+        i, j, n_overlap = pairs.row, pairs.col, pairs.data
+        keep = (n_overlap >= min_overlap) & (n_users[i] >= min_users) & (n_users[j] >= min_users)
+        i, j, n_overlap = i[keep], j[keep], n_overlap[keep]
+        order = np.lexsort((j, i))
+        i, j, n_overlap = i[order], j[order], n_overlap[order]
+    else:
+        eligible = np.flatnonzero(n_users >= min_users)
+        a, b = np.triu_indices(len(eligible), k=1)
+        i, j = eligible[a], eligible[b]
+        n_overlap = np.asarray(overlap[i, j]).ravel()
+
+    return pd.DataFrame(
+        {
+            "Program1": programs[i],
+            "Program2": programs[j],
+            "Name1": names[i],
+            "Name2": names[j],
+            "weight": n_overlap / (n_users[i] + n_users[j] - n_overlap),
+        }
+    )
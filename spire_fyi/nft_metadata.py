@@ -0,0 +1,191 @@
+"""Concurrent Helius token metadata ingestion into one parquet table keyed by mint"""
+
+from typing import Iterable, List, Optional, Union
+
+import asyncio
+import json
+import logging
+import shutil
+from dataclasses import replace
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from .http_client import AsyncHttp, get_policy
+
+__all__ = [
+    "HELIUS_METADATA_URL",
+    "NFT_METADATA_FILE",
+    "NftMetadataTable",
+    "get_top_creator_info",
+    "ingest",
+    "ingest_async",
+    "parse_token_metadata",
+]
+
+HELIUS_METADATA_URL = "https://api.helius.xyz/v0/tokens/metadata"
+NFT_METADATA_FILE = Path("data/nft_metadata.parquet")
+BATCH_SIZE = 100
+
+
+def get_top_creator_info(creators):
+    data = {"creator_address": "", "creator_share": 0}
+    for x in creators:
+        if x["share"] > data["creator_share"]:
+            data["creator_share"] = x["share"]
+            data["creator_address"] = x["address"]
+    return data
+
+
+def parse_token_metadata(y: dict) -> dict:
+    """The metadata columns we keep for one mint, with `has_metadata` False if it has no on-chain data"""
+    mint = y["mint"]
+    try:
+        onchain = y["onChainData"]
+        onchaindata = onchain["data"]
+    except (KeyError, TypeError):
+        return {"mint": mint, "has_metadata": False}
+    if not isinstance(onchaindata, dict):
+        return {"mint": mint, "has_metadata": False}
+    try:
+        creator_info = get_top_creator_info(onchaindata["creators"])
+    except (KeyError, TypeError):
+        creator_info = {"creator_address": "", "creator_share": 0}
+    return {
+        "mint": mint,
+        "has_metadata": True,
+        "name": onchaindata.get("name", ""),
+        "symbol": onchaindata.get("symbol", ""),
+        "seller_fee_basis_points": onchaindata.get("sellerFeeBasisPoints", 0),
+        "uri": onchaindata.get("uri", ""),
+        "update_authority": onchain.get("updateAuthority", ""),
+        **creator_info,
+    }
+
+
+class NftMetadataTable:
+    """Metadata for every mint checked so far, including those without metadata.
+
+    New rows are checkpointed as part files next to the table as they are fetched, so an interrupted
+    ingest keeps its progress, and `compact` folds them into the table.
+    """
+
+    def __init__(self, path: Union[str, Path] = NFT_METADATA_FILE):
+        self.path = Path(path)
+        self.parts_dir = self.path.with_name(f"{self.path.stem}_parts")
+
+    def _files(self) -> List[Path]:
+        parts = sorted(self.parts_dir.glob("part-*.parquet")) if self.parts_dir.exists() else []
+        return ([self.path] if self.path.exists() else []) + parts
+
+    def read(self, with_metadata_only: bool = True) -> pd.DataFrame:
+        files = self._files()
+        if len(files) == 0:
+            return pd.DataFrame(columns=["mint", "has_metadata"])
+        df = pd.concat([pd.read_parquet(x) for x in files]).drop_duplicates(subset="mint", keep="last")
+        if with_metadata_only:
+            df = df[df.has_metadata].drop(columns="has_metadata")
+            # Mints without metadata made these float
+            df = df.astype(
+                {x: "int64" for x in ["seller_fee_basis_points", "creator_share"] if x in df.columns}
+            )
+        return df.reset_index(drop=True)
+
+    def checked(self) -> pd.Index:
+        """Mints already asked about, the checkpoint of which still need fetching"""
+        mints = [pd.read_parquet(x, columns=["mint"]).mint for x in self._files()]
+        return pd.Index(pd.concat(mints).unique() if mints else [], dtype=object)
+
+    def append(self, rows: List[dict]) -> None:
+        if len(rows) == 0:
+            return
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        n = len(list(self.parts_dir.glob("part-*.parquet")))
+        pd.DataFrame(rows).to_parquet(Path(self.parts_dir, f"part-{n:05d}.parquet"), index=False)
+
+    def compact(self) -> None:
+        if not self.parts_dir.exists():
+            return
+        df = self.read(with_metadata_only=False)
+        tmp = self.path.with_suffix(".tmp")
+        df.to_parquet(tmp, index=False)
+        tmp.replace(self.path)
+        shutil.rmtree(self.parts_dir)
+
+    def import_legacy(
+        self,
+        checked_file: Union[str, Path] = "data/checked_for_metadata.txt",
+        json_dir: Union[str, Path] = "data/nft_metadata",
+    ) -> int:
+        """Load the old per-mint json files and checked mints list, if they exist"""
+        rows = []
+        for x in Path(json_dir).glob("*.json"):
+            with open(x) as f:
+                rows.append({**json.load(f), "has_metadata": True})
+        with_metadata = {x["mint"] for x in rows}
+        if Path(checked_file).exists():
+            with open(checked_file) as f:
+                checked = {x.strip() for x in f if x.strip()}
+            rows += [{"mint": x, "has_metadata": False} for x in sorted(checked - with_metadata)]
+        self.append(rows)
+        self.compact()
+        return len(rows)
+
+
+async def _fetch_batch(http: AsyncHttp, url: str, mints: List[str], max_retries: int) -> List[dict]:
+    r = await http.request("POST", url, json={"mintAccounts": mints}, max_retries=max_retries)
+    r.raise_for_status()
+    return [parse_token_metadata(y) for y in r.json()]
+
+
+async def ingest_async(
+    mints: Iterable[str],
+    api_key: str,
+    table: Optional[NftMetadataTable] = None,
+    batch_size: int = BATCH_SIZE,
+    max_concurrency: int = 4,
+    max_retries: int = 5,
+    base_delay: float = 2.0,
+    checkpoint_rows: int = 5000,
+) -> NftMetadataTable:
+    """Fetch metadata for the `mints` not yet in `table`, checkpointing every `checkpoint_rows` mints.
+
+    Batches of `batch_size` mints are posted with at most `max_concurrency` in flight; 429s, 5xxs and
+    connection errors are retried with backoff. Batches that still fail are left out of the table, so
+    they are fetched again next time.
+    """
+    table = NftMetadataTable() if table is None else table
+    mints = pd.Index(pd.unique(pd.Series(list(mints), dtype=str))).difference(table.checked())
+    batches = [mints[i : i + batch_size].tolist() for i in range(0, len(mints), batch_size)]
+    logging.info(f"#@# Fetching Helius metadata for {len(mints)} new mints in {len(batches)} requests")
+
+    url = f"{HELIUS_METADATA_URL}?api-key={api_key}"
+    host = urlparse(HELIUS_METADATA_URL).netloc
+    policy = replace(get_policy(host), max_connections=max_concurrency, base_delay=base_delay)
+    pending_rows = []
+    n_failed = 0
+    async with AsyncHttp({host: policy}) as http:
+
+        async def run(batch):
+            return await _fetch_batch(http, url, batch, max_retries)
+
+        for i, task in enumerate(asyncio.as_completed([run(x) for x in batches])):
+            try:
+                pending_rows += await task
+            except Exception as e:
+                logging.info(f"[ERROR] (helius) {e}")
+                n_failed += 1
+            if len(pending_rows) >= checkpoint_rows:
+                logging.info(f"#@# Checkpointing metadata after {i + 1} of {len(batches)} requests")
+                table.append(pending_rows)
+                pending_rows = []
+    table.append(pending_rows)
+    table.compact()
+    if n_failed > 0:
+        logging.info(f"#@# {n_failed} of {len(batches)} metadata requests failed")
+    return table
+
+
+def ingest(mints: Iterable[str], api_key: str, **kwargs) -> NftMetadataTable:
+    return asyncio.run(ingest_async(mints, api_key, **kwargs))
@@ -0,0 +1,189 @@
+"""Mergeable per program per day sketches of signer sets.
+
+HyperLogLog registers estimate distinct signers and one permutation MinHash signatures estimate the
+Jaccard similarity of two programs' signers. Both merge across days elementwise (max / min), so any date
+range can be answered from the daily sketches, at ~6KB per program-day instead of the address lists.
+"""
+
+from typing import Optional, Sequence, Tuple, Union
+
+import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "HLL_PRECISION",
+    "MINHASH_BUCKETS",
+    "SIGNER_SKETCHES_FILE",
+    "SIGNER_SKETCHES_NEW_USERS_FILE",
+    "build_sketches",
+    "estimate_distinct",
+    "estimate_jaccard",
+    "get_distinct_signers",
+    "get_similarity_network",
+    "hash_addresses",
+    "merge_sketches",
+    "read_sketches",
+    "update_sketches",
+]
+
+SIGNER_SKETCHES_FILE = Path("data/signer_sketches.parquet")
+SIGNER_SKETCHES_NEW_USERS_FILE = Path("data/signer_sketches_new_users.parquet")
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+MINHASH_BUCKETS = 256
+_minhash_bits = 8
+_empty = np.iinfo(np.uint64).max
+
+
+def hash_addresses(addresses: pd.Series) -> np.ndarray:
+    """64 bit hash of each address, stable across runs"""
+    return pd.util.hash_pandas_object(addresses.astype(str), index=False).values
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    # frexp is exact for 32 bit values, so split the 64 bit values in two
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+
+def _group_reduce(group: np.ndarray, slot: np.ndarray, values: np.ndarray, n_slots: int, how: str):
+    key = group.astype(np.int64) * n_slots + slot.astype(np.int64)
+    reduced = getattr(pd.Series(values).groupby(key), how)()
+    return reduced.index.values, reduced.values
+
+
+def build_sketches(
+    df: pd.DataFrame, keys: Sequence[str] = ("PROGRAM_ID", "DATE"), address_col: str = "SIGNERS"
+) -> pd.DataFrame:
+    """One row per `keys` group, with `hll` and `minhash` sketch bytes of the group's addresses"""
+    keys = list(keys)
+    groups = df.groupby(keys, sort=True)
+    group = groups.ngroup().values
+    n_groups = groups.ngroups
+    h = hash_addresses(df[address_col])
+
+    hll = np.zeros(n_groups * HLL_REGISTERS, dtype=np.uint8)
+    register = h >> np.uint64(64 - HLL_PRECISION)
+    rank = (64 - HLL_PRECISION + 1) - _bit_length(h & np.uint64((1 << (64 - HLL_PRECISION)) - 1))
+    idx, values = _group_reduce(group, register, rank.astype(np.uint8), HLL_REGISTERS, "max")
+    hll[idx] = values
+
+    minhash = np.full(n_groups * MINHASH_BUCKETS, _empty, dtype=np.uint64)
+    bucket = h & np.uint64(MINHASH_BUCKETS - 1)
+    idx, values = _group_reduce(group, bucket, h >> np.uint64(_minhash_bits), MINHASH_BUCKETS, "min")
+    minhash[idx] = values
+
+    sketches = groups.size().reset_index()[keys]
+    sketches["hll"] = [x.tobytes() for x in hll.reshape(n_groups, HLL_REGISTERS)]
+    sketches["minhash"] = [x.tobytes() for x in minhash.reshape(n_groups, MINHASH_BUCKETS)]
+    return sketches
+
+
+def _registers(sketches: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    hll = np.frombuffer(b"".join(sketches.hll), dtype=np.uint8).reshape(-1, HLL_REGISTERS)
+    minhash = np.frombuffer(b"".join(sketches.minhash), dtype=np.uint64).reshape(-1, MINHASH_BUCKETS)
+    return hll, minhash
+
+
+def merge_sketches(sketches: pd.DataFrame, by: str = "PROGRAM_ID") -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+    """Union the sketches in each `by` group: `(groups, hll registers, minhash signatures)`"""
+    codes, uniques = pd.factorize(sketches[by], sort=True)
+    hll, minhash = _registers(sketches)
+    merged_hll = np.zeros((len(uniques), HLL_REGISTERS), dtype=np.uint8)
+    merged_minhash = np.full((len(uniques), MINHASH_BUCKETS), _empty, dtype=np.uint64)
+    np.maximum.at(merged_hll, codes, hll)
+    np.minimum.at(merged_minhash, codes, minhash)
+    return pd.Index(uniques), merged_hll, merged_minhash
+
+
+def estimate_distinct(hll: np.ndarray) -> np.ndarray:
+    """HyperLogLog estimate for each row of registers, with linear counting for small cardinalities"""
+    hll = np.atleast_2d(hll)
+    m = hll.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m**2 / np.sum(np.ldexp(1.0, -hll.astype(np.int64)), axis=1)
+    zeros = np.sum(hll == 0, axis=1)
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / zeros)
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def estimate_jaccard(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """MinHash Jaccard estimate of one signature against one or more others"""
+    both_empty = (a == _empty) & (b == _empty)
+    matches = np.sum((a == b) & ~both_empty, axis=-1)
+    filled = np.sum(~both_empty, axis=-1)
+    return np.divide(matches, filled, out=np.zeros(matches.shape), where=filled > 0)
+
+
+def read_sketches(
+    path: Union[str, Path] = SIGNER_SKETCHES_FILE,
+    programs: Optional[Sequence[str]] = None,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+) -> pd.DataFrame:
+    filters = []
+    if programs is not None:
+        filters.append(("PROGRAM_ID", "in", list(programs)))
+    if start_date is not None:
+        filters.append(("DATE", ">=", f"{start_date:%Y-%m-%d}"))
+    if end_date is not None:
+        filters.append(("DATE", "<=", f"{end_date:%Y-%m-%d}"))
+    return pd.read_parquet(path, filters=filters or None)
+
+
+def update_sketches(sketches: pd.DataFrame, path: Union[str, Path] = SIGNER_SKETCHES_FILE) -> pd.DataFrame:
+    """Add new program-day sketches to the sketch file, replacing any for the same program and day"""
+    path = Path(path)
+    if path.exists():
+        sketches = pd.concat([pd.read_parquet(path), sketches]).drop_duplicates(
+            subset=["PROGRAM_ID", "DATE"], keep="last"
+        )
+    sketches = sketches.sort_values(by=["DATE", "PROGRAM_ID"]).reset_index(drop=True)
+    sketches.to_parquet(path, index=False)
+    return sketches
+
+
+def get_distinct_signers(sketches: pd.DataFrame) -> pd.DataFrame:
+    """Estimated distinct signers per program over all the days in `sketches`"""
+    programs, hll, _ = merge_sketches(sketches)
+    return pd.DataFrame({"PROGRAM_ID": programs, "SIGNERS": np.round(estimate_distinct(hll)).astype(int)})
+
+
+def get_similarity_network(
+    sketches: pd.DataFrame,
+    programs: Sequence[str],
+    names: Sequence[str],
+    min_users: int = 10,
+) -> pd.DataFrame:
+    """MinHash estimate of `network.get_overlap_network` for the days in `sketches`"""
+    programs = np.asarray(programs)
+    names = np.asarray(names)
+    sketch_programs, hll, minhash = merge_sketches(sketches[sketches.PROGRAM_ID.isin(programs)])
+    rows = sketch_programs.get_indexer(programs)
+    n_users = np.zeros(len(programs))
+    n_users[rows >= 0] = estimate_distinct(hll)[rows[rows >= 0]]
+
+    eligible = np.flatnonzero(n_users >= min_users)
+    i, j, weight = [], [], []
+    for k, x in enumerate(eligible[:-1]):
+        others = eligible[k + 1 :]
+        i.append(np.full(len(others), x))
+        j.append(others)
+        weight.append(estimate_jaccard(minhash[rows[x]], minhash[rows[others]]))
+    i = np.concatenate(i) if i else np.array([], dtype=int)
+    j = np.concatenate(j) if j else np.array([], dtype=int)
+    return pd.DataFrame(
+        {
+            "Program1": programs[i],
+            "Program2": programs[j],
+            "Name1": names[i],
+            "Name2": names[j],
+            "weight": np.concatenate(weight) if weight else np.array([]),
+        }
+    )
@@ -0,0 +1,100 @@
+"""Concurrent solana.fm account label client"""
+
+from typing import Callable, List, Optional, Sequence
+
+import asyncio
+import logging
+from dataclasses import replace
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from .http_client import AsyncHttp, get_policy
+
+__all__ = [
+    "SOLANA_FM_ACCOUNTS_URL",
+    "fetch_labels",
+    "fetch_labels_async",
+]
+
+SOLANA_FM_ACCOUNTS_URL = "https://api.solana.fm/v0/accounts"
+BATCH_SIZE = 100
+
+OnBatch = Callable[[Sequence[str], pd.DataFrame], None]
+
+
+def _to_frame(result: List[dict]) -> pd.DataFrame:
+    """Label rows from an accounts response, with columns named like the label csvs"""
+    label_results = []
+    for x in result:
+        try:
+            data = x["data"]
+            data["ADDRESS"] = x["accountHash"]
+            label_results.append(data)
+        except (KeyError, TypeError):
+            pass
+    df = pd.DataFrame(label_results)
+    return df.rename(columns={x: (x[0].upper() + x[1:]).replace("_", " ") for x in df.columns})
+
+
+async def _fetch_batch(http: AsyncHttp, batch: Sequence[str], max_retries: int) -> pd.DataFrame:
+    r = await http.request(
+        "POST", SOLANA_FM_ACCOUNTS_URL, json={"accountHashes": list(batch)}, max_retries=max_retries
+    )
+    r.raise_for_status()
+    return _to_frame(r.json()["result"])
+
+
+async def fetch_labels_async(
+    addresses: Sequence[str],
+    on_batch: Optional[OnBatch] = None,
+    batch_size: int = BATCH_SIZE,
+    max_concurrency: int = 8,
+    rate: float = 4.0,
+    capacity: int = 4,
+    max_retries: int = 5,
+    base_delay: float = 2.0,
+) -> pd.DataFrame:
+    """solana.fm labels for `addresses`, posted in batches of `batch_size` through the shared client layer.
+
+    At most `max_concurrency` batches are in flight and they start at most `rate` per second; 429s, 5xxs
+    and connection errors back off the whole client before the batch is retried. `on_batch(addresses,
+    labels)` is called as each batch succeeds, so results can be saved as they stream in. A batch that
+    still fails after `max_retries` is logged and left out.
+    """
+    addresses = list(addresses)
+    batches = [addresses[i : i + batch_size] for i in range(0, len(addresses), batch_size)]
+    host = urlparse(SOLANA_FM_ACCOUNTS_URL).netloc
+    policy = replace(
+        get_policy(host),
+        max_connections=max_concurrency,
+        rate=rate,
+        capacity=capacity,
+        base_delay=base_delay,
+    )
+
+    dfs = []
+    n_failed = 0
+    async with AsyncHttp({host: policy}) as http:
+
+        async def run(batch):
+            return batch, await _fetch_batch(http, batch, max_retries)
+
+        for task in asyncio.as_completed([run(x) for x in batches]):
+            try:
+                batch, df = await task
+            except Exception as e:
+                logging.info(f"[ERROR] (solana.fm) {e}")
+                n_failed += 1
+                continue
+            if on_batch is not None:
+                on_batch(batch, df)
+            dfs.append(df)
+    logging.info(f"#@# Fetched solana.fm labels for {len(batches)} batches, {n_failed} failed")
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=["ADDRESS"])
+    return pd.concat(dfs, ignore_index=True)
+
+
+def fetch_labels(addresses: Sequence[str], **kwargs) -> pd.DataFrame:
+    return asyncio.run(fetch_labels_async(addresses, **kwargs))
@@ -0,0 +1,325 @@
+"""On-disk storage for query results: a Hive-partitioned Parquet dataset of Flipside query output"""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import datetime
+import logging
+import re
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+__all__ = [
+    "FLIPSIDE_DATASET_DIR",
+    "COLUMN_TYPES",
+    "get_feather_path",
+    "get_partition_date",
+    "get_partition_path",
+    "has_flipside_dataset",
+    "migrate_csv_dir",
+    "read_flipside_dataset",
+    "read_flipside_partitions",
+    "read_output",
+    "split_output_file",
+    "write_feather",
+    "write_flipside_partition",
+]
+
+FLIPSIDE_DATASET_DIR = Path("data/flipside")
+
+_program_counts = {
+    "Date": "datetime64[ns]",
+    "PROGRAM_ID": "string",
+    "TX_COUNT": "int64",
+    "SIGNERS": "int64",
+}
+_signers_by_program = {
+    "PROGRAM_ID": "string",
+    "SIGNERS": "string",
+}
+_new_users = {
+    "ADDRESS": "string",
+    "CREATION_DATE": "datetime64[ns]",
+    "LAST_USE": "datetime64[ns]",
+}
+# Explicit column types for each query template, so every partition of a template has the same schema.
+# Templates without an entry can't be written; columns an entry doesn't list are written as strings
+COLUMN_TYPES: Dict[str, Dict[str, str]] = {
+    "sdk_programs_sol": _program_counts,
+    "sdk_programs_new_users_sol": _program_counts,
+    "sdk_programs_all_signers_sol": _program_counts,
+    "sdk_programs_new_users_all_signers_sol": _program_counts,
+    "sdk_signers_by_programID_sol": _signers_by_program,
+    "sdk_signers_by_programID_new_users_sol": _signers_by_program,
+    "sdk_new_users_sol": _new_users,
+    "sdk_new_user_first10x_sol": _new_users,
+    "sdk_transactions_sol": {
+        "DATETIME": "datetime64[ns]",
+        "TOTAL_TX": "int64",
+        # Sums and averages are null for an hour without successful or failed transactions
+        "TOTAL_FEE": "float64",
+        "AVG_TOTAL_FEE": "float64",
+        "TOTAL_COMPUTE_UNITS_USED": "float64",
+        "TOTAL_AVG_COMPUTE_UNITS_USED": "float64",
+        "TOTAL_AVG_COMPUTE_UNITS_REQUESTED": "float64",
+        "TOTAL_AVG_COMPUTE_UNITS_PROPORTION": "float64",
+        "SUCCESSFUL_TX": "int64",
+        "SUCCESSFUL_FEE": "float64",
+        "AVG_SUCCESSFUL_FEE": "float64",
+        "SUCCESSFUL_COMPUTE_UNITS_USED": "float64",
+        "AVG_SUCCESSFUL_COMPUTE_UNITS_USED": "float64",
+        "AVG_SUCCESSFUL_COMPUTE_UNITS_REQUESTED": "float64",
+        "AVG_SUCCESSFUL_COMPUTE_UNITS_PROPORTION": "float64",
+        "FAILED_TX": "int64",
+        "FAILED_FEE": "float64",
+        "AVG_FAILED_FEE": "float64",
+        "FAILED_COMPUTE_UNITS_USED": "float64",
+        "AVG_FAILED_COMPUTE_UNITS_USED": "float64",
+        "AVG_FAILED_COMPUTE_UNITS_REQUESTED": "float64",
+        "AVG_FAILED_COMPUTE_UNITS_PROPORTION": "float64",
+        "SUCCESS_RATE": "float64",
+        "TOTAL_TPS": "float64",
+        "SUCCESFUL_TPS": "float64",
+        "FAILED_TPS": "float64",
+    },
+    "sdk_weekly_program_count_sol": {"WEEK": "datetime64[ns]", "UNIQUE_PROGRAMS": "int64"},
+    "sdk_weekly_new_program_count_sol": {"WEEK": "datetime64[ns]", "New Programs": "int64"},
+    "sdk_weekly_users_sol": {"WEEK": "datetime64[ns]", "UNIQUE_USERS": "int64"},
+    "sdk_weekly_new_users_sol": {"WEEK": "datetime64[ns]", "NEW_USERS": "int64"},
+    "sdk_weekly_users_all_signers_sol": {"WEEK": "datetime64[ns]", "UNIQUE_USERS": "int64"},
+    "sdk_weekly_new_users_all_signers_sol": {"WEEK": "datetime64[ns]", "NEW_USERS": "int64"},
+    "sdk_dex": {"DATE": "datetime64[ns]", "TXS": "int64", "FEE_PAYERS": "int64", "DEX": "string"},
+    "sdk_dex_new_users": {
+        "FIRST_TX_DATE": "datetime64[ns]",
+        "NEW_WALLETS": "int64",
+        "PROGRAM_ID": "string",
+        "DEX": "string",
+    },
+    "sdk_openbook_users": {"TYPE": "string", "DATE": "datetime64[ns]", "WALLETS": "int64", "DEX": "string"},
+    "sdk_top_stakers_by_date_sol": {
+        "STAKER": "string",
+        "TOTAL_STAKE": "float64",
+        "ADDRESS_NAME": "string",
+        "LABEL": "string",
+        "LABEL_SUBTYPE": "string",
+        "LABEL_TYPE": "string",
+    },
+    "sdk_top_liquid_staking_token_holders_delta": {
+        "Date": "datetime64[ns]",
+        "WALLET": "string",
+        "TOKEN": "string",
+        "TOKEN_NAME": "string",
+        "SYMBOL": "string",
+        "AMOUNT": "float64",
+        "AMOUNT_USD": "float64",
+    },
+    "sdk_xnft": {
+        "BLOCK_TIMESTAMP": "datetime64[ns]",
+        "BLOCK_ID": "int64",
+        "TX_ID": "string",
+        "XNFT": "string",
+        "PROGRAM_DATA": "string",
+        "INSTRUCTION_TYPE": "string",
+        "PROGRAMID": "string",
+        "FEE_PAYER": "string",
+        "SUCCEEDED": "boolean",
+        "ALL_ACCOUNTS": "string",
+    },
+    "sdk_xnft_new_users": {"FIRST_TX_DATE": "datetime64[ns]", "NEW_WALLETS": "int64"},
+    # `select *` from solana.core.fact_nft_mints
+    "sdk_madlist": {
+        "BLOCK_TIMESTAMP": "datetime64[ns]",
+        "BLOCK_ID": "int64",
+        "TX_ID": "string",
+        "SUCCEEDED": "boolean",
+        "PROGRAM_ID": "string",
+        "PURCHASER": "string",
+        "MINT_PRICE": "float64",
+        "MINT_CURRENCY": "string",
+        "MINT": "string",
+    },
+    "sdk_nft_royalty_tx": {
+        "BLOCK_TIMESTAMP": "datetime64[ns]",
+        "TX_ID": "string",
+        "MARKETPLACE": "string",
+        "MINT": "string",
+        "SALES_AMOUNT": "float64",
+        "ROYALTY_AMOUNT": "float64",
+    },
+    # `select *` from solana.core.dim_labels
+    "sdk_labels_sol": {
+        "BLOCKCHAIN": "string",
+        "CREATOR": "string",
+        "ADDRESS": "string",
+        "LABEL_TYPE": "string",
+        "LABEL_SUBTYPE": "string",
+        "LABEL": "string",
+        "ADDRESS_NAME": "string",
+    },
+    "sdk_nft_mints": {
+        "BLOCK_TIMESTAMP": "datetime64[ns]",
+        "TX_ID": "string",
+        "PURCHASER": "string",
+        "SELLER": "string",
+        "MINT": "string",
+        "SALES_AMOUNT": "float64",
+    },
+}
+
+_partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+def split_output_file(output_file: Union[str, Path]) -> Tuple[str, str]:
+    """`(template, params)` for a query output file named `data/<template>/<template>_<params>.csv`"""
+    output_file = Path(output_file)
+    template = output_file.parent.name
+    return template, output_file.stem.removeprefix(f"{template}_")
+
+
+def get_partition_date(params: str) -> str:
+    """Date partition for a query's file name params, e.g. `2022-01-01_<program_id>` -> `2022-01-01`"""
+    dates = re.findall(r"\d{4}-\d{2}-\d{2}", params)
+    return dates[-1] if dates else "all"
+
+
+def get_partition_path(template: str, params: str, root: Union[str, Path] = FLIPSIDE_DATASET_DIR) -> Path:
+    date = get_partition_date(params)
+    return Path(root, f"template={template}", f"date={date}", f"{params.replace(':', '-')}.parquet")
+
+
+def apply_column_types(df: pd.DataFrame, template: str) -> pd.DataFrame:
+    for col, dtype in COLUMN_TYPES.get(template, {}).items():
+        if col not in df.columns:
+            continue
+        if dtype.startswith("datetime"):
+            df[col] = pd.to_datetime(df[col])
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def write_flipside_partition(
+    df: pd.DataFrame, template: str, params: str, root: Union[str, Path] = FLIPSIDE_DATASET_DIR
+) -> Optional[Path]:
+    """Write one query's results to `<root>/template=<template>/date=<date>/<params>.parquet`
+
+    Raises `ValueError` for a template without `COLUMN_TYPES`. Empty results are not written, since their
+    columns have no type to unify with the other partitions.
+    """
+    if template not in COLUMN_TYPES:
+        raise ValueError(f"No column types for {template}, add them to store.COLUMN_TYPES")
+    if len(df) == 0:
+        return None
+    df = apply_column_types(df, template)
+    unlisted = df.columns.difference(list(COLUMN_TYPES[template]))
+    if len(unlisted) > 0:
+        # e.g. a column added to a `select *` table, which could otherwise be null typed in some partitions
+        logging.warning(f"#@# No column types for {list(unlisted)} of {template}, writing them as strings")
+        df[unlisted] = df[unlisted].astype("string")
+    output_file = get_partition_path(template, params, root=root)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, output_file, compression="zstd")
+    return output_file
+
+
+def has_flipside_dataset(template: str, root: Union[str, Path] = FLIPSIDE_DATASET_DIR) -> bool:
+    return Path(root, f"template={template}").is_dir()
+
+
+def read_flipside_dataset(
+    template: str,
+    columns: Optional[List[str]] = None,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    filter: Optional[ds.Expression] = None,
+    root: Union[str, Path] = FLIPSIDE_DATASET_DIR,
+) -> pd.DataFrame:
+    """Read a template's partitions, pruning by date partition and pushing `filter` down to the files.
+
+    The `date` partition column is included in the result as a string.
+    """
+    dataset = ds.dataset(Path(root, f"template={template}"), format="parquet", partitioning=_partitioning)
+    exprs = [] if filter is None else [filter]
+    if start_date is not None:
+        exprs.append(ds.field("date") >= f"{start_date:%Y-%m-%d}")
+    if end_date is not None:
+        exprs.append(ds.field("date") <= f"{end_date:%Y-%m-%d}")
+    expr = None
+    for e in exprs:
+        expr = e if expr is None else expr & e
+    if columns is not None and "date" not in columns:
+        columns = [*columns, "date"]
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def read_flipside_partitions(
+    template: str,
+    names: List[str],
+    columns: Optional[List[str]] = None,
+    root: Union[str, Path] = FLIPSIDE_DATASET_DIR,
+) -> pd.DataFrame:
+    """Read only the given partition files, named relative to the template dir (`date=<date>/<params>.parquet`)"""
+    base_dir = Path(root, f"template={template}")
+    dataset = ds.dataset(
+        [str(Path(base_dir, x)) for x in names],
+        format="parquet",
+        partitioning=_partitioning,
+        partition_base_dir=str(base_dir),
+    )
+    if columns is not None and "date" not in columns:
+        columns = [*columns, "date"]
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def migrate_csv_dir(data_dir: Union[str, Path], root: Union[str, Path] = FLIPSIDE_DATASET_DIR) -> int:
+    """Convert an existing `data/<template>/<template>_<params>.csv` directory to Parquet partitions"""
+    d = Path(data_dir)
+    template = d.name
+    n = 0
+    for x in d.glob("*.csv"):
+        _, params = split_output_file(x)
+        write_flipside_partition(pd.read_csv(x), template, params, root=root)
+        n += 1
+    return n
+
+
+def get_feather_path(output_file: Union[str, Path]) -> Path:
+    """`data/<name>.feather` for a combined output `data/<name>.csv(.gz)`"""
+    output_file = Path(output_file)
+    name = output_file.name.removesuffix(".gz").removesuffix(".csv")
+    return output_file.with_name(f"{name}.feather")
+
+
+def write_feather(df: pd.DataFrame, output_file: Union[str, Path]) -> Optional[Path]:
+    """Write an uncompressed Feather (Arrow IPC) copy of a combined csv, which the app can memory-map
+
+    Frames pyarrow can't convert (e.g. object columns of mixed types) are left as csv only.
+    """
+    path = get_feather_path(output_file)
+    try:
+        feather.write_feather(df.reset_index(drop=True), path, compression="uncompressed")
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        logging.info(f"#@# Not writing {path}: {e}")
+        path.unlink(missing_ok=True)
+        return None
+    return path
+
+
+def read_output(output_file: Union[str, Path], columns: Optional[List[str]] = None, **kwargs) -> pd.DataFrame:
+    """Read a combined output, from its Feather copy if that is at least as new as the csv
+
+    The Feather file is memory-mapped, so only the pages of `columns` are read from disk, though they are
+    still copied into the returned frame. `kwargs` are passed to `pd.read_csv` when falling back to the csv.
+    """
+    output_file = Path(output_file)
+    path = get_feather_path(output_file)
+    if path.exists() and (
+        not output_file.exists() or path.stat().st_mtime_ns >= output_file.stat().st_mtime_ns
+    ):
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(output_file, usecols=columns, **kwargs)
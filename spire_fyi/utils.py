@@ -1,16 +1,15 @@
-from typing import Dict, Iterable, Union
+from typing import Dict, Iterable, List, Optional, Union
 
 import asyncio
 import datetime
 import logging
-import time
 from io import BytesIO
 from pathlib import Path
 from urllib.parse import urlparse
 
+import dateutil.tz
 import numpy as np
 import pandas as pd
-import requests
 import solders
 import streamlit as st
 from flipside import Flipside
@@ -19,7 +18,20 @@ from jinja2 import Environment, FileSystemLoader
 from PIL import Image
 from solana.rpc.async_api import AsyncClient
 
-from .xnft.accounts import Xnft
+from . import (
+    api_snapshots,
+    backpack,
+    datasets,
+    disk_cache,
+    http_client,
+    ipfs,
+    labels,
+    leaderboard,
+    sketches,
+    solana_fm,
+    store,
+    xnft_snapshot,
+)
 
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 __all__ = [
@@ -28,16 +40,21 @@ __all__ = [
     "api_base",
     "add_program_labels",
     "apply_program_name",
+    "get_program_names",
     "combine_flipside_date_data",
     "get_flipside_labels",
     "get_program_chart_data",
     "load_labeled_program_data",
+    "get_labeled_program_dataset",
+    "load_program_leaderboard",
+    "load_distinct_signers",
     "load_weekly_new_program_data",
     "load_weekly_program_data",
     "load_weekly_user_data",
     "load_weekly_last_use_data",
     "load_weekly_days_since_last_use_data",
     "load_defi_data",
+    "get_defi_dataset",
     "agg_method_dict",
     "metric_dict",
     "get_program_ids",
@@ -47,6 +64,7 @@ __all__ = [
     "get_random_image",
     "reformat_columns",
     "load_flipside_api_data",
+    "load_flipside_api_data_dict",
     "run_query_and_cache",
     "get_short_address",
     "get_nft_mint_data",
@@ -55,6 +73,7 @@ __all__ = [
     "load_fee_data",
     "get_native_balances",
     "load_xnft_data",
+    "get_xnft_dataset",
 ]
 
 API_KEY = st.secrets["flipside"]["api_key"]
@@ -64,8 +83,8 @@ helius_key = st.secrets["helius"]["api_key"]
 rpc_url = f"https://rpc.helius.xyz/?api-key={helius_key}"
 
 LAMPORTS_PER_SOL = 1_000_000_000
-IPFS_RESOLVER_URL = "https://cloudflare-ipfs.com/ipfs"
-IPFS_RESOLVER_ALT_URL = "https://ipfs.io/ipfs"
+IPFS_RESOLVER_URL = ipfs.IPFS_RESOLVER_URL
+IPFS_RESOLVER_ALT_URL = ipfs.IPFS_RESOLVER_ALT_URL
 
 query_base = "https://flipsidecrypto.xyz/edit/queries"
 api_base = "https://api.flipsidecrypto.com/api/v2/queries"
@@ -165,15 +184,37 @@ liquid_staking_tokens = {
 }
 
 
-def combine_flipside_date_data(data_dir, add_date=False, with_program=False, nft_royalty=False):
+def combine_flipside_date_data(
+    data_dir,
+    add_date=False,
+    with_program=False,
+    nft_royalty=False,
+    columns=None,
+    start_date=None,
+    end_date=None,
+):
     d = Path(data_dir)
+    if store.has_flipside_dataset(d.name):
+        # Partitioned parquet output; only the requested columns and date partitions are read
+        combined_df = store.read_flipside_dataset(
+            d.name, columns=columns, start_date=start_date, end_date=end_date
+        )
+        if add_date:
+            combined_df["DATE"] = combined_df["date"]
+        return combined_df.drop(columns="date")
+
     data_files = d.glob("*.csv")
     if nft_royalty:
         data_files_todo = {}
         # TODO: get the most recent / highest mints for each nft collection
     dfs = []
     for x in data_files:
-        df = pd.read_csv(x)
+        file_date = store.get_partition_date(x.stem)
+        if start_date is not None and file_date < f"{start_date:%Y-%m-%d}":
+            continue
+        if end_date is not None and file_date > f"{end_date:%Y-%m-%d}":
+            continue
+        df = pd.read_csv(x, usecols=columns)
         if add_date and not with_program:
             date_str = x.name.split("_")[-1].split(".csv")[0]
             df["DATE"] = date_str
@@ -223,34 +264,45 @@ def create_label_query(addresses):
     return query
 
 
-def get_flipside_labels(df, output_prefix, col):
-    # #TODO combine with solana.fm
+def get_flipside_labels(df, output_prefix, col, ttl=None):
+    """Fetch Flipside labels for the addresses in `col` that are new or older than `ttl`"""
     ids = df[col].unique()
-    labels = create_label_query(ids)
-    query_flipside_data([labels, Path(f"data/{output_prefix}_flipside_labels.csv")])
+    output_file = Path(f"data/{output_prefix}_flipside_labels.csv")
+    label_store = labels.LabelStore()
+    try:
+        new_ids = label_store.stale(ids, "flipside", ttl)
+        logging.info(f"#@# Fetching Flipside labels for {len(new_ids)} of {len(ids)} addresses")
+        if len(new_ids) > 0:
+            label_query = create_label_query(new_ids)
+            # Not straight to `output_file`, which also holds the labels of addresses not in `df`
+            query_file = output_file.with_name(f"{output_prefix}_flipside_labels_new.csv")
+            query_flipside_data([label_query, query_file])
+            label_store.upsert(pd.read_csv(query_file), "flipside")
+            label_store.mark_checked(new_ids, "flipside")
+            query_file.unlink()
+        label_store.export_csv(ids, "flipside", output_file)
+    finally:
+        label_store.close()
+
+
+def get_solana_fm_labels(df, output_prefix, col, ttl=None):
+    """Fetch solana.fm labels for the addresses in `col` that are new or older than `ttl`"""
+    ids = df[col].unique()
+    label_store = labels.LabelStore()
+    try:
+        new_ids = label_store.stale(ids, "solana_fm", ttl)
+        logging.info(f"#@# Fetching solana.fm labels for {len(new_ids)} of {len(ids)} addresses")
 
+        def save_batch(batch, new_labels):
+            if len(new_labels) > 0:
+                label_store.upsert(new_labels, "solana_fm")
+            label_store.mark_checked(batch, "solana_fm")
 
-def get_solana_fm_labels(df, output_prefix, col):
-    ids = df[col].unique()
-    split_ids = [ids[i : i + 100] for i in range(0, len(ids), 100)]
-
-    label_url = "https://api.solana.fm/v0/accounts"
-    label_results = []
-    for i, id_set in enumerate(split_ids):
-        if i % 4 == 0:
-            time.sleep(1)
-        r = requests.post(label_url, json={"accountHashes": list(id_set)})
-        res = r.json()["result"]
-        for x in res:
-            try:
-                data = x["data"]
-                data["ADDRESS"] = x["accountHash"]
-                label_results.append(data)
-            except KeyError:
-                pass
-    df = pd.DataFrame(label_results).sort_values(by="ADDRESS").reset_index(drop=True)
-    df = df.rename(columns={x: (x[0].upper() + x[1:]).replace("_", " ") for x in df.columns})
-    df.to_csv(f"data/{output_prefix}_solana_fm_labels.csv", index=False)
+        if len(new_ids) > 0:
+            solana_fm.fetch_labels(new_ids, on_batch=save_batch)
+        label_store.export_csv(ids, "solana_fm", f"data/{output_prefix}_solana_fm_labels.csv")
+    finally:
+        label_store.close()
 
 
 def load_program_label_df(prefix="program", use_manual=True, sfm_only=False):
@@ -278,7 +330,18 @@ def add_program_labels(
     use_manual=True,
     sfm_only=False,
 ):
-    label_df = load_program_label_df(prefix, use_manual, sfm_only)
+    if labels.LABELS_FILE.exists():
+        if sfm_only:
+            sources = ["solana_fm"]
+        else:
+            sources = [x for x in labels.SOURCES if use_manual or x != "manual"]
+        label_store = labels.LabelStore()
+        try:
+            label_df = label_store.lookup(df[left_on].unique(), sources).rename(columns={"ADDRESS": right_on})
+        finally:
+            label_store.close()
+    else:
+        label_df = load_program_label_df(prefix, use_manual, sfm_only)
     df = df.merge(label_df, left_on=left_on, right_on=right_on, how="left").drop(axis=1, columns=drop)
     if rename_solana_label:
         df.loc[df.PROGRAM_ID == "ComputeBudget111111111111111111111111111111", "LABEL"] = "solana"
@@ -308,41 +371,70 @@ def apply_program_name(
             return address_name
 
 
+def get_program_names(
+    df,
+    address_col="PROGRAM_ID",
+    address_name_col="ADDRESS_NAME",
+    label_col="LABEL",
+    friendly_name_col="FriendlyName",
+):
+    """Vectorized `apply_program_name`: names are resolved once per unique label combination and mapped back"""
+    cols = [address_col, address_name_col, label_col, friendly_name_col]
+    keys = df[cols]
+    codes = keys.groupby(cols, dropna=False, sort=False).ngroup().values
+    unique_keys = keys.drop_duplicates().astype(object)
+    address, address_name, label, friendly_name = (unique_keys[x] for x in cols)
+
+    names = address.where(friendly_name.isna(), friendly_name)
+    names = names.where(address_name.isna(), address_name)
+    is_str = address_name.map(lambda x: isinstance(x, str)) & label.map(lambda x: isinstance(x, str))
+    names[is_str] = label[is_str].str.title() + "- " + address_name[is_str].str.title()
+    return pd.Series(names.values[codes], index=df.index)
+
+
+def _output_files(output_file: Union[str, Path]) -> List[Path]:
+    """A combined output and its Feather copy, either of which `store.read_output` may read"""
+    return [Path(output_file), store.get_feather_path(output_file)]
+
+
 @st.cache_data(ttl=3600)
+@disk_cache.persist(ttl=3600)
 def get_program_chart_data(
-    df,
+    _df,
+    dataset,
     metric,
     agg_method,
     date_range,
     exclude_solana,
     exclude_oracle,
     programs,
+    _leaderboard=None,
 ):
-    if date_range == "All dates":
-        chart_df = df.copy()
-    elif date_range == "Year to Date":
-        chart_df = df.copy()[df.Date >= "2022-01-01"]
-    else:
-        chart_df = df.copy()[df.Date >= (datetime.datetime.today() - pd.Timedelta(date_range))]
-
-    if exclude_solana:
-        chart_df = chart_df[chart_df.LABEL != "solana"]
-    if exclude_oracle:
-        chart_df = chart_df[~chart_df.LABEL.isin(["pyth", "switchboard"])]
-        chart_df = chart_df[~chart_df.FriendlyName.isin(["SwitchBoard V2 Program", "Chainlink Program"])]
-        chart_df = chart_df[~chart_df.LABEL_SUBTYPE.isin(["oracle"])]
+    """Daily usage of the top `programs` (or the given program ids); `dataset` is the handle of `_df`
+
+    The top programs are looked up in `_df`'s leaderboard cube, if there is one covering `date_range` today.
+    """
     if type(programs) == int:
-        program_ids = (
-            chart_df.groupby("PROGRAM_ID")
-            .agg({metric: agg_method})
-            .sort_values(by=metric, ascending=False)
-            .iloc[:programs]
-            .index
-        )
+        program_ids = None
+        if _leaderboard is not None:
+            program_ids = leaderboard.top_programs(
+                _leaderboard, metric, agg_method, date_range, exclude_solana, exclude_oracle, programs
+            )
+        if program_ids is None:
+            program_ids = (
+                leaderboard.filter_programs(_df, date_range, exclude_solana, exclude_oracle)
+                .groupby("PROGRAM_ID")
+                .agg({metric: agg_method})
+                .sort_values(by=metric, ascending=False)
+                .iloc[:programs]
+                .index
+            )
     else:
         program_ids = programs
     chart_df = (
-        chart_df[chart_df.PROGRAM_ID.isin(program_ids)]
+        leaderboard.filter_programs(
+            _df[_df.PROGRAM_ID.isin(program_ids)], date_range, exclude_solana, exclude_oracle
+        )
         .sort_values(by=["Date", metric], ascending=False)
         .reset_index(drop=True)
     )
@@ -350,18 +442,44 @@ def get_program_chart_data(
     return chart_df
 
 
-@st.cache_data(ttl=600)
-def load_labeled_program_data(new_users_only=False, user_type=None):
+def _labeled_program_file(new_users_only=False, user_type=None):
     if user_type == "Signers":
         if new_users_only:
-            return pd.read_csv("data/programs_new_users_all_signers_labeled.csv.gz")
+            return "data/programs_new_users_all_signers_labeled.csv.gz"
         else:
-            return pd.read_csv("data/programs_all_signers_labeled.csv.gz")
+            return "data/programs_all_signers_labeled.csv.gz"
     else:
         if new_users_only:
-            return pd.read_csv("data/programs_new_users_labeled.csv.gz")
+            return "data/programs_new_users_labeled.csv.gz"
         else:
-            return pd.read_csv("data/programs_labeled.csv.gz")
+            return "data/programs_labeled.csv.gz"
+
+
+@st.cache_data(ttl=600)
+def load_labeled_program_data(new_users_only=False, user_type=None, columns=None):
+    return store.read_output(_labeled_program_file(new_users_only, user_type), columns)
+
+
+def get_labeled_program_dataset(new_users_only=False, user_type=None):
+    """Handle of `load_labeled_program_data`'s frame, for the aggregations cached on it"""
+    output_file = _labeled_program_file(new_users_only, user_type)
+    return datasets.from_files(output_file, _output_files(output_file))
+
+
+@st.cache_data(ttl=600)
+def load_program_leaderboard(new_users_only=False, user_type=None):
+    """Precomputed top program aggregates for `load_labeled_program_data`, None if not built yet"""
+    return leaderboard.read_cube(_labeled_program_file(new_users_only, user_type))
+
+
+@st.cache_data(ttl=3600)
+def load_distinct_signers(program_ids, start_date, end_date, new_users_only=False):
+    """Estimated distinct fee payers per program over a date range, from the daily signer sketches"""
+    path = sketches.SIGNER_SKETCHES_NEW_USERS_FILE if new_users_only else sketches.SIGNER_SKETCHES_FILE
+    if not path.exists():
+        return pd.DataFrame(columns=["PROGRAM_ID", "SIGNERS"])
+    df = sketches.read_sketches(path, programs=program_ids, start_date=start_date, end_date=end_date)
+    return sketches.get_distinct_signers(df)
 
 
 @st.cache_data(ttl=60)
@@ -411,7 +529,7 @@ def load_weekly_new_user_data(user_type="Fee Payers"):
 @st.cache_data(ttl=1800)
 def load_nft_data():
     main_data = (
-        pd.read_json(f"{api_base}/2b945162-59a9-4ccc-95ee-fca67ac142c4/data/latest")
+        api_snapshots.read_latest(f"{api_base}/2b945162-59a9-4ccc-95ee-fca67ac142c4/data/latest")
         .rename(
             columns={
                 "WEEK": "Date",
@@ -447,23 +565,23 @@ def load_nft_data():
         ]
     )
     mints_by_purchaser = (
-        pd.read_json(f"{api_base}/04be6d7d-b5cd-4c11-9f73-68288e1353d4/data/latest")
+        api_snapshots.read_latest(f"{api_base}/04be6d7d-b5cd-4c11-9f73-68288e1353d4/data/latest")
         .rename(columns={"DATE": "Date", "AVERAGE_MINTS": "Average Mints per Address"})
         .sort_values(by="Date", ascending=False)
         .reset_index(drop=True)
     )
     mints_by_purchaser["Date"] = pd.to_datetime(mints_by_purchaser["Date"])
     mints_by_chain = (
-        pd.read_json(f"{api_base}/88cfaf1c-e485-4926-817f-61ed261d9cfb/data/latest")
+        api_snapshots.read_latest(f"{api_base}/88cfaf1c-e485-4926-817f-61ed261d9cfb/data/latest")
         .rename(columns={"DATE": "Date", "CHAIN": "Chain", "MINTS": "Count", "MINTERS": "Unique Users"})
         .sort_values(by="Date", ascending=False)
         .reset_index(drop=True)
     )
     mints_by_chain["Type"] = "Mints"
     mints_by_chain["Date"] = pd.to_datetime(mints_by_chain["Date"])
-    sales_by_chain = pd.read_json(f"{api_base}/7daf5636-2364-4281-b1cb-2d44ae1bcffd/data/latest").rename(
-        columns={"DATE": "Date", "CHAIN": "Chain", "SALES": "Count", "BUYERS": "Unique Users"}
-    )
+    sales_by_chain = api_snapshots.read_latest(
+        f"{api_base}/7daf5636-2364-4281-b1cb-2d44ae1bcffd/data/latest"
+    ).rename(columns={"DATE": "Date", "CHAIN": "Chain", "SALES": "Count", "BUYERS": "Unique Users"})
     sales_by_chain["Date"] = pd.to_datetime(sales_by_chain["Date"])
     sales_by_chain["Type"] = "Sales"
     by_chain_data = (
@@ -477,7 +595,7 @@ def load_nft_data():
 @st.cache_data(ttl=1800)
 def load_royalty_data():
     df = (
-        pd.read_json(
+        api_snapshots.read_latest(
             f"{api_base}/ffd713f1-4d05-4f3e-82b8-dc2c87db6691/data/latest"  # fork
             # f"{api_base}/7572e1e3-fbfb-4dd4-9d45-dd6cde7f42df/data/latest"  # original, see https://twitter.com/BlumbergKellen/status/1601245496789463045
         )
@@ -508,16 +626,17 @@ def load_royalty_data():
 
 @st.cache_data(ttl=1800)
 def load_sol_daily_price():
-    df = pd.read_json(f"{api_base}/398c8e9a-7178-4816-ae4a-74c3181dcafc/data/latest")
+    df = api_snapshots.read_latest(f"{api_base}/398c8e9a-7178-4816-ae4a-74c3181dcafc/data/latest")
     df["Date"] = pd.to_datetime(df["Date"])
     df = df.sort_values(by="Date")
     return df
 
 
 @st.cache_data(ttl=1800)
+@disk_cache.persist(files=_output_files("data/top_nft_sales_metadata_with_royalties.csv.gz"))
 def load_top_nft_info():
     df = (
-        pd.read_csv("data/top_nft_sales_metadata_with_royalties.csv.gz")
+        store.read_output("data/top_nft_sales_metadata_with_royalties.csv.gz")
         .sort_values(by=["BLOCK_TIMESTAMP"])
         .drop(columns=["uri_y"])
         .rename(columns={"uri_x": "uri"})
@@ -544,8 +663,8 @@ def load_top_nft_info():
 def get_random_image(df):
     num = np.random.randint(len(df))
     rand_row = df.iloc[num]
-    r = requests.get(rand_row.uri)
-    j = r.json()
+    # Metadata and images are on any host, so don't let a slow one hold up the page
+    j = http_client.get_json(rand_row.uri, max_retries=1, timeout=10)
     try:
         img_file = j["properties"]["files"][0]["uri"]
         if img_file.lower().endswith("gif"):
@@ -554,7 +673,7 @@ def get_random_image(df):
         img_file = j["image"]
 
     try:
-        response = requests.get(img_file)
+        response = http_client.request("GET", img_file, max_retries=1, timeout=10)
         image = Image.open(BytesIO(response.content))
     except:
         image = None
@@ -565,7 +684,7 @@ def get_random_image(df):
 @st.cache_data(ttl=1800)
 def load_defi_data():
     df = (
-        pd.read_json(f"{api_base}/02d025f0-9eb1-4bff-b317-299c8b251178/data/latest")
+        api_snapshots.read_latest(f"{api_base}/02d025f0-9eb1-4bff-b317-299c8b251178/data/latest")
         .sort_values(by=["WEEK", "SWAP_PROGRAM"])
         .reset_index(drop=True)
         .rename(
@@ -621,7 +740,7 @@ def get_program_ids(df):
 
 
 # sandstorm
-@st.cache_data(ttl=300)
+# Not cached: hashing the frame for a cache key costs more than reformatting it
 def reformat_columns(df: pd.DataFrame, datecols: Union[list, None]) -> pd.DataFrame:
     if datecols is not None:
         df[datecols] = df[datecols].apply(pd.to_datetime)
@@ -633,13 +752,33 @@ def reformat_columns(df: pd.DataFrame, datecols: Union[list, None]) -> pd.DataFr
     return df
 
 
-@st.cache_data(ttl=3600)
-def load_flipside_api_data(url: str, datecols: Union[list, None]) -> pd.DataFrame:
-    df = pd.read_json(url)
+@st.cache_data(max_entries=200)
+def _load_flipside_api_snapshot(url: str, datecols: Union[list, None], version: str) -> pd.DataFrame:
+    """Cached per snapshot `version`, so a refreshed snapshot is picked up on the next rerun"""
+    df = api_snapshots.read_snapshot(url)
     df = reformat_columns(df, datecols)
     return df
 
 
+def load_flipside_api_data(url: str, datecols: Union[list, None]) -> pd.DataFrame:
+    """The latest good snapshot of a Flipside API endpoint; stale ones are refreshed in the background"""
+    version = api_snapshots.get_versions([url])[url]
+    return _load_flipside_api_snapshot(url, datecols, version)
+
+
+def load_flipside_api_data_dict(query_dict: Dict[str, dict]) -> Dict[str, pd.DataFrame]:
+    """`load_flipside_api_data` for every `{"api": url, "datecols": cols}` in `query_dict`, keeping its keys.
+
+    Endpoints without a snapshot yet are all downloaded at once, so a cold load waits about as long as
+    the slowest endpoint rather than the sum of them.
+    """
+    versions = api_snapshots.get_versions([v["api"] for v in query_dict.values()])
+    return {
+        k: _load_flipside_api_snapshot(v["api"], v["datecols"], versions[v["api"]])
+        for k, v in query_dict.items()
+    }
+
+
 @st.cache_data(ttl=3600 * 6)
 def run_query_and_cache(name, sql, param, force_update=False):
     today = datetime.date.today()
@@ -705,11 +844,14 @@ def get_bonk_balance(address):
         return
 
 
+async def _get_fee_stats(dates) -> List[dict]:
+    async with http_client.AsyncHttp() as http:
+        urls = [f"https://api.solana.fm/v0/stats/tx-fees?date={d.strftime('%d-%m-%Y')}" for d in dates]
+        return await asyncio.gather(*[http.get_json(x) for x in urls])
+
+
 def load_fees(dates):
-    data = []
-    for d in dates:
-        r = requests.get(f"https://api.solana.fm/v0/stats/tx-fees?date={d.strftime('%d-%m-%Y')}")
-        data.append(r.json()["result"])
+    data = [x["result"] for x in asyncio.run(_get_fee_stats(dates))]
 
     fees = pd.DataFrame(data)
     fees["Date"] = pd.to_datetime(fees.date, dayfirst=True)
@@ -735,31 +877,37 @@ def get_native_balances(address):
     return bal["nativeBalance"] / LAMPORTS_PER_SOL
 
 
-async def lookup_xnft(xnft: str) -> Xnft:
-    conn = AsyncClient(rpc_url)
-    xnft_id = solders.pubkey.Pubkey.from_string(xnft)
-    return await Xnft.fetch(conn, xnft_id)
-
-
-def get_xnft_info(xnfts: Iterable[str]) -> dict:
-    data = {}
-    for x in xnfts:
-        data[x] = asyncio.run(lookup_xnft(x)).to_json()
-    return data
-
-
-def create_xnft_info_df(xnft_info: Dict[str, dict]) -> pd.DataFrame:
-    xnft_info_df = pd.DataFrame(xnft_info).T
-    xnft_info_df["XNFT"] = xnft_info_df.index
-    xnft_info_df = xnft_info_df.reset_index(drop=True)
-    xnft_info_df["kind"] = xnft_info_df["kind"].apply(lambda x: x["kind"])
-    xnft_info_df["tag"] = xnft_info_df["tag"].apply(lambda x: x["kind"])
-    xnft_info_df["created_datetime"] = xnft_info_df["created_ts"].apply(
-        lambda x: datetime.datetime.fromtimestamp(x).isoformat(sep=" ")
-    )
-    xnft_info_df["updated_datetime"] = xnft_info_df["updated_ts"].apply(
-        lambda x: datetime.datetime.fromtimestamp(x).isoformat(sep=" ")
-    )
+async def lookup_xnfts(
+    xnfts: List[str], batch_size: int = 100, max_concurrency: int = 4
+) -> List[Optional[bytes]]:
+    """Raw data of xNFT accounts over one client, with a `getMultipleAccounts` call per `batch_size` pubkeys"""
+    pubkeys = [solders.pubkey.Pubkey.from_string(x) for x in xnfts]
+    async with AsyncClient(rpc_url) as conn:
+        return await xnft_snapshot.fetch_accounts(conn, pubkeys, batch_size, max_concurrency)
+
+
+def get_xnft_info(xnfts: Iterable[str]) -> pd.DataFrame:
+    """One row per xNFT account, decoded column-wise, with the address in `address`"""
+    xnfts = list(xnfts)
+    accounts = []
+    for x, data in zip(xnfts, asyncio.run(lookup_xnfts(xnfts))):
+        if data is None:
+            logging.info(f"[ERROR] xNFT account {x} not found")
+            continue
+        accounts.append((x, data))
+    return xnft_snapshot.decode_accounts(accounts, "xnft")
+
+
+def create_xnft_info_df(xnft_info: pd.DataFrame) -> pd.DataFrame:
+    xnft_info_df = xnft_info.rename(columns={"address": "XNFT"})
+    xnft_info_df = xnft_info_df[[*xnft_info_df.columns.drop("XNFT"), "XNFT"]].reset_index(drop=True)
+    for x in ["created", "updated"]:
+        # Local time, like `datetime.datetime.fromtimestamp`
+        xnft_info_df[f"{x}_datetime"] = (
+            pd.to_datetime(xnft_info_df[f"{x}_ts"].astype(np.int64), unit="s", utc=True)
+            .dt.tz_convert(dateutil.tz.tzlocal())
+            .dt.strftime("%Y-%m-%d %H:%M:%S")
+        )
     return xnft_info_df
 
 
@@ -782,31 +930,13 @@ def get_xnft_contacts(contact: dict) -> dict:
     return d
 
 
-def get_uri_info(uri: str) -> dict:
-    url = resolve_ipfs_uri(uri)
+def get_uri_info(uri: str, data: Optional[dict] = None) -> dict:
+    """Description, image and contacts from an xNFT's metadata json, fetched from `uri` unless given"""
+    if data is None:
+        data = ipfs.fetch_json([uri])[uri]
     info = {"uri": uri}
-    if "ipfs" in url:
-        time.sleep(np.random.randint(2, 10))
-        try:
-            data = requests.get(url).json()
-        except:
-            logging.warning(f"Request failed for: {url} -- Retrying in 30s")
-            time.sleep(30)
-            try:
-                data = requests.get(url).json()
-            except:
-                logging.warning(f"Request failed for: {url} -- Retrying in 60s with alternate resolver")
-                time.sleep(60)
-                try:
-                    url = resolve_ipfs_uri(uri, use_alternate=True)
-                    data = requests.get(url).json()
-                except:
-                    return info
-    else:
-        try:
-            data = requests.get(url).json()
-        except:
-            return info
+    if data is None:
+        return info
     info["description"] = data["description"]
     info["image"] = resolve_ipfs_uri(data["image"])
     try:
@@ -826,11 +956,8 @@ def get_uri_info(uri: str) -> dict:
 
 
 def add_uri_info(xnft_info: pd.DataFrame) -> pd.DataFrame:
-    # TODO: better caching
-    data = []
-    for x in xnft_info.uri.unique():
-        data.append(get_uri_info(x))
-    uri_info = pd.DataFrame(data)
+    uri_data = ipfs.fetch_json(xnft_info.uri.unique())
+    uri_info = pd.DataFrame([get_uri_info(k, v) for k, v in uri_data.items()])
     df = xnft_info.copy().merge(uri_info, on="uri")
     return df
 
@@ -843,10 +970,22 @@ def load_xnft_data():
     return df
 
 
+def get_xnft_dataset():
+    """Handle of `load_xnft_data`'s frame"""
+    return datasets.from_files(
+        "data/xnft_create_install_all_info.csv", ["data/xnft_create_install_all_info.csv"]
+    )
+
+
 # def grouping_with_other(x):
 #     if
 @st.cache_data(ttl=3600)
-def aggregate_xnft_data(df, n=15):
+@disk_cache.persist(ttl=3600)
+def aggregate_xnft_data(_df, dataset, date_range, n=15):
+    df = _df[
+        _df["Block Timestamp"]
+        >= (pd.to_datetime(datetime.datetime.today()) - pd.Timedelta(f"{int(date_range[:-1])}d"))
+    ].copy()
     total_counts = (
         df.groupby(["Xnft", "Mint Seed Name"])["Tx Id"]
         .count()
@@ -889,77 +1028,31 @@ def aggregate_xnft_data(df, n=15):
 def get_backpack_usernames(
     addresses: Iterable, address_key="Collector", username_key="Username"
 ) -> pd.DataFrame:
-    df = pd.read_csv("data/backpack_info.csv")
-    cached = dict(zip(df.address.values, df.user.values))
-    new_entries = []
-    output = []
-    for x in addresses:
-        if x in cached.keys():
-            username = cached[x]
-        else:
-            username = get_backpack_username(x)
-            if username is not None:
-                new_entries.append({"user": username, "address": x})
-        output.append({address_key: x, username_key: username})
-    if new_entries != []:
-        df = pd.concat([df, pd.DataFrame(new_entries)], ignore_index=True)
-        df.to_csv("data/backpack_info.csv", index=False)
-    return pd.DataFrame(output)
+    addresses = list(addresses)
+    usernames = backpack.resolve_usernames(addresses)
+    return pd.DataFrame({address_key: addresses, username_key: [usernames.get(x) for x in addresses]})
 
 
 @st.cache_data(ttl=3600 * 24)
 def get_backpack_username(x):
-    if x == "":
-        return ""
-    try:
-        url = "https://xnft-api-server.xnfts.dev/v1/users/fromPubkey"
-        r = requests.get(url, params={"publicKey": x, "blockchain": "solana"})
-        j = r.json()
-        username = j["user"]["username"]
-    except KeyError:
-        return None
-    return username
+    return backpack.resolve_usernames([x]).get(x)
 
 
 @st.cache_data(ttl=3600 * 24)
 def get_backpack_addresses(
     usernames: Iterable, address_key="Collector", username_key="Username"
 ) -> pd.DataFrame:
-    df = pd.read_csv("data/backpack_info.csv")
-    cached = dict(zip(df.user.values, df.address.values))
-    new_entries = []
-    output = []
-    for x in usernames:
-        if x in cached.keys():
-            address = cached[x]
-        else:
-            address = get_backpack_address(x)
-            if address is not None:
-                new_entries.append({"user": x, "address": address})
-        output.append({address_key: address, username_key: x})
-    df = pd.concat([df, pd.DataFrame(new_entries)], ignore_index=True)
-    df.to_csv("data/backpack_info.csv", index=False)
-    return pd.DataFrame(output)
+    usernames = list(usernames)
+    addresses = backpack.resolve_addresses(usernames)
+    return pd.DataFrame({address_key: [addresses.get(x) for x in usernames], username_key: usernames})
 
 
 @st.cache_data(ttl=3600 * 24)
 def get_backpack_address(username):
-    if username == "":
-        return ""
-    try:
-        url = "https://xnft-api-server.xnfts.dev/v1/users/fromUsername"
-        r = requests.get(url, params={"username": username})
-        j = r.json()
-        addresses = j["user"]["public_keys"]
-        for x in addresses:
-            if x["blockchain"] == "solana":
-                address = x["public_key"]
-    except KeyError:
-        return None
-    return address
+    return backpack.resolve_addresses([username]).get(username)
 
 
-@st.cache_data(ttl=3600 * 24)
+# Not cached itself, the usernames are cached by address in `get_backpack_usernames`
 def add_backpack_username(df, address_col, username_col="Username"):
     df[username_col] = get_backpack_usernames(df[address_col].values)[username_col].values
     return df
@@ -1015,10 +1108,16 @@ def load_defi_data():
     return dex_info, dex_new_user, dex_signers_fee_payers
 
 
+def get_defi_dataset():
+    """Handle of `load_defi_data`'s `dex_info`"""
+    return datasets.from_files("data/dex_info.csv", ["data/dex_info.csv"])
+
+
 @st.cache_data(ttl=3600)
-def agg_defi_data(df, date_range):
-    chart_df = df.copy()[
-        df["Date"] >= (pd.to_datetime(datetime.datetime.today()) - pd.Timedelta(f"{int(date_range[:-1])}d"))
+@disk_cache.persist(ttl=3600)
+def agg_defi_data(_df, dataset, date_range):
+    chart_df = _df.copy()[
+        _df["Date"] >= (pd.to_datetime(datetime.datetime.today()) - pd.Timedelta(f"{int(date_range[:-1])}d"))
     ]
 
     top_dex_tx = chart_df.groupby(["Dex"]).Txs.sum().sort_values(ascending=False).reset_index()
@@ -1082,9 +1181,10 @@ def add_rarity_data(df, rarity_df="data/madlads_rarity.csv", on="Mint", how="inn
 
 
 @st.cache_data(ttl=3600)
+@disk_cache.persist(files=_output_files("data/staking_combined.csv.gz"))
 def load_staker_data():
     # TODO: move to combine_data
-    df = pd.read_csv("data/staking_combined.csv.gz", low_memory=False)
+    df = store.read_output("data/staking_combined.csv.gz", low_memory=False)
     df = reformat_columns(df, ["DATE"])
     df = (
         df[["Date"] + df.columns.drop("Date").to_list()]
@@ -1093,6 +1193,12 @@ def load_staker_data():
     )
     return df
 
+
+def get_staker_dataset():
+    """Handle of `load_staker_data`'s frame"""
+    return datasets.from_files("data/staking_combined.csv.gz", _output_files("data/staking_combined.csv.gz"))
+
+
 @st.cache_data(ttl=3600)
 def load_staker_interaction_data():
     df = pd.read_csv("data/top_staker_interactions.csv", low_memory=False)
@@ -1106,8 +1212,10 @@ def load_staker_interaction_data():
 
 
 @st.cache_data(ttl=3600)
+@disk_cache.persist(ttl=3600)
 def get_stakers_chart_data(
-    df,
+    _df,
+    dataset,
     date_range,
     exclude_foundation,
     exclude_labeled,
@@ -1115,7 +1223,7 @@ def get_stakers_chart_data(
     user_type,
     token,
 ):
-    chart_df = df.copy()[df.Date >= (datetime.datetime.today() - pd.Timedelta(date_range))]
+    chart_df = _df.copy()[_df.Date >= (datetime.datetime.today() - pd.Timedelta(date_range))]
 
     if exclude_foundation:
         chart_df = chart_df[chart_df["Address Name"] != "Solana Foundation Delegation Account"]
@@ -1146,11 +1254,15 @@ def get_stakers_chart_data(
 
 
 @st.cache_data(ttl=3600)
+@disk_cache.persist(
+    files=_output_files("data/liquid_staking_token_holders.csv.gz")
+    + _output_files("data/liquid_staking_token_holders_delta.csv")
+)
 def load_lst(filled=True):
     if filled:
-        df = pd.read_csv("data/liquid_staking_token_holders.csv.gz")
+        df = store.read_output("data/liquid_staking_token_holders.csv.gz")
     else:
-        df = pd.read_csv("data/liquid_staking_token_holders_delta.csv")
+        df = store.read_output("data/liquid_staking_token_holders_delta.csv")
     df = reformat_columns(df, ["DATE"])
     df = df.sort_values(by=["Address", "Token", "Date"])
     return df
@@ -0,0 +1,164 @@
+"""Snapshot of every account owned by the xNFT program, one filtered `getProgramAccounts` call per type"""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import asyncio
+import logging
+from pathlib import Path
+
+import based58
+import pandas as pd
+from anchorpy.coder.accounts import ACCOUNT_DISCRIMINATOR_SIZE
+from anchorpy.error import AccountInvalidDiscriminator
+from solana.rpc.async_api import AsyncClient
+from solana.rpc.types import MemcmpOpts
+from solders.pubkey import Pubkey
+
+from . import borsh_columns
+from .borsh_columns import PUBKEY, STRING
+from .xnft.accounts import Access, Install, Review, Xnft
+from .xnft.program_id import PROGRAM_ID
+
+__all__ = [
+    "ACCOUNT_LAYOUTS",
+    "ACCOUNT_TYPES",
+    "XNFT_SNAPSHOT_DIR",
+    "decode_accounts",
+    "fetch_accounts",
+    "fetch_program_accounts",
+    "get_snapshot",
+    "get_snapshot_async",
+    "read_snapshot",
+    "write_snapshot",
+]
+
+XNFT_SNAPSHOT_DIR = Path("data/xnft_snapshot")
+ACCOUNT_TYPES = {
+    "xnft": Xnft,
+    "install": Install,
+    "review": Review,
+    "access": Access,
+}
+# The generated `layout`s of the account classes, for `borsh_columns.decode_columns`; padding is dropped
+ACCOUNT_LAYOUTS = {
+    "xnft": [
+        ("publisher", PUBKEY),
+        ("install_vault", PUBKEY),
+        ("master_metadata", PUBKEY),
+        ("master_mint", PUBKEY),
+        ("install_authority", ("option", PUBKEY)),
+        ("curator", ("option", [("curator", PUBKEY), ("curator_verified", "?")])),
+        ("uri", STRING),
+        ("mint_seed_name", ("option", STRING)),
+        ("kind", ("enum", ["App", "Collectible"])),
+        ("tag", ("enum", ["None", "Defi", "Game", "Nfts"])),
+        ("supply", ("option", "<u8")),
+        ("total_installs", "<u8"),
+        ("install_price", "<u8"),
+        ("created_ts", "<i8"),
+        ("updated_ts", "<i8"),
+        ("total_rating", "<u8"),
+        ("num_ratings", "<u4"),
+        ("suspended", "?"),
+        ("bump", ("pad", 1)),
+        ("reserved0", ("pad", 64)),
+        ("reserved1", ("pad", 24)),
+        ("reserved2", ("pad", 9)),
+    ],
+    "install": [
+        ("authority", PUBKEY),
+        ("xnft", PUBKEY),
+        ("master_metadata", PUBKEY),
+        ("edition", "<u8"),
+        ("reserved", ("pad", 64)),
+    ],
+    "review": [
+        ("author", PUBKEY),
+        ("xnft", PUBKEY),
+        ("rating", "u1"),
+        ("uri", STRING),
+        ("reserved", ("pad", 32)),
+    ],
+    "access": [
+        ("wallet", PUBKEY),
+        ("xnft", PUBKEY),
+        ("bump", ("pad", 1)),
+        ("reserved", ("pad", 32)),
+    ],
+}
+
+RawAccounts = List[Tuple[Pubkey, bytes]]
+
+
+async def fetch_program_accounts(
+    conn: AsyncClient, account_cls, program_id: Pubkey = PROGRAM_ID
+) -> RawAccounts:
+    """`(pubkey, data)` of every `account_cls` account, selected by its 8 byte discriminator"""
+    discriminator = based58.b58encode(account_cls.discriminator).decode()
+    resp = await conn.get_program_accounts(
+        program_id, encoding="base64", filters=[MemcmpOpts(offset=0, bytes=discriminator)]
+    )
+    return [(x.pubkey, x.account.data) for x in resp.value]
+
+
+async def fetch_accounts(
+    conn: AsyncClient, pubkeys: List[Pubkey], batch_size: int = 100, max_concurrency: int = 4
+) -> List[Optional[bytes]]:
+    """Data of each of `pubkeys` (None if it doesn't exist), with a `getMultipleAccounts` call per batch"""
+    batches = [pubkeys[i : i + batch_size] for i in range(0, len(pubkeys), batch_size)]
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(batch):
+        async with semaphore:
+            resp = await conn.get_multiple_accounts(batch, encoding="base64")
+        return [None if x is None else x.data for x in resp.value]
+
+    results = await asyncio.gather(*[fetch(x) for x in batches])
+    return [x for batch in results for x in batch]
+
+
+def decode_accounts(accounts: RawAccounts, name: str) -> pd.DataFrame:
+    """One row per account of type `name`, with the address in `address`"""
+    account_cls = ACCOUNT_TYPES[name]
+    data = [x for _, x in accounts]
+    bad = [i for i, x in enumerate(data) if x[:ACCOUNT_DISCRIMINATOR_SIZE] != account_cls.discriminator]
+    if bad:
+        raise AccountInvalidDiscriminator(f"{len(bad)} accounts are not {account_cls.__name__} accounts")
+    df = borsh_columns.decode_columns(data, ACCOUNT_LAYOUTS[name], offset=ACCOUNT_DISCRIMINATOR_SIZE)
+    df.insert(0, "address", [str(x) for x, _ in accounts])
+    return df
+
+
+async def get_snapshot_async(
+    rpc_url: str, account_types: Optional[List[str]] = None
+) -> Dict[str, pd.DataFrame]:
+    account_types = list(ACCOUNT_TYPES) if account_types is None else account_types
+    async with AsyncClient(rpc_url, timeout=120) as conn:
+        results = await asyncio.gather(
+            *[fetch_program_accounts(conn, ACCOUNT_TYPES[x]) for x in account_types]
+        )
+    tables = {}
+    for name, accounts in zip(account_types, results):
+        tables[name] = decode_accounts(accounts, name)
+        logging.info(f"#@# Decoded {len(tables[name])} xNFT {name} accounts")
+    return tables
+
+
+def get_snapshot(rpc_url: str, account_types: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+    """Every `Xnft`, `Install`, `Review` and `Access` account (or just `account_types`), as a table each"""
+    return asyncio.run(get_snapshot_async(rpc_url, account_types))
+
+
+def write_snapshot(
+    tables: Dict[str, pd.DataFrame], snapshot_dir: Union[str, Path] = XNFT_SNAPSHOT_DIR
+) -> None:
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in tables.items():
+        df.to_parquet(Path(snapshot_dir, f"{name}.parquet"), index=False)
+
+
+def read_snapshot(
+    name: str, snapshot_dir: Union[str, Path] = XNFT_SNAPSHOT_DIR, columns=None
+) -> pd.DataFrame:
+    return pd.read_parquet(Path(snapshot_dir, f"{name}.parquet"), columns=columns)